@@ -8,23 +8,42 @@ from flask import (
     session,
     jsonify,
     current_app,
+    abort,
 )
 import sqlite3
 import os
 import base64
-from io import BytesIO
-from PIL import Image
 import json
 import datetime
 
 # ===== Extra imports for Workout Analyzer =====
+import re
 import uuid
-import cv2
-import numpy as np
-import mediapipe as mp
+import math
+import atexit
+from pose_engine import analyze_video, warm_pose_pool
+from landmark_cache import LandmarkCache
+from video_sinks import HLS_PLAYLIST
+from media_serving import send_media
+from video_uploads import UploadRejected, save_video_upload, streaming_upload_request
+from werkzeug.exceptions import RequestEntityTooLarge
+from rep_counters import FORM_COUNTERS, SIMPLE_COUNTERS
+from workout_jobs import InputPins, WorkoutJobQueue, JobQueueFull
+from storage_manager import StorageManager, StoragePool, megabytes, days
+from live_session import serve_live_socket
+from rep_events import encode_rep_log, rep_log_series, summarize_reps
+from nutrition_cache import NutritionCache, image_digest
+from frame_dedup import LiveFrameDeduper
+from vision_images import normalize_image
+from vision_gateway import ModelsUnavailable, VisionGateway, VisionTimeout
+
+try:
+    from flask_sock import Sock  # live workout mode (WebSocket)
+except ImportError:
+    Sock = None
 
 # ==== OpenAI ====
-from openai import OpenAI, OpenAIError
+from openai import OpenAIError
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"  # move to env in production
@@ -43,7 +62,29 @@ if not OPENAI_API_KEY:
 client_kwargs = {"api_key": OPENAI_API_KEY}
 if OPENAI_PROJECT:
     client_kwargs["project"] = OPENAI_PROJECT
-client = OpenAI(**client_kwargs)
+
+# Vision calls run on a background asyncio loop with one pooled client
+# (see vision_gateway.py): deadline per request, bounded concurrency,
+# and optionally a hedged request to the fallback model (0 = off).
+# When every slot stays busy for VISION_QUEUE_TIMEOUT_SECONDS the call
+# fails fast with 503 instead of holding the web worker.
+# Per-model circuit breakers: a model without access is skipped for
+# VISION_MODEL_UNAVAILABLE_SECONDS; rate limits and repeated errors back
+# off exponentially from VISION_BREAKER_COOLDOWN_SECONDS
+vision_gateway = VisionGateway(
+    client_kwargs,
+    deadline=float(os.getenv("VISION_DEADLINE_SECONDS", "15")),
+    max_concurrency=int(os.getenv("VISION_MAX_CONCURRENCY", "8")),
+    queue_timeout=float(os.getenv("VISION_QUEUE_TIMEOUT_SECONDS", "2")),
+    hedge_after=float(os.getenv("VISION_HEDGE_AFTER_SECONDS", "0")),
+    breaker_options={
+        "failures": int(os.getenv("VISION_BREAKER_FAILURES", "3")),
+        "cooldown": float(os.getenv("VISION_BREAKER_COOLDOWN_SECONDS", "15")),
+        "max_cooldown": float(os.getenv("VISION_BREAKER_MAX_COOLDOWN_SECONDS", "600")),
+        "unavailable_for": float(os.getenv("VISION_MODEL_UNAVAILABLE_SECONDS", "600")),
+    },
+)
+atexit.register(vision_gateway.close)
 
 # ---------- Workout folders ----------
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -52,378 +93,135 @@ WORKOUT_OUTPUT_FOLDER = os.path.join(BASE_DIR, "static", "workouts")
 os.makedirs(WORKOUT_UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(WORKOUT_OUTPUT_FOLDER, exist_ok=True)
 
-# ---------- Mediapipe setup ----------
-mp_drawing = mp.solutions.drawing_utils
-mp_pose = mp.solutions.pose
-
-
-# =========================================================
-# Helper: angle + analyzer functions for workouts
-# =========================================================
-def calculate_angle(a, b, c):
-    """
-    Calculates the angle (in degrees) at point b given three points a, b, c.
-    Each point is (x, y).
-    """
-    a = np.array(a, dtype=np.float32)
-    b = np.array(b, dtype=np.float32)
-    c = np.array(c, dtype=np.float32)
-
-    ba = a - b
-    bc = c - b
-
-    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc) + 1e-8)
-    cosine_angle = np.clip(cosine_angle, -1.0, 1.0)
-    angle = np.degrees(np.arccos(cosine_angle))
-    return float(angle)
-
-
-def _analyze_pushup(video_path, output_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        return 0, None
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    fps = cap.get(cv2.CAP_PROP_FPS) or 25
-    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 640)
-    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 480)
-    out = cv2.VideoWriter(output_path, fourcc, fps, (w, h))
-
-    counter = 0
-    stage = None
-
-    with mp_pose.Pose(min_detection_confidence=0.5,
-                      min_tracking_confidence=0.5) as pose:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image.flags.writeable = False
-            results = pose.process(image)
-
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-            try:
-                landmarks = results.pose_landmarks.landmark
-                shoulder = landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value]
-                elbow = landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW.value]
-                wrist = landmarks[mp_pose.PoseLandmark.RIGHT_WRIST.value]
-
-                shoulder_c = [shoulder.x * w, shoulder.y * h]
-                elbow_c = [elbow.x * w, elbow.y * h]
-                wrist_c = [wrist.x * w, wrist.y * h]
-
-                angle = calculate_angle(shoulder_c, elbow_c, wrist_c)
-
-                if angle > 160:
-                    stage = "up"
-                if angle < 90 and stage == "up":
-                    stage = "down"
-                    counter += 1
-
-                cv2.putText(
-                    image,
-                    f"Elbow angle: {int(angle)}",
-                    (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.7,
-                    (255, 0, 255),
-                    2,
-                )
-
-            except Exception:
-                pass
-
-            if results.pose_landmarks:
-                mp_drawing.draw_landmarks(
-                    image,
-                    results.pose_landmarks,
-                    mp_pose.POSE_CONNECTIONS,
-                    mp_drawing.DrawingSpec(color=(255, 0, 255), thickness=2, circle_radius=2),
-                    mp_drawing.DrawingSpec(color=(0, 255, 255), thickness=2, circle_radius=2),
-                )
-
-            cv2.putText(
-                image,
-                f"Push-ups: {counter}",
-                (10, h - 20),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.9,
-                (255, 0, 255),
-                2,
-            )
-
-            out.write(image)
-
-    cap.release()
-    out.release()
-    return counter, output_path
-
-
-def _analyze_squat(video_path, output_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        return 0, None
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    fps = cap.get(cv2.CAP_PROP_FPS) or 25
-    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 640)
-    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 480)
-    out = cv2.VideoWriter(output_path, fourcc, fps, (w, h))
-
-    counter = 0
-    stage = None
-
-    with mp_pose.Pose(min_detection_confidence=0.5,
-                      min_tracking_confidence=0.5) as pose:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image.flags.writeable = False
-            results = pose.process(image)
-
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-            try:
-                landmarks = results.pose_landmarks.landmark
-                hip = landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value]
-                knee = landmarks[mp_pose.PoseLandmark.RIGHT_KNEE.value]
-                ankle = landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value]
-
-                hip_c = [hip.x * w, hip.y * h]
-                knee_c = [knee.x * w, knee.y * h]
-                ankle_c = [ankle.x * w, ankle.y * h]
-
-                angle = calculate_angle(hip_c, knee_c, ankle_c)
-
-                if angle > 160:
-                    stage = "up"
-                if angle < 100 and stage == "up":
-                    stage = "down"
-                    counter += 1
-
-                cv2.putText(
-                    image,
-                    f"Knee angle: {int(angle)}",
-                    (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.7,
-                    (255, 0, 255),
-                    2,
-                )
-
-            except Exception:
-                pass
-
-            if results.pose_landmarks:
-                mp_drawing.draw_landmarks(
-                    image,
-                    results.pose_landmarks,
-                    mp_pose.POSE_CONNECTIONS,
-                    mp_drawing.DrawingSpec(color=(255, 0, 255), thickness=2, circle_radius=2),
-                    mp_drawing.DrawingSpec(color=(0, 255, 255), thickness=2, circle_radius=2),
-                )
-
-            cv2.putText(
-                image,
-                f"Squats: {counter}",
-                (10, h - 20),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.9,
-                (255, 0, 255),
-                2,
-            )
-
-            out.write(image)
-
-    cap.release()
-    out.release()
-    return counter, output_path
-
-
-def _analyze_pullup(video_path, output_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        return 0, None
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    fps = cap.get(cv2.CAP_PROP_FPS) or 25
-    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 640)
-    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 480)
-    out = cv2.VideoWriter(output_path, fourcc, fps, (w, h))
-
-    counter = 0
-    stage = None
-
-    with mp_pose.Pose(min_detection_confidence=0.5,
-                      min_tracking_confidence=0.5) as pose:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image.flags.writeable = False
-            results = pose.process(image)
-
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-            try:
-                landmarks = results.pose_landmarks.landmark
-                shoulder = landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value]
-                elbow = landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW.value]
-                wrist = landmarks[mp_pose.PoseLandmark.RIGHT_WRIST.value]
-
-                shoulder_c = [shoulder.x * w, shoulder.y * h]
-                elbow_c = [elbow.x * w, elbow.y * h]
-                wrist_c = [wrist.x * w, wrist.y * h]
-
-                angle = calculate_angle(shoulder_c, elbow_c, wrist_c)
-
-                if angle > 150:
-                    stage = "down"
-                if angle < 80 and stage == "down":
-                    stage = "up"
-                    counter += 1
-
-                cv2.putText(
-                    image,
-                    f"Arm angle: {int(angle)}",
-                    (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.7,
-                    (255, 0, 255),
-                    2,
-                )
-
-            except Exception:
-                pass
-
-            if results.pose_landmarks:
-                mp_drawing.draw_landmarks(
-                    image,
-                    results.pose_landmarks,
-                    mp_pose.POSE_CONNECTIONS,
-                    mp_drawing.DrawingSpec(color=(255, 0, 255), thickness=2, circle_radius=2),
-                    mp_drawing.DrawingSpec(color=(0, 255, 255), thickness=2, circle_radius=2),
-                )
-
-            cv2.putText(
-                image,
-                f"Pull-ups: {counter}",
-                (10, h - 20),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.9,
-                (255, 0, 255),
-                2,
-            )
-
-            out.write(image)
-
-    cap.release()
-    out.release()
-    return counter, output_path
-
-
-def _analyze_jumping_jack(video_path, output_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        return 0, None
+# ---------- Vision result cache (see nutrition_cache.py) ----------
+# Same photo + model -> stored result instead of another API call.
+# TTL in hours, size in entries; 0 disables either bound.
+nutrition_cache = NutritionCache(
+    os.getenv("NUTRITION_CACHE_DB", os.path.join(BASE_DIR, "nutrition_cache.db")),
+    ttl=float(os.getenv("NUTRITION_CACHE_TTL_HOURS", "720")) * 3600,
+    max_entries=int(os.getenv("NUTRITION_CACHE_MAX_ENTRIES", "5000")),
+)
 
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    fps = cap.get(cv2.CAP_PROP_FPS) or 25
-    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 640)
-    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 480)
-    out = cv2.VideoWriter(output_path, fourcc, fps, (w, h))
+# Live camera: frames within LIVE_FRAME_DEDUP_BITS (of a 64-bit perceptual
+# hash) of the session's last analyzed frame reuse its result for up to
+# LIVE_FRAME_DEDUP_SECONDS (see frame_dedup.py); 0 bits = identical hashes only
+live_frames = LiveFrameDeduper(
+    method=os.getenv("LIVE_FRAME_HASH", "dhash"),
+    threshold=int(os.getenv("LIVE_FRAME_DEDUP_BITS", "6")),
+    max_age=float(os.getenv("LIVE_FRAME_DEDUP_SECONDS", "60")),
+)
 
-    counter = 0
-    stage = None
+# Images sent to the vision model: longest side capped, EXIF stripped,
+# re-encoded as JPEG at this quality (see vision_images.py)
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "768"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "80"))
+
+# "hls": annotated videos are written as HLS segments + playlist while the
+# job runs, so playback can start early; "mp4": one file when done.
+# (hls needs ffmpeg and falls back to mp4 without it, see video_sinks.py)
+WORKOUT_OUTPUT_FORMAT = os.getenv("WORKOUT_OUTPUT_FORMAT", "hls").lower()
+
+# Workout videos are streamed straight into the upload folder and probed
+# from their first bytes (see video_uploads.py); 0 disables the size cap
+WORKOUT_MAX_UPLOAD_MB = int(os.getenv("WORKOUT_MAX_UPLOAD_MB", "500"))
+app.config["MAX_CONTENT_LENGTH"] = WORKOUT_MAX_UPLOAD_MB * 1024 * 1024 or None
+app.request_class = streaming_upload_request(WORKOUT_UPLOAD_FOLDER, {"upload_workout"})
+
+# Per-video pose landmarks, keyed by upload content hash
+WORKOUT_LANDMARK_FOLDER = os.path.join(WORKOUT_UPLOAD_FOLDER, "landmarks")
+landmark_cache = LandmarkCache(WORKOUT_LANDMARK_FOLDER)
+
+# ---------- Storage retention (see storage_manager.py) ----------
+# Raw uploads are deleted once their landmarks are cached unless
+# WORKOUT_KEEP_UPLOADS=1. Quotas are in MB / days; 0 disables one.
+# Uploads used by queued / running jobs are pinned and never evicted.
+WORKOUT_KEEP_UPLOADS = os.getenv("WORKOUT_KEEP_UPLOADS", "0") == "1"
+workout_inputs = InputPins()
+storage = StorageManager(
+    [
+        StoragePool(
+            "workout_uploads",
+            WORKOUT_UPLOAD_FOLDER,
+            max_bytes=megabytes(os.getenv("WORKOUT_UPLOAD_QUOTA_MB", "4096")),
+            max_age=days(os.getenv("WORKOUT_UPLOAD_MAX_AGE_DAYS", "2")),
+            exclude={"landmarks"},
+            pinned=workout_inputs,
+        ),
+        StoragePool(
+            "workout_outputs",
+            WORKOUT_OUTPUT_FOLDER,
+            max_bytes=megabytes(os.getenv("WORKOUT_OUTPUT_QUOTA_MB", "2048")),
+            max_age=days(os.getenv("WORKOUT_OUTPUT_MAX_AGE_DAYS", "7")),
+        ),
+        StoragePool(
+            "landmarks",
+            WORKOUT_LANDMARK_FOLDER,
+            max_bytes=megabytes(os.getenv("LANDMARK_CACHE_QUOTA_MB", "1024")),
+            max_age=days(os.getenv("LANDMARK_CACHE_MAX_AGE_DAYS", "90")),
+        ),
+    ],
+    interval=float(os.getenv("STORAGE_SWEEP_SECONDS", "600")),
+)
 
-    with mp_pose.Pose(min_detection_confidence=0.5,
-                      min_tracking_confidence=0.5) as pose:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
 
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image.flags.writeable = False
-            results = pose.process(image)
+@app.before_request
+def _start_storage_sweeps():
+    # started lazily so job worker processes importing this module don't sweep
+    storage.start()
 
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+# Analysis jobs run in worker processes, each with a warm Pose graph;
+# finished jobs are logged for the progress page (_log_workout_job)
+workout_jobs = WorkoutJobQueue(
+    initializer=warm_pose_pool,
+    initargs=({},),
+    on_done=lambda job: _log_workout_job(job),
+    pins=workout_inputs,
+)
+atexit.register(workout_jobs.shutdown)
+
+# ---------- Pose inference settings ----------
+# Rep counting doesn't need the source frame rate or resolution:
+# infer at ~15 fps on frames whose longest side is capped (0 disables).
+WORKOUT_ANALYSIS_FPS = float(os.getenv("WORKOUT_ANALYSIS_FPS", "15"))
+WORKOUT_MAX_INFERENCE_SIDE = int(os.getenv("WORKOUT_MAX_INFERENCE_SIDE", "640"))
+# Long uploads: infer time segments in this many processes (0 = off),
+# see POSE_SEGMENT_SECONDS / POSE_SEGMENT_OVERLAP in pose_engine.py
+WORKOUT_SEGMENT_WORKERS = int(os.getenv("WORKOUT_SEGMENT_WORKERS", "0"))
+WORKOUT_ENGINE_OPTIONS = {
+    "analysis_fps": WORKOUT_ANALYSIS_FPS or None,
+    "max_inference_side": WORKOUT_MAX_INFERENCE_SIDE or None,
+    "segment_workers": WORKOUT_SEGMENT_WORKERS,
+}
 
-            try:
-                landmarks = results.pose_landmarks.landmark
-                l_ankle = landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value]
-                r_ankle = landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value]
-
-                l_wrist = landmarks[mp_pose.PoseLandmark.LEFT_WRIST.value]
-                r_wrist = landmarks[mp_pose.PoseLandmark.RIGHT_WRIST.value]
-
-                # distances in pixels
-                feet_dist = abs((l_ankle.x - r_ankle.x) * w)
-                hands_dist = abs((l_wrist.y - r_wrist.y) * h)
-
-                if feet_dist < 0.1 * w and hands_dist > 0.6 * h:
-                    stage = "down"  # arms down, feet together
-                if feet_dist > 0.2 * w and hands_dist < 0.4 * h and stage == "down":
-                    stage = "up"
-                    counter += 1
-
-                cv2.putText(
-                    image,
-                    f"Jacks: {counter}",
-                    (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.7,
-                    (255, 0, 255),
-                    2,
-                )
-
-            except Exception:
-                pass
-
-            if results.pose_landmarks:
-                mp_drawing.draw_landmarks(
-                    image,
-                    results.pose_landmarks,
-                    mp_pose.POSE_CONNECTIONS,
-                    mp_drawing.DrawingSpec(color=(255, 0, 255), thickness=2, circle_radius=2),
-                    mp_drawing.DrawingSpec(color=(0, 255, 255), thickness=2, circle_radius=2),
-                )
-
-            cv2.putText(
-                image,
-                f"Jumping Jacks: {counter}",
-                (10, h - 20),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.9,
-                (255, 0, 255),
-                2,
-            )
+# =========================================================
+# Workout helpers (analysis runs in workout_jobs, see pose_engine.py)
+# =========================================================
+def _workout_video_url(processed_path):
+    """
+    URL for an annotated video in WORKOUT_OUTPUT_FOLDER: the stream route
+    for an HLS playlist, the media route otherwise.
+    """
+    if processed_path.endswith(".m3u8"):
+        stream_id = os.path.basename(os.path.dirname(processed_path))
+        return url_for("workout_stream", stream_id=stream_id,
+                       filename=os.path.basename(processed_path))
+    rel_path = os.path.relpath(processed_path, WORKOUT_OUTPUT_FOLDER)
+    return url_for("workout_media", filename=rel_path.replace("\\", "/"))
 
-            out.write(image)
 
-    cap.release()
-    out.release()
-    return counter, output_path
+def _wants_json():
+    """True when the client asked for JSON instead of a rendered page."""
+    best = request.accept_mimetypes.best_match(["application/json", "text/html"])
+    return request.args.get("format") == "json" or best == "application/json"
 
 
 # --- Database Setup ---
 def init_db():
     """
     Creates `users` and `logs` tables if DB does not exist.
-    logs table stores JSON blobs for assessment/nutrition entries
-    linked to users.id (user_id may be NULL for anonymous).
+    logs table stores JSON blobs for assessment/nutrition/workout entries
+    linked to users.id (user_id may be NULL for anonymous); workout
+    entries also carry a per-rep columnar log in `blob` (rep_events.py).
     """
     if not os.path.exists(DB_NAME):
         conn = sqlite3.connect(DB_NAME)
@@ -449,6 +247,7 @@ def init_db():
             date TEXT NOT NULL,
             type TEXT NOT NULL,
             data TEXT NOT NULL,
+            blob BLOB,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
         """
@@ -456,6 +255,14 @@ def init_db():
         conn.commit()
         conn.close()
 
+    # older logs tables: add the binary column used by workout rep logs
+    conn = sqlite3.connect(DB_NAME)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(logs)")]
+    if columns and "blob" not in columns:
+        conn.execute("ALTER TABLE logs ADD COLUMN blob BLOB")
+        conn.commit()
+    conn.close()
+
 
 init_db()
 
@@ -787,39 +594,11 @@ def nutrition():
 
 
 # ------- OpenAI Vision helper --------
-def _vision_call_with_model(model_name, img_b64):
+def _try_models_with_image_b64(img_b64):
     """
-    Helper to query a model; raises OpenAIError to be handled by caller.
-    Forces JSON output to reduce parsing errors.
+    Try configured model, then fallback (vision_gateway); return parsed
+    JSON dict. Results are cached per image content + model (nutrition_cache).
     """
-    prompt = (
-        "You are a nutrition expert. Look at the food photo and respond ONLY as strict JSON with this schema: "
-        '{"is_food": true|false, "items": [{"name": string, "calories": integer, "protein": number, "carbs": number, "fat": number}]}'
-    )
-
-    return client.chat.completions.create(
-        model=model_name,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": "You are a nutrition assistant."},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"},
-                    },
-                ],
-            },
-        ],
-        max_tokens=500,
-        temperature=0.2,
-    )
-
-
-def _try_models_with_image_b64(img_b64):
-    """Try configured model, then fallback; return parsed JSON dict."""
     if not OPENAI_API_KEY:
         raise OpenAIError("OpenAI key not set on server. Set OPENAI_API_KEY.")
     models_to_try = (
@@ -827,23 +606,14 @@ def _try_models_with_image_b64(img_b64):
         if VISION_MODEL != "gpt-4o"
         else ["gpt-4o", "gpt-4o-mini"]
     )
-    last_err = None
-    for m in models_to_try:
-        try:
-            resp = _vision_call_with_model(m, img_b64)
-            raw = resp.choices[0].message.content.strip()
-            return json.loads(raw)
-        except OpenAIError as e:
-            last_err = e
-            msg = str(e).lower()
-            if ("model" in msg) or ("access" in msg) or ("403" in msg):
-                # try next model in list
-                continue
-            # other OpenAI errors should be raised
-            raise
-    if last_err:
-        raise last_err
-    raise OpenAIError("Unknown OpenAI error")
+    digest = image_digest(base64.b64decode(img_b64))
+    _model, cached = nutrition_cache.get(digest, models_to_try)
+    if cached is not None:
+        return cached
+
+    model, data = vision_gateway.analyze(img_b64, models_to_try)
+    nutrition_cache.put(digest, model, data)
+    return data
 
 
 # --- Upload-based nutrition (existing) ---
@@ -859,11 +629,9 @@ def analyze_nutrition():
         return redirect(url_for("nutrition"))
 
     try:
-        # Convert uploaded image to base64 for OpenAI
-        img = Image.open(file.stream).convert("RGB")
-        buffered = BytesIO()
-        img.save(buffered, format="JPEG")
-        img_b64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        # Downscaled, metadata-free JPEG for OpenAI (see vision_images.py)
+        img_bytes = normalize_image(file.stream, VISION_MAX_SIDE, VISION_JPEG_QUALITY)
+        img_b64 = base64.b64encode(img_bytes).decode("utf-8")
 
         data = _try_models_with_image_b64(img_b64)
 
@@ -935,6 +703,14 @@ def analyze_nutrition():
         return redirect(url_for("nutrition"))
 
 
+def _live_session_id(payload):
+    """Camera session sent by the page, else one per browser session."""
+    session_id = str(payload.get("session_id") or "")[:64]
+    if not session_id:
+        session_id = session.setdefault("live_frame_session", uuid.uuid4().hex)
+    return session_id
+
+
 # --- NEW: Live camera frame analysis (JSON in/out) ---
 @app.route("/analyze_nutrition_frame", methods=["POST"])
 def analyze_nutrition_frame():
@@ -945,17 +721,37 @@ def analyze_nutrition_frame():
         if not img_b64:
             return jsonify({"ok": False, "error": "image_b64 missing"}), 400
 
+        dedup_threshold = payload.get("dedup_threshold")
+        if dedup_threshold is not None:
+            try:
+                dedup_threshold = int(dedup_threshold)
+            except (TypeError, ValueError, OverflowError):
+                return jsonify({"ok": False, "error": "dedup_threshold must be an integer"}), 400
+
         # allow 'data:image/jpeg;base64,...'
         if "," in img_b64:
             img_b64 = img_b64.split(",", 1)[1]
 
-        data = _try_models_with_image_b64(img_b64)
+        frame = normalize_image(base64.b64decode(img_b64), VISION_MAX_SIDE, VISION_JPEG_QUALITY)
+        img_b64 = base64.b64encode(frame).decode("utf-8")
+
+        # same plate as the last analyzed frame of this camera session?
+        session_id = _live_session_id(payload)
+        if dedup_threshold is not None:
+            live_frames.set_threshold(session_id, dedup_threshold)
+        frame_hash = live_frames.hash(frame)
+        data = live_frames.lookup(session_id, frame_hash)
+        deduped = data is not None
+        if not deduped:
+            data = _try_models_with_image_b64(img_b64)
+            live_frames.store(session_id, frame_hash, data)
 
         if not data.get("is_food"):
             return jsonify(
                 {
                     "ok": True,
                     "is_food": False,
+                    "deduped": deduped,
                     "items": [],
                     "totals": {
                         "calories": 0,
@@ -973,8 +769,18 @@ def analyze_nutrition_frame():
             "carbs": float(sum(float(i.get("carbs", 0)) for i in items)),
             "fat": float(sum(float(i.get("fat", 0)) for i in items)),
         }
-        return jsonify({"ok": True, "is_food": True, "items": items, "totals": totals})
+        return jsonify(
+            {"ok": True, "is_food": True, "deduped": deduped, "items": items, "totals": totals}
+        )
 
+    except VisionTimeout as e:
+        return jsonify({"ok": False, "error": str(e)}), 504
+    except ModelsUnavailable as e:
+        # circuits open or every slot busy: tell the camera loop when to come back
+        retry_after = max(1, math.ceil(e.retry_after))
+        response = jsonify({"ok": False, "error": str(e), "retry_after": retry_after})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 503
     except OpenAIError as e:
         msg = str(e)
         if "model_not_found" in msg or "does not have access" in msg or "403" in msg:
@@ -993,7 +799,7 @@ def analyze_nutrition_frame():
 @app.route("/progress", methods=["GET"])
 def progress():
     logs = []
-    series = {"assessments": [], "nutrition": []}
+    series = {"assessments": [], "nutrition": [], "workouts": []}
 
     user_id = get_current_user_id()
     if user_id:
@@ -1001,13 +807,13 @@ def progress():
             conn = sqlite3.connect(DB_NAME)
             c = conn.cursor()
             c.execute(
-                "SELECT date, type, data FROM logs WHERE user_id=? ORDER BY date ASC",
+                "SELECT date, type, data, blob FROM logs WHERE user_id=? ORDER BY date ASC",
                 (user_id,),
             )
             rows = c.fetchall()
             conn.close()
 
-            for d, t, data_json in rows:
+            for d, t, data_json, blob in rows:
                 parsed = json.loads(data_json)
                 logs.append({"date": d, "type": t, "data": parsed})
                 if t == "assessment":
@@ -1022,6 +828,16 @@ def progress():
                 elif t == "nutrition":
                     totals = parsed.get("totals") or {}
                     series["nutrition"].append({"date": d, "totals": totals})
+                elif t == "workout":
+                    series["workouts"].append(
+                        {
+                            "date": d,
+                            "workout_type": parsed.get("workout_type"),
+                            "reps": parsed.get("reps"),
+                            "summary": parsed.get("summary") or {},
+                            "per_rep": rep_log_series(blob) if blob else None,
+                        }
+                    )
         except Exception as e:
             print("Warning: failed to load progress logs:", e)
 
@@ -1057,8 +873,9 @@ def upload_workout():
     """
     Handles the form in workouts.html:
     - Reads workout_type and video file
-    - Runs the appropriate analyzer
-    - Renders workouts.html with annotated video + rep count
+    - Queues the appropriate analyzer as a background job
+    - Renders workouts.html, which polls the job until the annotated
+      video + rep count are ready (JSON clients get the job id, 202)
     """
     user_id = get_current_user_id()
     sample_workouts = [
@@ -1067,7 +884,27 @@ def upload_workout():
         {"title": "HIIT Cardio Blast", "duration": "20 min", "level": "Advanced"},
     ]
 
-    if "video" not in request.files:
+    try:
+        # parses the multipart body: the video is streamed to disk here
+        has_video = "video" in request.files
+    except (UploadRejected, RequestEntityTooLarge) as e:
+        if e.code == 413:
+            error = f"Video is too large (max {WORKOUT_MAX_UPLOAD_MB} MB)."
+        else:
+            error = e.description
+        if _wants_json():
+            return jsonify({"ok": False, "error": error}), e.code
+        return render_template(
+            "workouts.html",
+            workouts=sample_workouts,
+            user_id=user_id,
+            selected_workout=None,
+            video_url=None,
+            reps=None,
+            error=error,
+        ), e.code
+
+    if not has_video:
         error = "No video uploaded!"
         return render_template(
             "workouts.html",
@@ -1094,47 +931,67 @@ def upload_workout():
             error=error,
         )
 
-    # Save uploaded file
+    # Save uploaded file under its content hash (re-uploads reuse cached landmarks)
     ext = os.path.splitext(video_file.filename)[1].lower() or ".mp4"
-    input_name = f"{uuid.uuid4().hex}_input{ext}"
-    output_name = f"{uuid.uuid4().hex}_output.mp4"
-
-    input_path = os.path.join(WORKOUT_UPLOAD_FOLDER, input_name)
-    output_path = os.path.join(WORKOUT_OUTPUT_FOLDER, output_name)
-    video_file.save(input_path)
-
-    # Choose analyzer
+    # pinned until the job has it: a finishing job can't discard the same file meanwhile
     try:
-        if workout_type == "squat":
-            reps, processed_path = _analyze_squat(input_path, output_path)
-        elif workout_type == "pullup":
-            reps, processed_path = _analyze_pullup(input_path, output_path)
-        elif workout_type == "jumping_jack":
-            reps, processed_path = _analyze_jumping_jack(input_path, output_path)
-        else:
-            workout_type = "pushup"
-            reps, processed_path = _analyze_pushup(input_path, output_path)
-
-        if processed_path is None:
-            raise RuntimeError("Failed to process video")
-
-        # Build URL for template
-        rel_path = os.path.relpath(processed_path, os.path.join(BASE_DIR, "static"))
-        video_url = url_for("static", filename=rel_path.replace("\\", "/"))
-
+        with workout_inputs.saving():
+            input_path, video_hash = save_video_upload(video_file, WORKOUT_UPLOAD_FOLDER, ext)
+            workout_inputs.pin(input_path)
+    except UploadRejected as e:
+        if _wants_json():
+            return jsonify({"ok": False, "error": e.description}), e.code
         return render_template(
             "workouts.html",
             workouts=sample_workouts,
             user_id=user_id,
             selected_workout=workout_type,
-            video_url=video_url,
-            reps=reps,
-            error=None,
-        )
+            video_url=None,
+            reps=None,
+            error=e.description,
+        ), e.code
 
-    except Exception as e:
-        print("Workout analyze error:", e)
-        error = f"Failed to analyze workout: {e}"
+    stream_id = uuid.uuid4().hex
+    if WORKOUT_OUTPUT_FORMAT == "hls":
+        output_path = os.path.join(WORKOUT_OUTPUT_FOLDER, stream_id, HLS_PLAYLIST)
+    else:
+        output_path = os.path.join(WORKOUT_OUTPUT_FOLDER, f"{stream_id}_output.mp4")
+
+    # Several workout_type values may be posted; all are scored in one pass.
+    # "auto" detects the exercise(s) from the landmarks instead
+    posted_types = request.form.getlist("workout_type")
+    detect = "auto" in posted_types
+    workout_types = [
+        t for t in dict.fromkeys(posted_types) if t in SIMPLE_COUNTERS
+    ] or ["pushup"]
+    workout_type = "auto" if detect else workout_types[0]
+    # "Counts only": skip drawing + encoding the annotated video
+    render = request.form.get("render", "1").lower() not in ("0", "false", "no", "off")
+
+    # Queue the analyzer; the page polls the job endpoints for the result
+    try:
+        job_id = workout_jobs.submit(
+            analyze_video,
+            args=(input_path, output_path, workout_types),
+            kwargs=dict(
+                WORKOUT_ENGINE_OPTIONS,
+                render=render,
+                cache=landmark_cache,
+                video_hash=video_hash,
+                output_format=WORKOUT_OUTPUT_FORMAT,
+                detect=detect,
+            ),
+            meta={
+                "workout_type": workout_type,
+                "user_id": user_id,
+                "stream_id": stream_id if render and WORKOUT_OUTPUT_FORMAT == "hls" else None,
+            },
+            inputs=[input_path],
+            discard_inputs=not WORKOUT_KEEP_UPLOADS,
+        )
+    except JobQueueFull as e:
+        if _wants_json():
+            return jsonify({"ok": False, "error": str(e)}), 503
         return render_template(
             "workouts.html",
             workouts=sample_workouts,
@@ -1142,8 +999,256 @@ def upload_workout():
             selected_workout=workout_type,
             video_url=None,
             reps=None,
-            error=error,
+            error=str(e),
         )
+    finally:
+        # the job holds its own pin now (or there is no job)
+        workout_inputs.release(input_path)
+
+    if _wants_json():
+        return jsonify(
+            {
+                "ok": True,
+                "job_id": job_id,
+                "status_url": url_for("workout_job_status", job_id=job_id),
+                "result_url": url_for("workout_job_result", job_id=job_id),
+            }
+        ), 202
+
+    return render_template(
+        "workouts.html",
+        workouts=sample_workouts,
+        user_id=user_id,
+        selected_workout=workout_type,
+        video_url=None,
+        reps=None,
+        error=None,
+        job_id=job_id,
+    )
+
+
+# ------- Workout logs (per-rep events, charted on the progress page) -------
+def _job_reps(workout_type, counts):
+    # auto-detected clips: reps over every detected exercise
+    return counts[workout_type] if workout_type in counts else sum(counts.values())
+
+
+def _log_workout_job(job):
+    """
+    Saves a finished analysis to the logs table: the JSON summary in
+    `data`, every rep (rep_events.py) as a columnar blob in `blob`.
+    """
+    result = job["result"]
+    if job["status"] != "done" or result is None:
+        return
+    workout_type = job["meta"].get("workout_type")
+    events = result.get("rep_events") or []
+    log_payload = {
+        "workout_type": workout_type,
+        "reps": _job_reps(workout_type, result["counts"]),
+        "counts": result["counts"],
+        "summary": summarize_reps(events),
+    }
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO logs (user_id, date, type, data, blob) VALUES (?,?,?,?,?)",
+        (
+            job["meta"].get("user_id"),
+            datetime.date.today().isoformat(),
+            "workout",
+            json.dumps(log_payload),
+            encode_rep_log(events, result.get("fps")),
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+# ------- Progressive annotated output (HLS playlist + fMP4 segments) -------
+def _workout_stream_url(stream_id):
+    """Playlist URL once the first HLS segment is out, else None."""
+    if not stream_id:
+        return None
+    if not os.path.exists(os.path.join(WORKOUT_OUTPUT_FOLDER, stream_id, HLS_PLAYLIST)):
+        return None
+    return url_for("workout_stream", stream_id=stream_id, filename=HLS_PLAYLIST)
+
+
+@app.route("/workouts/stream/<stream_id>/<path:filename>", methods=["GET"])
+def workout_stream(stream_id, filename):
+    """
+    Serves the HLS playlist and segments of an annotated video. The
+    playlist grows while the job runs, so it must not be cached;
+    finished segments never change.
+    """
+    if not re.fullmatch(r"[0-9a-f]{32}", stream_id):
+        abort(404)
+    playlist = filename.endswith(".m3u8")
+    response = send_media(WORKOUT_OUTPUT_FOLDER, f"{stream_id}/{filename}", immutable=not playlist)
+    if not playlist:
+        storage.touch(os.path.join(WORKOUT_OUTPUT_FOLDER, stream_id, filename))
+    return response
+
+
+@app.route("/media/workouts/<path:filename>", methods=["GET"])
+def workout_media(filename):
+    """
+    Finished annotated videos: strong ETag, immutable caching and Range
+    requests for scrubbing (see media_serving.py).
+    """
+    response = send_media(WORKOUT_OUTPUT_FOLDER, filename)
+    storage.touch(os.path.join(WORKOUT_OUTPUT_FOLDER, filename))
+    return response
+
+
+# ------- Workout job status / result (JSON, polled by workouts.html) -------
+@app.route("/workout_jobs/<job_id>", methods=["GET"])
+def workout_job_status(job_id):
+    job = workout_jobs.get(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "Unknown job"}), 404
+
+    return jsonify(
+        {
+            "ok": True,
+            "job_id": job_id,
+            "status": job["status"],
+            "progress": round(job["progress"], 3),
+            "workout_type": job["meta"].get("workout_type"),
+            "stream_url": _workout_stream_url(job["meta"].get("stream_id")),
+            "error": job["error"],
+        }
+    )
+
+
+@app.route("/workout_jobs/<job_id>/result", methods=["GET"])
+def workout_job_result(job_id):
+    job = workout_jobs.get(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "Unknown job"}), 404
+
+    if job["status"] == "failed":
+        return jsonify(
+            {"ok": False, "status": "failed", "error": f"Failed to analyze workout: {job['error']}"}
+        ), 500
+
+    if job["status"] != "done":
+        return jsonify(
+            {"ok": False, "status": job["status"], "progress": round(job["progress"], 3)}
+        ), 202
+
+    result = job["result"]
+    if result is None:
+        return jsonify(
+            {"ok": False, "status": "failed", "error": "Failed to process video"}
+        ), 500
+
+    counts = result["counts"]
+    processed_path = result["output_path"]
+    if processed_path:
+        storage.touch(processed_path)
+
+    workout_type = job["meta"].get("workout_type")
+    reps = _job_reps(workout_type, counts)
+
+    return jsonify(
+        {
+            "ok": True,
+            "status": "done",
+            "workout_type": workout_type,
+            "reps": reps,
+            "counts": counts,
+            "segments": result.get("segments"),
+            "timeline": result.get("timeline"),
+            "rep_summary": summarize_reps(result.get("rep_events") or []),
+            "cached_landmarks": result.get("cached", False),
+            "video_url": _workout_video_url(processed_path) if processed_path else None,
+            "landmarks_url": (
+                url_for("workout_job_landmarks", job_id=job_id)
+                if result.get("landmarks_path") else None
+            ),
+        }
+    )
+
+
+@app.route("/workout_jobs/<job_id>/timeline", methods=["GET"])
+def workout_job_timeline(job_id):
+    """
+    Exercise / rest intervals of an auto-detected (workout_type=auto) job,
+    with timestamps and reps per interval (see exercise_detection.py).
+    """
+    job = workout_jobs.get(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "Unknown job"}), 404
+    if job["status"] != "done":
+        return jsonify({"ok": False, "status": job["status"]}), 202
+    timeline = (job["result"] or {}).get("timeline")
+    if timeline is None:
+        return jsonify({"ok": False, "error": "No timeline: the job was not auto-detected"}), 404
+    return jsonify({"ok": True, "job_id": job_id, "timeline": timeline})
+
+
+@app.route("/workout_jobs/<job_id>/landmarks", methods=["GET"])
+def workout_job_landmarks(job_id):
+    """
+    Export of the job's pose track in the binary .lmk format (see
+    landmark_format.py), served straight from the landmark cache.
+    """
+    job = workout_jobs.get(job_id)
+    if job is None or job["status"] != "done" or not job["result"]:
+        return jsonify({"ok": False, "error": "No landmarks for this job"}), 404
+    path = job["result"].get("landmarks_path")
+    if not path:
+        return jsonify({"ok": False, "error": "No landmarks for this job"}), 404
+
+    response = send_media(WORKOUT_LANDMARK_FOLDER, os.path.basename(path))
+    response.headers["Content-Disposition"] = f"attachment; filename={job_id}.lmk"
+    storage.touch(path)
+    return response
+
+
+# ------- Live workout mode (WebSocket, see live_session.py) -------
+sock = Sock(app) if Sock is not None else None
+if sock is None:
+    print("WARNING: flask-sock is not installed. Live workout mode is disabled.")
+else:
+
+    @sock.route("/ws/workout_live")
+    def workout_live(ws):
+        """
+        ?workout_type=pushup (repeatable), ?mode=form for the form-coaching
+        counters. Frames or landmarks in, JSON counts/feedback out.
+        """
+        workout_types = [
+            t for t in dict.fromkeys(request.args.getlist("workout_type")) if t in SIMPLE_COUNTERS
+        ] or ["pushup"]
+        counter_classes = FORM_COUNTERS if request.args.get("mode") == "form" else SIMPLE_COUNTERS
+        serve_live_socket(ws, workout_types, counter_classes)
+
+
+@app.context_processor
+def _live_mode_flag():
+    return {"live_ws_enabled": sock is not None}
+
+
+# ------- Vision result cache metrics (hits, misses, evictions) -------
+@app.route("/nutrition/cache/metrics", methods=["GET"])
+def nutrition_cache_metrics():
+    return jsonify(
+        {
+            "ok": True,
+            **nutrition_cache.metrics(),
+            "live_frames": live_frames.metrics(),
+            "vision_models": vision_gateway.metrics(),
+        }
+    )
+
+
+# ------- Storage metrics (bytes held per folder, evictions) -------
+@app.route("/storage/metrics", methods=["GET"])
+def storage_metrics():
+    return jsonify({"ok": True, **storage.metrics()})
 
 
 if __name__ == "__main__":
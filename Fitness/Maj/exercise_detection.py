@@ -0,0 +1,345 @@
+"""
+Exercise auto-detection over a landmark track.
+
+Instead of trusting the workout_type picked on the form, the clip's
+landmark series is cut into short overlapping windows and each window
+is scored for every exercise from a handful of posture / motion
+features (torso angle, joint angle ranges, hands overhead, feet
+spread). Consecutive windows with the same winner become segments,
+and each segment is counted by that exercise's counter, so a clip with
+squats then push-ups gets both counts from one pose pass.
+
+It is a transparent rule-based scorer, not a trained model: thresholds
+are in the same units as the rep counters (degrees, body proportions)
+and can be tuned next to them.
+
+For circuit videos (several exercises in a row, rests in between)
+build_timeline() turns the segments into a JSON timeline of exercise
+and rest intervals with timestamps and per-interval reps, which the
+workouts page renders as is.
+"""
+import numpy as np
+
+from kinematics import (
+    LEFT_SHOULDER,
+    RIGHT_SHOULDER,
+    LEFT_WRIST,
+    RIGHT_WRIST,
+    LEFT_HIP,
+    RIGHT_HIP,
+    LEFT_ANKLE,
+    RIGHT_ANKLE,
+    JOINTS,
+    joint_angles,
+    pixel_coords,
+)
+
+EXERCISES = ("pushup", "squat", "pullup", "jumping_jack")
+REST = "rest"
+
+WINDOW_SECONDS = 2.0     # one window ~ one slow rep
+MIN_SCORE = 0.5          # best window score below this = rest / unknown
+MIN_POSE_FRACTION = 0.5  # windows with fewer pose frames are rest
+MIN_SEGMENT_SECONDS = 3.0
+
+_DETECTION_JOINTS = {
+    name: JOINTS[name] for name in ("left_elbow", "right_elbow", "left_knee", "right_knee")
+}
+
+
+def _ramp(value, low, high):
+    """0 below low, 1 above high, linear in between."""
+    return float(np.clip((value - low) / (high - low), 0.0, 1.0))
+
+
+def _spread(values):
+    """Robust range (p90 - p10) ignoring NaN; 0 for an all-NaN window."""
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return 0.0
+    p10, p90 = np.percentile(values, [10, 90])
+    return float(p90 - p10)
+
+
+def frame_features(landmarks, frame_size):
+    """
+    Per-frame features for an (N, 33, 4) track, each (N,) float32
+    (NaN where no pose): torso inclination (0 = upright, 90 = lying),
+    elbow / knee angles per side, hand height above the shoulders and
+    ankle spread, both in torso lengths.
+    """
+    xy = pixel_coords(landmarks, frame_size)
+    shoulders = (xy[:, LEFT_SHOULDER] + xy[:, RIGHT_SHOULDER]) / 2
+    hips = (xy[:, LEFT_HIP] + xy[:, RIGHT_HIP]) / 2
+    torso = shoulders - hips
+    torso_len = np.linalg.norm(torso, axis=-1) + 1e-6
+    wrists_y = np.maximum(xy[:, LEFT_WRIST, 1], xy[:, RIGHT_WRIST, 1])  # the lower hand
+
+    angles = joint_angles(landmarks, frame_size, _DETECTION_JOINTS)
+    return {
+        "inclination": np.degrees(np.arctan2(np.abs(torso[:, 0]), np.abs(torso[:, 1]))),
+        "left_elbow": angles["left_elbow"],
+        "right_elbow": angles["right_elbow"],
+        "left_knee": angles["left_knee"],
+        "right_knee": angles["right_knee"],
+        "hands_up": (shoulders[:, 1] - wrists_y) / torso_len,
+        "feet_spread": np.abs(xy[:, LEFT_ANKLE, 0] - xy[:, RIGHT_ANKLE, 0]) / torso_len,
+    }
+
+
+def window_scores(features, start, end):
+    """{exercise: 0..1} for frames [start, end), or None if mostly no pose."""
+    incl = features["inclination"][start:end]
+    pose = ~np.isnan(incl)
+    if not len(incl) or pose.mean() < MIN_POSE_FRACTION:
+        return None
+
+    lying = _ramp(float(np.nanmedian(incl)), 50, 70)
+    upright = 1.0 - _ramp(float(np.nanmedian(incl)), 35, 60)
+    elbow_range = max(_spread(features["left_elbow"][start:end]),
+                      _spread(features["right_elbow"][start:end]))
+    knee_range = max(_spread(features["left_knee"][start:end]),
+                     _spread(features["right_knee"][start:end]))
+    hands_up = features["hands_up"][start:end][pose]
+    overhead = float(np.mean(hands_up > 0.3))
+    arm_swing = _spread(features["hands_up"][start:end])
+    feet_swing = _spread(features["feet_spread"][start:end])
+
+    return {
+        "pushup": lying * _ramp(elbow_range, 15, 45),
+        "squat": upright * _ramp(knee_range, 20, 50) * (1.0 - _ramp(overhead, 0.5, 0.8)),
+        "pullup": upright * _ramp(overhead, 0.6, 0.9) * _ramp(elbow_range, 20, 50),
+        "jumping_jack": upright * _ramp(feet_swing, 0.25, 0.6) * _ramp(arm_swing, 0.6, 1.2),
+    }
+
+
+def classify_windows(landmarks, frame_size, rate, window_seconds=WINDOW_SECONDS):
+    """
+    Labels half-overlapping windows of the track.
+    `rate` is track rows per second (video fps / stride).
+    Returns (hop, [(label, score), ...]); window k covers rows
+    [k * hop, k * hop + 2 * hop).
+    """
+    hop = max(1, int(round(window_seconds * rate / 2)))
+    features = frame_features(landmarks, frame_size)
+    labels = []
+    for start in range(0, max(len(landmarks) - hop, 1), hop):
+        scores = window_scores(features, start, start + 2 * hop)
+        if scores is None:
+            labels.append((REST, 0.0))
+            continue
+        best = max(scores, key=scores.get)
+        if scores[best] < MIN_SCORE:
+            labels.append((REST, scores[best]))
+        else:
+            labels.append((best, scores[best]))
+    return hop, labels
+
+
+def _smooth(labels):
+    """Majority of each window and its two neighbours (drops 1-window blips)."""
+    names = [label for label, _score in labels]
+    smoothed = list(names)
+    for i in range(1, len(names) - 1):
+        if names[i - 1] == names[i + 1] != names[i]:
+            smoothed[i] = names[i - 1]
+    return smoothed
+
+
+def detect_segments(landmarks, frame_size, rate, min_segment_seconds=MIN_SEGMENT_SECONDS):
+    """
+    Exercise intervals of a track: a list of dicts with exercise,
+    start / end (track rows, end exclusive) and mean window score as
+    confidence, in order. Rest stretches are left out, and runs shorter
+    than min_segment_seconds are folded into their neighbours.
+    """
+    if not len(landmarks):
+        return []
+    hop, labels = classify_windows(landmarks, frame_size, rate)
+    names = _smooth(labels)
+
+    # runs of equal labels, as [name, first window, last window]
+    runs = []
+    for k, name in enumerate(names):
+        if runs and runs[-1][0] == name:
+            runs[-1][2] = k
+        else:
+            runs.append([name, k, k])
+
+    # fold short runs into the longer neighbour
+    min_windows = max(1, int(np.ceil(min_segment_seconds * rate / hop)))
+    while len(runs) > 1:
+        short = [i for i, run in enumerate(runs) if run[2] - run[1] + 1 < min_windows]
+        if not short:
+            break
+        i = min(short, key=lambda j: runs[j][2] - runs[j][1])
+        left = runs[i - 1] if i > 0 else None
+        right = runs[i + 1] if i + 1 < len(runs) else None
+        target = max((r for r in (left, right) if r), key=lambda r: r[2] - r[1])
+        target[1], target[2] = min(target[1], runs[i][1]), max(target[2], runs[i][2])
+        del runs[i]
+        merged = [runs[0]]
+        for run in runs[1:]:
+            if run[0] == merged[-1][0]:
+                merged[-1][2] = run[2]
+            else:
+                merged.append(run)
+        runs = merged
+
+    segments = []
+    for name, first, last in runs:
+        if name == REST:
+            continue
+        scores = [labels[k][1] for k in range(first, last + 1) if labels[k][0] == name]
+        # window k is centred on row (k + 1) * hop: split between centres
+        start = 0 if first == 0 else first * hop + hop // 2
+        end = len(landmarks) if last == len(names) - 1 else (last + 1) * hop + hop // 2
+        segments.append({
+            "exercise": name,
+            "start": start,
+            "end": min(end, len(landmarks)),
+            "confidence": round(float(np.mean(scores)) if scores else 0.0, 3),
+        })
+    return segments
+
+
+class SegmentedCounter:
+    """
+    One exercise's counter, active only inside that exercise's segments
+    (track row ranges). Each segment starts from a fresh state machine;
+    `count` is the total and `segment_counts` the per-segment reps.
+    Works with PoseVideoEngine like any counter: update() is called once
+    per track row, update_series() with the whole track.
+    """
+
+    def __init__(self, counter_class, ranges):
+        self.counter_class = counter_class
+        self.name = counter_class.name
+        self.label = counter_class.label
+        self.ranges = list(ranges)
+        self.segment_counts = [0] * len(self.ranges)
+        self.inner = counter_class()
+        self._row = 0
+        self._active = None
+
+    def __getattr__(self, attr):
+        # stage, feedback_text, angle, ... of the current state machine
+        inner = self.__dict__.get("inner")
+        if inner is None:
+            raise AttributeError(attr)
+        return getattr(inner, attr)
+
+    @property
+    def count(self):
+        return self.inner.count
+
+    def _start_segment(self, k):
+        fresh = self.counter_class()
+        fresh.count = self.inner.count
+        self.inner = fresh
+        self._active = k
+
+    def _segment_at(self, row):
+        for k, (start, end) in enumerate(self.ranges):
+            if start <= row < end:
+                return k
+        return None
+
+    def update(self, landmarks, frame_size):
+        k = self._segment_at(self._row)
+        self._row += 1
+        if k is None:
+            self._active = None
+            return
+        if k != self._active:
+            self._start_segment(k)
+        before = self.inner.count
+        self.inner.update(landmarks, frame_size)
+        self.segment_counts[k] += self.inner.count - before
+
+    def update_series(self, landmarks, frame_size):
+        for k, (start, end) in enumerate(self.ranges):
+            self._start_segment(k)
+            before = self.inner.count
+            self.inner.update_series(landmarks[start:end], frame_size)
+            self.segment_counts[k] += self.inner.count - before
+        self._active = None
+
+    def draw(self, image, slot=0):
+        if self._active is not None:
+            self.inner.draw(image, slot)
+
+
+def segment_counters(segments, counter_classes):
+    """One SegmentedCounter per detected exercise, in order of first appearance."""
+    ranges = {}
+    for segment in segments:
+        ranges.setdefault(segment["exercise"], []).append((segment["start"], segment["end"]))
+    return [SegmentedCounter(counter_classes[name], spans) for name, spans in ranges.items()]
+
+
+def segment_report(segments, counters, stride, fps, frames=None):
+    """
+    Detected segments with their rep counts, in video frame numbers and
+    seconds (`frames` clips the last segment to the clip length).
+    """
+    by_name = {c.name: c for c in counters}
+    seen = {}
+    report = []
+    for segment in segments:
+        name = segment["exercise"]
+        k = seen.get(name, 0)
+        seen[name] = k + 1
+        start_frame = segment["start"] * stride
+        end_frame = segment["end"] * stride
+        if frames is not None:
+            end_frame = min(end_frame, frames)
+        report.append({
+            "exercise": name,
+            "start_frame": start_frame,
+            "end_frame": end_frame,
+            "start": round(start_frame / fps, 2),
+            "end": round(end_frame / fps, 2),
+            "reps": by_name[name].segment_counts[k],
+            "confidence": segment["confidence"],
+        })
+    return report
+
+
+def build_timeline(report, frames, fps):
+    """
+    JSON timeline of a whole clip: the segment_report() intervals with
+    the gaps between them filled by "rest" intervals, so the intervals
+    tile [0, duration] seconds. Also totals reps per exercise.
+    """
+    intervals = []
+    cursor = 0
+    for segment in report:
+        if segment["start_frame"] > cursor:
+            intervals.append(_rest(cursor, segment["start_frame"], fps))
+        intervals.append(segment)
+        cursor = segment["end_frame"]
+    if frames > cursor:
+        intervals.append(_rest(cursor, frames, fps))
+
+    totals = {}
+    for segment in report:
+        totals[segment["exercise"]] = totals.get(segment["exercise"], 0) + segment["reps"]
+    return {
+        "duration": round(frames / fps, 2),
+        "fps": fps,
+        "totals": totals,
+        "intervals": intervals,
+    }
+
+
+def _rest(start_frame, end_frame, fps):
+    return {
+        "exercise": REST,
+        "start_frame": start_frame,
+        "end_frame": end_frame,
+        "start": round(start_frame / fps, 2),
+        "end": round(end_frame / fps, 2),
+        "reps": 0,
+        "confidence": None,
+    }
@@ -0,0 +1,132 @@
+"""
+Near-duplicate detection for the live nutrition camera.
+
+The camera page posts a frame every 2 s, and most of them show the same
+plate. Each frame gets a 64-bit perceptual hash (dHash by default,
+pHash optional). When its Hamming distance to the last analyzed frame
+of the same live session is within that session's threshold, the
+previous result is returned without calling the vision API.
+
+Both hashes survive JPEG re-encoding, small exposure changes and
+sensor noise, but change when the plate is moved or food is added.
+A cached result is still refreshed after `max_age` seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+
+
+def _gray(image_bytes, size):
+    img = Image.open(BytesIO(image_bytes))
+    # JPEG: let the decoder downscale (1/2 .. 1/8), far less work than a full decode
+    img.draft("L", (size[0] * 4, size[1] * 4))
+    img = img.convert("L").resize(size, Image.BILINEAR)
+    return np.asarray(img, dtype=np.float32)
+
+
+def _pack(bits):
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(image_bytes):
+    """Difference hash: is each pixel brighter than its right neighbour (9x8 grid)."""
+    gray = _gray(image_bytes, (9, 8))
+    return _pack(gray[:, 1:] > gray[:, :-1])
+
+
+_N = 32
+_DCT = np.cos(np.pi * (2 * np.arange(_N)[None, :] + 1) * np.arange(_N)[:, None] / (2 * _N))
+
+
+def phash(image_bytes):
+    """DCT hash: low 8x8 frequencies of a 32x32 thumbnail against their median."""
+    gray = _gray(image_bytes, (_N, _N))
+    low = (_DCT @ gray @ _DCT.T)[:8, :8].ravel()
+    return _pack(low > np.median(low[1:]))
+
+
+HASHES = {"dhash": dhash, "phash": phash}
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class LiveFrameDeduper:
+    """
+    Last analyzed frame (hash + result) per live session.
+
+    threshold   : default max Hamming distance (bits of 64) that counts
+                  as the same frame; sessions may set their own
+    max_age     : seconds before a repeated frame is analyzed again
+    max_sessions: LRU bound on tracked sessions
+    """
+
+    def __init__(self, method="dhash", threshold=6, max_age=60, max_sessions=1000):
+        self.hash = HASHES[method]
+        self.method = method
+        self.threshold = threshold
+        self.max_age = max_age or None
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _session(self, session_id):
+        state = self._sessions.get(session_id)
+        if state is None:
+            state = {"threshold": self.threshold, "hash": None, "result": None, "time": 0.0}
+            self._sessions[session_id] = state
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return state
+
+    def set_threshold(self, session_id, bits):
+        """Per-session threshold, clamped to 0..HASH_BITS."""
+        with self._lock:
+            self._session(session_id)["threshold"] = max(0, min(HASH_BITS, int(bits)))
+
+    def lookup(self, session_id, frame_hash):
+        """The last result of this session if frame_hash is close enough, else None."""
+        now = time.time()
+        with self._lock:
+            state = self._session(session_id)
+            same = (
+                state["hash"] is not None
+                and hamming(state["hash"], frame_hash) <= state["threshold"]
+                and not (self.max_age and now - state["time"] > self.max_age)
+            )
+            if same:
+                self.hits += 1
+                return state["result"]
+            self.misses += 1
+            return None
+
+    def store(self, session_id, frame_hash, result):
+        with self._lock:
+            state = self._session(session_id)
+            state.update(hash=frame_hash, result=result, time=time.time())
+
+    def metrics(self):
+        with self._lock:
+            frames = self.hits + self.misses
+            return {
+                "method": self.method,
+                "threshold": self.threshold,
+                "max_age_seconds": self.max_age,
+                "sessions": len(self._sessions),
+                "deduped_frames": self.hits,
+                "analyzed_frames": self.misses,
+                "dedup_rate": round(self.hits / frames, 3) if frames else None,
+            }
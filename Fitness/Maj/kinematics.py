@@ -0,0 +1,131 @@
+"""
+Vectorized joint kinematics over landmark time series.
+
+Everything here works on a whole clip at once: an (N, 33, 3|4) array
+of normalized landmarks (NaN rows where no pose was detected) goes in,
+and (N,) angle series or rep events come out after a handful of NumPy
+operations.
+"""
+import math
+
+import numpy as np
+
+# ---------- MediaPipe Pose landmark indices ----------
+NUM_LANDMARKS = 33
+LEFT_SHOULDER = 11
+RIGHT_SHOULDER = 12
+LEFT_ELBOW = 13
+RIGHT_ELBOW = 14
+LEFT_WRIST = 15
+RIGHT_WRIST = 16
+LEFT_HIP = 23
+RIGHT_HIP = 24
+LEFT_KNEE = 25
+RIGHT_KNEE = 26
+LEFT_ANKLE = 27
+RIGHT_ANKLE = 28
+
+# all 33, in index order (the landmark schema of stored tracks)
+LANDMARK_NAMES = (
+    "nose",
+    "left_eye_inner", "left_eye", "left_eye_outer",
+    "right_eye_inner", "right_eye", "right_eye_outer",
+    "left_ear", "right_ear",
+    "mouth_left", "mouth_right",
+    "left_shoulder", "right_shoulder",
+    "left_elbow", "right_elbow",
+    "left_wrist", "right_wrist",
+    "left_pinky", "right_pinky",
+    "left_index", "right_index",
+    "left_thumb", "right_thumb",
+    "left_hip", "right_hip",
+    "left_knee", "right_knee",
+    "left_ankle", "right_ankle",
+    "left_heel", "right_heel",
+    "left_foot_index", "right_foot_index",
+)
+# per-landmark values, in storage order
+LANDMARK_CHANNELS = ("x", "y", "z", "visibility")
+
+# joint name -> (a, b, c): the angle is measured at b
+JOINTS = {
+    "left_elbow": (LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST),
+    "right_elbow": (RIGHT_SHOULDER, RIGHT_ELBOW, RIGHT_WRIST),
+    "left_shoulder": (LEFT_HIP, LEFT_SHOULDER, LEFT_ELBOW),
+    "right_shoulder": (RIGHT_HIP, RIGHT_SHOULDER, RIGHT_ELBOW),
+    "left_hip": (LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE),
+    "right_hip": (RIGHT_SHOULDER, RIGHT_HIP, RIGHT_KNEE),
+    "left_knee": (LEFT_HIP, LEFT_KNEE, LEFT_ANKLE),
+    "right_knee": (RIGHT_HIP, RIGHT_KNEE, RIGHT_ANKLE),
+    # shoulder-hip-ankle: straight body line in a plank
+    "left_body_line": (LEFT_SHOULDER, LEFT_HIP, LEFT_ANKLE),
+    "right_body_line": (RIGHT_SHOULDER, RIGHT_HIP, RIGHT_ANKLE),
+}
+
+
+def calculate_angle(a, b, c):
+    """
+    Calculates the angle (in degrees) at point b given three points a, b, c.
+    Each point is (x, y). Scalar math only, for per-frame use.
+    """
+    bax, bay = a[0] - b[0], a[1] - b[1]
+    bcx, bcy = c[0] - b[0], c[1] - b[1]
+
+    cosine_angle = (bax * bcx + bay * bcy) / (math.hypot(bax, bay) * math.hypot(bcx, bcy) + 1e-8)
+    cosine_angle = min(1.0, max(-1.0, cosine_angle))
+    return math.degrees(math.acos(cosine_angle))
+
+
+def pixel_coords(landmarks, frame_size, integer=False):
+    """
+    (N, 33, 2) pixel x/y for a frame of size (w, h).
+    integer=True truncates like int(lm.x * w) in the per-frame counters.
+    """
+    w, h = frame_size
+    xy = landmarks[..., :2] * np.array([w, h], dtype=np.float32)
+    return np.trunc(xy) if integer else xy
+
+
+def joint_angles(landmarks, frame_size=(1, 1), joints=None, integer=False):
+    """
+    All requested joint angles for the whole clip in one pass.
+    Returns {joint name: (N,) float32 degrees}, NaN where no pose.
+    """
+    joints = joints or JOINTS
+    names = list(joints)
+    triplets = np.array([joints[n] for n in names])  # (J, 3)
+
+    xy = pixel_coords(landmarks, frame_size, integer)
+    pts = xy[:, triplets]  # (N, J, 3, 2)
+    ba = pts[:, :, 0] - pts[:, :, 1]
+    bc = pts[:, :, 2] - pts[:, :, 1]
+
+    dot = np.einsum("njk,njk->nj", ba, bc)
+    norms = np.linalg.norm(ba, axis=-1) * np.linalg.norm(bc, axis=-1) + 1e-8
+    angles = np.degrees(np.arccos(np.clip(dot / norms, -1.0, 1.0))).astype(np.float32)
+    return {name: angles[:, i] for i, name in enumerate(names)}
+
+
+def hysteresis_reps(enter, complete, primed=False):
+    """
+    Vectorized two-phase rep state machine.
+
+    enter/complete are (N,) bool arrays that are never both True on one
+    frame (e.g. "arm extended" / "arm flexed"). A rep is counted on each
+    `complete` frame whose most recent event was `enter`; primed=True
+    means the clip starts as if `enter` had just happened.
+
+    Returns (rep_frames, last_event): the frame index of every counted
+    rep, and the last event seen (1 = enter, 2 = complete, 0 = none).
+    """
+    events = np.zeros(len(enter), dtype=np.int8)
+    events[enter] = 1
+    events[complete] = 2
+
+    idx = np.flatnonzero(events)
+    seq = events[idx]
+    prev = np.concatenate(([1 if primed else 0], seq[:-1])).astype(np.int8)
+    rep_frames = idx[(seq == 2) & (prev == 1)]
+
+    last = int(seq[-1]) if len(seq) else (1 if primed else 0)
+    return rep_frames, last
@@ -0,0 +1,125 @@
+"""
+Content-addressed landmark store for workout videos.
+
+Pose inference is the expensive part of an analysis, and its output
+only depends on the video bytes and the inference settings. Uploads
+are hashed (SHA-256) as they are saved, and the per-frame landmark
+track is persisted as a raw .lmk file (the binary track format of
+landmark_format.py) keyed by that hash plus a signature of the engine
+options. A repeat analysis, with any exercise or threshold, then only
+replays the counters over the memory-mapped array.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+
+import numpy as np
+
+from kinematics import NUM_LANDMARKS
+from landmark_format import EXTENSION, open_landmarks, write_landmarks
+
+HASH_CHUNK = 1 << 20  # 1 MiB
+
+
+def hash_file(path):
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_stream_hashed(stream, folder, ext):
+    """
+    Copies a file-like upload stream to disk while hashing it.
+    The file is stored as <sha256><ext>, so identical uploads share one
+    file and one landmark cache entry. Returns (path, sha256).
+    """
+    tmp_path = os.path.join(folder, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    with open(tmp_path, "wb") as f:
+        for chunk in iter(lambda: stream.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+            f.write(chunk)
+
+    video_hash = digest.hexdigest()
+    path = os.path.join(folder, f"{video_hash}{ext}")
+    os.replace(tmp_path, path)
+    return path, video_hash
+
+
+def pack_landmarks(rows):
+    """List of (33, 4) arrays / None -> (N, 33, 4) float32, NaN where no pose."""
+    packed = np.full((len(rows), NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+    for i, row in enumerate(rows):
+        if row is not None:
+            packed[i] = row
+    return packed
+
+
+def unpack_landmarks(packed):
+    """Inverse of pack_landmarks: yields (33, 4) views, or None for no pose."""
+    missing = np.isnan(packed[:, 0, 0])
+    for i in range(len(packed)):
+        yield None if missing[i] else packed[i]
+
+
+def options_key(signature):
+    """Short stable hash of the engine options that affect landmarks."""
+    blob = json.dumps(signature, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(blob).hexdigest()[:12]
+
+
+class LandmarkCache:
+    """
+    Directory of <video_hash>_<options_key>.lmk landmark tracks.
+
+    A track is a dict: landmarks (N, 33, 4) for the inferred frames,
+    stride, fps, frames (decoded), width, height. Loaded tracks hold a
+    read-only np.memmap of the file; dtype="float16" halves the size.
+    """
+
+    TRACK_FIELDS = {"stride": int, "fps": float, "frames": int, "width": int, "height": int}
+
+    def __init__(self, root, dtype="float32"):
+        self.root = root
+        self.dtype = dtype
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, video_hash, signature):
+        return os.path.join(self.root, f"{video_hash}_{options_key(signature)}{EXTENSION}")
+
+    def load(self, video_hash, signature):
+        """Return the cached track, or None on a miss / unreadable file."""
+        path = self.path_for(video_hash, signature)
+        if not os.path.exists(path):
+            return None
+        try:
+            # bump atime: tracks are evicted least-recently-used first
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+            landmarks, header = open_landmarks(path)
+            track = {name: cast(header[name]) for name, cast in self.TRACK_FIELDS.items()}
+            track["landmarks"] = landmarks
+            return track
+        except Exception as e:
+            print("Warning: failed to read landmark cache:", path, e)
+            return None
+
+    def save(self, video_hash, signature, track):
+        """Write a track atomically (temp file + rename); True on success."""
+        path = self.path_for(video_hash, signature)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            meta = {name: cast(track[name]) for name, cast in self.TRACK_FIELDS.items()}
+            with open(tmp_path, "wb") as f:
+                write_landmarks(f, track["landmarks"], self.dtype, **meta)
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            print("Warning: failed to write landmark cache:", path, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
@@ -0,0 +1,136 @@
+"""
+Binary pose time series (.lmk).
+
+One file holds one landmark track: a small JSON header followed by a
+single contiguous little-endian float16/float32 array of shape
+(frames, 33, 4), NaN rows where no pose was found.
+
+  offset 0   magic      b"\\x89LMK\\r\\n\\x1a\\n"
+  offset 8   uint32 LE  header length H
+  offset 12  H bytes    UTF-8 JSON, space padded so the array starts
+                        on a 64-byte boundary:
+                        {"version", "dtype", "shape", "fps", "width",
+                         "height", ...track fields..., "schema": {
+                         "landmarks": [33 names], "channels": [x, y, z, visibility]}}
+  offset 12+H           the array, C order
+
+Because the array is stored raw, np.memmap (files) or np.frombuffer
+(request bodies) turn it into an ndarray without reading or copying
+it; counters, the landmark cache and exports all work on that view.
+"""
+import json
+import struct
+
+import numpy as np
+
+from kinematics import LANDMARK_CHANNELS, LANDMARK_NAMES, NUM_LANDMARKS
+
+MAGIC = b"\x89LMK\r\n\x1a\n"
+VERSION = 1
+ALIGNMENT = 64
+EXTENSION = ".lmk"
+MEDIA_TYPE = "application/vnd.fitsmart.landmarks"
+
+DTYPES = {"float16": np.dtype("<f2"), "float32": np.dtype("<f4")}
+
+_PREFIX = struct.Struct("<8sI")
+
+
+class LandmarkFormatError(ValueError):
+    """Bytes that are not a readable .lmk track."""
+
+
+def is_landmark_data(head):
+    return bytes(head[:len(MAGIC)]) == MAGIC
+
+
+def encode_header(shape, dtype, **meta):
+    """Magic + length + padded JSON header for an array of `shape` / `dtype`."""
+    header = {
+        "version": VERSION,
+        "dtype": np.dtype(dtype).str,
+        "shape": list(shape),
+        **meta,
+        "schema": {"landmarks": list(LANDMARK_NAMES), "channels": list(LANDMARK_CHANNELS)},
+    }
+    blob = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    blob += b" " * (-(_PREFIX.size + len(blob)) % ALIGNMENT)
+    return _PREFIX.pack(MAGIC, len(blob)) + blob
+
+
+def decode_header(buf):
+    """(header dict, data offset) from the first bytes of a track."""
+    if len(buf) < _PREFIX.size or not is_landmark_data(buf):
+        raise LandmarkFormatError("not a landmark track")
+    _magic, length = _PREFIX.unpack_from(buf)
+    end = _PREFIX.size + length
+    if len(buf) < end:
+        raise LandmarkFormatError("truncated header")
+    try:
+        header = json.loads(bytes(buf[_PREFIX.size:end]).decode("utf-8"))
+    except ValueError:
+        raise LandmarkFormatError("unreadable header")
+
+    if header.get("version") != VERSION:
+        raise LandmarkFormatError(f"unsupported version {header.get('version')}")
+    try:
+        dtype = np.dtype(header.get("dtype"))
+    except (TypeError, ValueError):
+        dtype = None
+    if dtype not in DTYPES.values():
+        raise LandmarkFormatError(f"unsupported dtype {header.get('dtype')}")
+    shape = header.get("shape")
+    if not (isinstance(shape, list) and len(shape) == 3
+            and all(type(n) is int for n in shape) and shape[0] >= 0
+            and shape[1:] == [NUM_LANDMARKS, len(LANDMARK_CHANNELS)]):
+        raise LandmarkFormatError(f"unsupported shape {shape}")
+    return header, end
+
+
+def _array_nbytes(header):
+    return int(np.prod(header["shape"])) * np.dtype(header["dtype"]).itemsize
+
+
+def to_bytes(landmarks, dtype="float32", **meta):
+    """Header + array as one bytes object (for HTTP bodies)."""
+    arr = np.ascontiguousarray(landmarks, dtype=DTYPES[dtype])
+    return encode_header(arr.shape, arr.dtype, **meta) + arr.tobytes()
+
+
+def from_bytes(data):
+    """
+    (landmarks view, header) over a bytes-like body. No copy: the array
+    is read-only and shares `data`'s memory.
+    """
+    header, offset = decode_header(memoryview(data)[:ALIGNMENT * 64])
+    if len(data) != offset + _array_nbytes(header):
+        raise LandmarkFormatError("array size does not match the header")
+    arr = np.frombuffer(data, dtype=header["dtype"], offset=offset)
+    return arr.reshape(header["shape"]), header
+
+
+def write_landmarks(f, landmarks, dtype="float32", **meta):
+    """Writes a track to an open binary file (the array without a copy)."""
+    arr = np.ascontiguousarray(landmarks, dtype=DTYPES[dtype])
+    f.write(encode_header(arr.shape, arr.dtype, **meta))
+    # a flat byte view: memoryview.cast() rejects shapes with a zero (empty tracks)
+    f.write(memoryview(arr.reshape(-1).view(np.uint8)))
+
+
+def open_landmarks(path):
+    """
+    (landmarks, header) for a .lmk file. The array is a read-only
+    np.memmap, so only the frames / joints actually touched are paged in.
+    """
+    with open(path, "rb") as f:
+        head = f.read(ALIGNMENT * 64)
+        header, offset = decode_header(head)
+        f.seek(0, 2)
+        size = f.tell()
+    if size != offset + _array_nbytes(header):
+        raise LandmarkFormatError("array size does not match the header")
+    shape = tuple(header["shape"])
+    if shape[0] == 0:
+        # mmap can't map zero bytes
+        return np.empty(shape, dtype=header["dtype"]), header
+    return np.memmap(path, dtype=header["dtype"], mode="r", offset=offset, shape=shape), header
@@ -0,0 +1,193 @@
+"""
+Landmark-only workout uploads.
+
+Clients that already run a pose estimator on the device (MediaPipe
+Tasks in the browser, ML Kit / BlazePose on phones) upload the pose
+time series instead of the video. The server then only runs the rep
+counters and form feedback over an (N, 33, 4) array, which takes
+milliseconds instead of seconds of decoding and inference.
+
+Two encodings are accepted:
+  JSON   : {"workout_type": "squat", "fps": 30, "width": 720, "height": 1280,
+            "landmarks": [[[x, y, z, visibility] x 33] | [] | null, ...]}
+  binary : application/octet-stream body of N x 33 x 4 little-endian
+           float16 or float32 values (NaN rows = no pose); workout_type,
+           dtype, fps, width and height go in the query string.
+           A .lmk track (landmark_format.py) works too and brings its
+           own dtype, fps and frame size.
+Coordinates are MediaPipe's: x / y normalized to the frame, visibility 0..1.
+"""
+import os
+
+import numpy as np
+from werkzeug.exceptions import BadRequest
+
+from kinematics import NUM_LANDMARKS
+from landmark_format import DTYPES, LandmarkFormatError, from_bytes, is_landmark_data
+from rep_counters import SIMPLE_COUNTERS
+
+# ~1 hour at 30 fps
+MAX_LANDMARK_FRAMES = int(os.getenv("WORKOUT_MAX_LANDMARK_FRAMES", "108000"))
+
+DEFAULT_FRAME_SIZE = (640, 480)
+DEFAULT_LANDMARK_FPS = 30.0
+
+
+class LandmarkUploadError(BadRequest):
+    """The uploaded landmark series is malformed."""
+
+    description = "Invalid landmark upload."
+
+
+def landmarks_from_rows(rows):
+    """
+    JSON landmarks ([[x, y, z, visibility], ...] x 33, visibility optional)
+    -> (33, 4) float32, or None for an empty / missing pose.
+    Raises ValueError for anything else.
+    """
+    if not rows:
+        return None
+    arr = np.asarray(rows, dtype=np.float32)
+    if arr.ndim != 2 or arr.shape[0] != NUM_LANDMARKS or arr.shape[1] not in (3, 4):
+        raise ValueError(f"expected {NUM_LANDMARKS}x3 or {NUM_LANDMARKS}x4 landmarks")
+    if arr.shape[1] == 3:
+        arr = np.concatenate([arr, np.ones((NUM_LANDMARKS, 1), dtype=np.float32)], axis=1)
+    return arr
+
+
+def _check_frames(count):
+    if count == 0:
+        raise LandmarkUploadError("No landmark frames in the upload.")
+    if MAX_LANDMARK_FRAMES and count > MAX_LANDMARK_FRAMES:
+        raise LandmarkUploadError(f"Too many frames (max {MAX_LANDMARK_FRAMES}).")
+
+
+def parse_landmark_json(frames):
+    """JSON frame list -> (N, 33, 4) float32 with NaN rows for missing poses."""
+    if not isinstance(frames, list):
+        raise LandmarkUploadError("'landmarks' must be a list of frames.")
+    _check_frames(len(frames))
+    packed = np.full((len(frames), NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+    for i, rows in enumerate(frames):
+        try:
+            row = landmarks_from_rows(rows)
+        except (ValueError, TypeError) as e:
+            raise LandmarkUploadError(f"Frame {i}: {e}")
+        if row is not None:
+            packed[i] = row
+    return packed
+
+
+def parse_landmark_binary(data, dtype="float32"):
+    """
+    Raw N x 33 x 4 little-endian floats -> read-only (N, 33, 4) view of
+    the body (no copy). The counters accept float16 as is: the angle maths
+    widens the x / y it uses to float32.
+    """
+    if dtype not in DTYPES:
+        raise LandmarkUploadError(f"dtype must be one of {', '.join(DTYPES)}.")
+    item = DTYPES[dtype]
+    frame_bytes = NUM_LANDMARKS * 4 * item.itemsize
+    if len(data) % frame_bytes:
+        raise LandmarkUploadError(
+            f"Body is not a whole number of {NUM_LANDMARKS}x4 {dtype} frames."
+        )
+    _check_frames(len(data) // frame_bytes)
+    return np.frombuffer(data, dtype=item).reshape(-1, NUM_LANDMARKS, 4)
+
+
+def _number(value, name, default):
+    if value in (None, ""):
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise LandmarkUploadError(f"'{name}' must be a number.")
+    if not number > 0:
+        raise LandmarkUploadError(f"'{name}' must be positive.")
+    return number
+
+
+def read_landmark_upload(request):
+    """
+    Parses a Flask request in either encoding.
+    Returns (landmarks, options) where options has workout_type (as sent,
+    may be None), fps, frame_size (w, h) and feedback (bool).
+    """
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            raise LandmarkUploadError("Body must be a JSON object.")
+        landmarks = parse_landmark_json(payload.get("landmarks"))
+        params = payload
+    else:
+        data = request.get_data(cache=False)
+        params = request.args
+        if is_landmark_data(data):
+            try:
+                landmarks, header = from_bytes(data)
+            except LandmarkFormatError as e:
+                raise LandmarkUploadError(f"Invalid landmark track: {e}")
+            _check_frames(len(landmarks))
+            params = {**header, **params.to_dict()}
+        else:
+            landmarks = parse_landmark_binary(data, params.get("dtype", "float32"))
+
+    feedback = params.get("feedback", True)
+    if isinstance(feedback, str):
+        feedback = feedback.lower() not in ("0", "false", "no", "off")
+    options = {
+        "workout_type": params.get("workout_type"),
+        "fps": _number(params.get("fps"), "fps", DEFAULT_LANDMARK_FPS),
+        "frame_size": (
+            int(_number(params.get("width"), "width", DEFAULT_FRAME_SIZE[0])),
+            int(_number(params.get("height"), "height", DEFAULT_FRAME_SIZE[1])),
+        ),
+        "feedback": bool(feedback),
+    }
+    return landmarks, options
+
+
+def score_landmarks(landmarks, workout_types, frame_size=DEFAULT_FRAME_SIZE,
+                    counter_classes=SIMPLE_COUNTERS, feedback=True):
+    """
+    Runs the rep counters over an (N, 33, 4) series.
+
+    feedback=False takes the vectorized update_series() path (counts only).
+    Otherwise counters step frame by frame, as during a rendered analysis,
+    and form counters report how many frames each feedback message was
+    shown for. Returns {"counts", "stages", "feedback"}.
+    """
+    counters = [counter_classes[t]() for t in workout_types]
+    coaching = {}
+
+    if not feedback:
+        for counter in counters:
+            counter.update_series(landmarks, frame_size)
+    else:
+        coaching = {c.name: {} for c in counters if hasattr(c, "feedback_text")}
+        missing = np.isnan(landmarks[:, 0, 0])
+        for i in range(len(landmarks)):
+            row = None if missing[i] else landmarks[i]
+            for counter in counters:
+                counter.update(row, frame_size)
+                if counter.name in coaching:
+                    seen = coaching[counter.name]
+                    for message in counter.feedback_text.split(" / "):
+                        seen[message] = seen.get(message, 0) + 1
+
+    return {
+        "counts": {c.name: c.count for c in counters},
+        "stages": {c.name: c.stage for c in counters},
+        "feedback": {
+            c.name: {
+                "final": c.feedback_text,
+                "messages": [
+                    {"message": message, "frames": frames}
+                    for message, frames in sorted(coaching[c.name].items(),
+                                                  key=lambda kv: -kv[1])
+                ],
+            }
+            for c in counters if c.name in coaching
+        },
+    }
@@ -0,0 +1,232 @@
+"""
+Live (webcam) rep counting.
+
+One LiveWorkoutSession per WebSocket connection. The browser sends
+either landmarks it computed itself (cheap: only the rep state machines
+run here) or small JPEG frames, which go through a Pose graph checked
+out of the pool for the lifetime of the connection so MediaPipe keeps
+its tracking state between frames. Counters are the same classes the
+video analyzers use, updated one frame at a time.
+
+FrameMailbox sits between the socket reader and the session: when
+inference falls behind, queued camera frames are replaced by the
+newest one instead of piling up, so replies stay close to real time.
+Landmark messages are tiny and are always processed in order.
+"""
+import json
+import base64
+import threading
+from collections import deque
+from contextlib import ExitStack
+
+import cv2
+import numpy as np
+
+from rep_counters import SIMPLE_COUNTERS
+from landmark_uploads import DEFAULT_FRAME_SIZE, landmarks_from_rows
+from pose_engine import PoseVideoEngine, landmarks_to_array, pose_pool
+
+# live frames are small already; cap inference size a bit lower than videos
+LIVE_MAX_INFERENCE_SIDE = 480
+
+
+def decode_image(data):
+    """JPEG/PNG bytes or a (data URL) base64 string -> BGR frame, or None."""
+    if isinstance(data, str):
+        if "," in data:
+            data = data.split(",", 1)[1]
+        data = base64.b64decode(data)
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if not buf.size:
+        return None
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+class LiveWorkoutSession:
+    """Counters + (lazily) a dedicated Pose graph for one live connection."""
+
+    def __init__(self, workout_types, counter_classes=SIMPLE_COUNTERS, pose_options=None):
+        self.counter_classes = counter_classes
+        self.engine = PoseVideoEngine(
+            [counter_classes[t]() for t in workout_types],
+            pose_options=pose_options,
+            max_inference_side=LIVE_MAX_INFERENCE_SIDE,
+            pipeline_depth=0,
+        )
+        self.frames = 0
+        self.has_pose = False
+        self._stack = ExitStack()
+        self._pose = None
+
+    @property
+    def counters(self):
+        return self.engine.counters
+
+    def reset(self, workout_types=None):
+        """Fresh counters (optionally for other exercises); Pose is kept."""
+        names = workout_types or [c.name for c in self.counters]
+        self.engine.counters = [self.counter_classes[t]() for t in names]
+        self.frames = 0
+
+    def update_landmarks(self, landmarks, frame_size=DEFAULT_FRAME_SIZE):
+        self.frames += 1
+        self.has_pose = landmarks is not None
+        for counter in self.counters:
+            counter.update(landmarks, frame_size)
+
+    def update_image(self, frame):
+        """Runs Pose on one BGR camera frame, then the counters."""
+        if self._pose is None:
+            self._pose = self._stack.enter_context(pose_pool.checkout(self.engine.pose_options))
+        h, w = frame.shape[:2]
+        image = self.engine.inference_image(frame)
+        try:
+            results = self._pose.process(image)
+        except Exception as e:
+            # close the graph instead of pooling it; the next frame checks out a fresh one
+            self._stack.__exit__(type(e), e, e.__traceback__)
+            self._stack = ExitStack()
+            self._pose = None
+            raise
+        self.update_landmarks(landmarks_to_array(results.pose_landmarks), (w, h))
+
+    def state(self):
+        return {
+            # the exercises actually counted (unknown requested types are dropped)
+            "workout_types": [c.name for c in self.counters],
+            "counts": {c.name: c.count for c in self.counters},
+            "stages": {c.name: c.stage for c in self.counters},
+            "feedback": {
+                c.name: c.feedback_text for c in self.counters if hasattr(c, "feedback_text")
+            },
+            "pose": self.has_pose,
+            "frames": self.frames,
+        }
+
+    def close(self):
+        # returns the Pose graph (reset) to the pool
+        self._stack.close()
+        self._pose = None
+
+
+class FrameMailbox:
+    """
+    Hand-off between the socket reader thread and the processing loop.
+    put() of a camera frame discards camera frames still waiting (they are
+    stale); other messages are kept in order. get() blocks.
+    """
+
+    def __init__(self):
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, message, is_frame=False):
+        with self._cond:
+            if is_frame:
+                kept = deque(m for m in self._items if not m[1])
+                self.dropped += len(self._items) - len(kept)
+                self._items = kept
+            self._items.append((message, is_frame))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def get(self):
+        """Next message, or None once closed and drained."""
+        with self._cond:
+            while not self._items and not self._closed:
+                self._cond.wait()
+            if not self._items:
+                return None
+            return self._items.popleft()[0]
+
+
+def parse_message(message):
+    """
+    Socket message -> payload dict (None if it is not valid JSON).
+
+      binary bytes                          : a JPEG/PNG camera frame
+      {"type": "frame", "image_b64": ...}   : same, base64 / data URL
+      {"type": "landmarks", "landmarks": [[x, y, z, v] x 33] | [],
+       "width": w, "height": h}             : client-side pose
+      {"type": "reset", "workout_types": [...]}
+    Any "seq" in a JSON message is echoed back for latency tracking.
+    """
+    if isinstance(message, (bytes, bytearray)):
+        return {"type": "frame", "image": bytes(message)}
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def handle_message(session, payload):
+    """Applies one parsed message to the session; returns the reply dict."""
+    if not payload:
+        return {"ok": False, "error": "Invalid message"}
+
+    kind = payload.get("type")
+    seq = payload.get("seq")
+    try:
+        if kind == "landmarks":
+            size = (int(payload.get("width") or DEFAULT_FRAME_SIZE[0]),
+                    int(payload.get("height") or DEFAULT_FRAME_SIZE[1]))
+            session.update_landmarks(landmarks_from_rows(payload.get("landmarks")), size)
+        elif kind == "frame":
+            frame = decode_image(payload.get("image") or payload.get("image_b64") or b"")
+            if frame is None:
+                return {"ok": False, "error": "Could not decode frame", "seq": seq}
+            session.update_image(frame)
+        elif kind == "reset":
+            names = [t for t in payload.get("workout_types") or [] if t in session.counter_classes]
+            session.reset(names or None)
+        else:
+            return {"ok": False, "error": f"Unknown message type: {kind}", "seq": seq}
+    except (ValueError, TypeError, RuntimeError, cv2.error) as e:
+        # bad input or a failed Pose graph: report it, keep the socket open
+        return {"ok": False, "error": str(e), "seq": seq}
+
+    return {"ok": True, "seq": seq, **session.state()}
+
+
+def serve_live_socket(ws, workout_types, counter_classes=SIMPLE_COUNTERS, pose_options=None):
+    """
+    WebSocket loop (flask-sock style `ws` with receive()/send()).
+    A reader thread keeps receiving into a FrameMailbox while this thread
+    processes the newest work and replies with JSON.
+    """
+    session = LiveWorkoutSession(workout_types, counter_classes, pose_options)
+    mailbox = FrameMailbox()
+
+    def read():
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                # {} for invalid messages: None is the mailbox's "closed"
+                payload = parse_message(message) or {}
+                mailbox.put(payload, is_frame=payload.get("type") == "frame")
+        except Exception:
+            pass  # connection closed
+        finally:
+            mailbox.close()
+
+    reader = threading.Thread(target=read, name="live-ws-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            payload = mailbox.get()
+            if payload is None:
+                break
+            reply = handle_message(session, payload)
+            reply["dropped"] = mailbox.dropped
+            ws.send(json.dumps(reply))
+    finally:
+        session.close()
@@ -0,0 +1,87 @@
+"""
+Serving of processed workout videos.
+
+Rendered outputs are never rewritten once finished (every job writes
+to a fresh uuid name), so they are sent with a strong ETag and a
+year-long immutable Cache-Control; players then scrub with Range
+requests (206) against the browser cache. Files that still change, like
+a growing HLS playlist, are revalidated on every request instead.
+
+MEDIA_OFFLOAD hands the byte copying to the front server:
+  "x-sendfile" : X-Sendfile header (Apache mod_xsendfile, lighttpd)
+  "x-accel"    : X-Accel-Redirect to MEDIA_ACCEL_PREFIX + path relative to
+                 the media root (an nginx `internal` location aliased to it)
+"""
+import os
+import mimetypes
+
+from flask import abort, current_app, make_response, request
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+MEDIA_OFFLOAD = os.getenv("MEDIA_OFFLOAD", "").strip().lower()
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/protected-media/")
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+MEDIA_TYPES = {
+    ".mp4": "video/mp4",
+    ".m4s": "video/mp4",
+    ".webm": "video/webm",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".lmk": "application/vnd.fitsmart.landmarks",
+}
+
+
+def strong_etag(st):
+    """
+    Validator from size + nanosecond mtime. Any write to the file changes
+    it, which is all a strong ETag needs for files that aren't edited in
+    place, and it costs one stat() instead of hashing the video.
+    """
+    return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+def media_type(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return MEDIA_TYPES.get(ext) or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+def send_media(root, filename, immutable=True, offload=MEDIA_OFFLOAD):
+    """
+    Response for `filename` under `root` with a strong ETag, Range and
+    conditional request support. immutable=False (for files that are
+    still growing) sends no-cache so clients revalidate.
+    Returns 404 for paths outside root or missing files.
+    """
+    path = safe_join(root, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    st = os.stat(path)
+    etag = strong_etag(st)
+    mimetype = media_type(filename)
+
+    if offload == "x-accel":
+        # nginx serves the bytes (and Range/conditionals); Python only routes
+        response = make_response("")
+        rel_path = os.path.relpath(path, root)
+        response.headers["X-Accel-Redirect"] = MEDIA_ACCEL_PREFIX + rel_path.replace(os.sep, "/")
+        response.headers["Content-Type"] = mimetype
+        response.set_etag(etag)
+    else:
+        response = send_file(
+            path,
+            request.environ,
+            mimetype=mimetype,
+            conditional=True,
+            etag=etag,
+            last_modified=st.st_mtime,
+            use_x_sendfile=offload == "x-sendfile",
+            response_class=current_app.response_class,
+        )
+
+    if immutable:
+        response.headers["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    return response
@@ -0,0 +1,143 @@
+"""
+Persistent cache of vision nutrition results.
+
+A food photo is sent to OpenAI at most once per model: results are
+stored in a small SQLite database keyed by the SHA-256 of the image
+bytes that would be sent and the model name, so re-uploads (and the
+live camera pointed at the same plate) come back in milliseconds.
+
+Entries expire after `ttl` seconds and the table is kept under
+`max_entries` by dropping the least recently used rows. Hit / miss /
+eviction counters are kept in memory for the metrics endpoint.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nutrition_cache (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL
+)
+"""
+
+
+def image_digest(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class NutritionCache:
+    """
+    path        : SQLite file (created on first use)
+    ttl         : seconds a result stays valid (None = forever)
+    max_entries : LRU bound on stored results (None = unbounded)
+    """
+
+    def __init__(self, path, ttl=None, max_entries=None):
+        self.path = path
+        self.ttl = ttl or None
+        self.max_entries = max_entries or None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS nutrition_cache_used ON nutrition_cache (used)")
+
+    @contextmanager
+    def _connect(self):
+        # one short-lived connection per call: Flask serves from many threads
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def key(digest, model):
+        return f"{model}:{digest}"
+
+    def get(self, digest, models):
+        """
+        (model, result dict) of the first of `models` with a cached result
+        for this image digest, or (None, None). One lookup = one hit / miss.
+        """
+        now = time.time()
+        found = None
+        try:
+            with self._connect() as conn:
+                for model in models:
+                    key = self.key(digest, model)
+                    row = conn.execute(
+                        "SELECT result, created FROM nutrition_cache WHERE key=?", (key,)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    if self.ttl and now - row[1] > self.ttl:
+                        conn.execute("DELETE FROM nutrition_cache WHERE key=?", (key,))
+                        with self._lock:
+                            self.expired += 1
+                        continue
+                    conn.execute("UPDATE nutrition_cache SET used=? WHERE key=?", (now, key))
+                    found = model, json.loads(row[0])
+                    break
+        except sqlite3.Error as e:
+            print("Warning: nutrition cache read failed:", e)
+
+        with self._lock:
+            if found is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return found or (None, None)
+
+    def put(self, digest, model, result):
+        """Stores a result, then trims the table to max_entries (LRU)."""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO nutrition_cache (key, model, result, created, used) "
+                    "VALUES (?,?,?,?,?)",
+                    (self.key(digest, model), model, json.dumps(result), now, now),
+                )
+                if self.max_entries:
+                    removed = conn.execute(
+                        "DELETE FROM nutrition_cache WHERE key IN ("
+                        "SELECT key FROM nutrition_cache ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,),
+                    ).rowcount
+                    if removed > 0:
+                        with self._lock:
+                            self.evicted += removed
+        except sqlite3.Error as e:
+            print("Warning: nutrition cache write failed:", e)
+
+    def metrics(self):
+        try:
+            with self._connect() as conn:
+                entries = conn.execute("SELECT COUNT(*) FROM nutrition_cache").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
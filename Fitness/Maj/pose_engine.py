@@ -0,0 +1,837 @@
+"""
+Single-pass pose analysis engine for workout videos.
+
+PoseVideoEngine decodes a clip once, runs MediaPipe Pose once per
+frame and hands a compact (33, 4) landmark array to every attached
+rep counter (see rep_counters.py). Several counters can share one
+pass, so one upload can be scored for several exercises without
+decoding or inferring the video again.
+"""
+import os
+import math
+import queue
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+
+import cv2
+import numpy as np
+import mediapipe as mp
+
+from kinematics import NUM_LANDMARKS
+from rep_counters import SIMPLE_COUNTERS
+from landmark_cache import hash_file, pack_landmarks, unpack_landmarks
+from video_sinks import open_sink
+from exercise_detection import (
+    SegmentedCounter,
+    build_timeline,
+    detect_segments,
+    segment_counters,
+    segment_report,
+)
+from rep_events import rep_events
+
+mp_pose = mp.solutions.pose
+
+POSE_CONNECTIONS = tuple(sorted(mp_pose.POSE_CONNECTIONS))
+
+# Matches mediapipe.solutions.drawing_utils defaults
+VISIBILITY_THRESHOLD = 0.5
+WHITE = (224, 224, 224)
+
+# ---------- Skeleton styles ----------
+# app.py: pink joints, cyan bones
+DEFAULT_SKELETON_STYLE = {
+    "landmark_color": (255, 0, 255),
+    "landmark_thickness": 2,
+    "landmark_radius": 2,
+    "connection_color": (0, 255, 255),
+    "connection_thickness": 2,
+}
+# test.py: pink sticks
+PINK_SKELETON_STYLE = {
+    "landmark_color": (255, 0, 255),
+    "landmark_thickness": 3,
+    "landmark_radius": 4,
+    "connection_color": (255, 0, 255),
+    "connection_thickness": 2,
+}
+
+# frames buffered between decode / inference / encode (0 = no threads)
+PIPELINE_DEPTH = int(os.getenv("POSE_PIPELINE_DEPTH", "8"))
+
+# Long clips: segment length and warm-up overlap (seconds) for
+# PoseVideoEngine(segment_workers=N), see infer_segments()
+SEGMENT_SECONDS = float(os.getenv("POSE_SEGMENT_SECONDS", "120"))
+SEGMENT_OVERLAP = float(os.getenv("POSE_SEGMENT_OVERLAP", "2"))
+
+DEFAULT_POSE_OPTIONS = {
+    "min_detection_confidence": 0.5,
+    "min_tracking_confidence": 0.5,
+}
+
+
+def landmarks_to_array(pose_landmarks):
+    """
+    Converts a MediaPipe NormalizedLandmarkList into a (33, 4) float32
+    array of (x, y, z, visibility). Returns None when nothing was detected.
+    """
+    if pose_landmarks is None:
+        return None
+    return np.array(
+        [(lm.x, lm.y, lm.z, lm.visibility) for lm in pose_landmarks.landmark],
+        dtype=np.float32,
+    ).reshape(NUM_LANDMARKS, 4)
+
+
+def draw_pose(image, landmarks, style=DEFAULT_SKELETON_STYLE):
+    """
+    Draws the pose skeleton from a (33, 4) landmark array, the same way
+    mp_drawing.draw_landmarks does (low-visibility joints are skipped).
+    """
+    h, w = image.shape[:2]
+    visible = landmarks[:, 3] >= VISIBILITY_THRESHOLD
+    points = [(int(x * w), int(y * h)) for x, y in landmarks[:, :2]]
+
+    for start, end in POSE_CONNECTIONS:
+        if visible[start] and visible[end]:
+            cv2.line(image, points[start], points[end],
+                     style["connection_color"], style["connection_thickness"])
+
+    radius = style["landmark_radius"]
+    border_radius = max(radius + 1, int(radius * 1.2))
+    for idx, point in enumerate(points):
+        if not visible[idx]:
+            continue
+        cv2.circle(image, point, border_radius, WHITE, style["landmark_thickness"])
+        cv2.circle(image, point, radius, style["landmark_color"], style["landmark_thickness"])
+
+
+def report_progress(progress, frame_idx, total_frames, every=15):
+    """
+    Calls the optional progress callback every few frames with a 0..1 fraction.
+    Used by background jobs; a no-op for synchronous calls.
+    """
+    if progress is None or frame_idx % every:
+        return
+    progress(min(frame_idx / total_frames, 1.0) if total_frames > 0 else 0.0)
+
+
+def scaled_progress(progress, start, end):
+    """Maps a 0..1 progress callback onto the [start, end] part of another."""
+    if progress is None:
+        return None
+    return lambda fraction: progress(start + (end - start) * fraction)
+
+
+class PosePool:
+    """
+    Process-wide pool of warm mp_pose.Pose graphs.
+
+    Building a Pose loads the TFLite graph, which is slow, so instances
+    are kept per configuration (confidences, smooth_landmarks,
+    model_complexity, ...) and reused across videos. checkout() hands
+    out an idle instance or builds a new one; on return the instance is
+    reset() so no tracking state leaks into the next video. At most
+    `max_idle` instances per configuration are kept.
+    """
+
+    def __init__(self, max_idle=2):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    @staticmethod
+    def _key(options):
+        return tuple(sorted(options.items()))
+
+    def _acquire(self, options):
+        with self._lock:
+            idle = self._idle.get(self._key(options))
+            if idle:
+                return idle.pop()
+        return mp_pose.Pose(**options)
+
+    def _release(self, options, pose):
+        try:
+            pose.reset()
+        except Exception:
+            pose.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(self._key(options), [])
+            if len(idle) < self.max_idle:
+                idle.append(pose)
+                return
+        pose.close()
+
+    @contextmanager
+    def checkout(self, options):
+        """Context manager yielding a ready Pose for `options`."""
+        pose = self._acquire(options)
+        try:
+            yield pose
+        except BaseException:
+            # don't return a graph that failed mid-video
+            pose.close()
+            raise
+        else:
+            self._release(options, pose)
+
+    def warm(self, options, count=1):
+        """Pre-build `count` idle instances for `options`."""
+        for _ in range(min(count, self.max_idle)):
+            self._release(options, mp_pose.Pose(**options))
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for poses in idle.values():
+            for pose in poses:
+                pose.close()
+
+
+pose_pool = PosePool(max_idle=int(os.getenv("POSE_POOL_MAX_IDLE", "2")))
+atexit.register(pose_pool.close_all)
+
+
+def warm_pose_pool(*option_sets):
+    """
+    Job-worker initializer: build one Pose per configuration up front so
+    the first job in a fresh worker process doesn't pay for graph loading.
+    """
+    for options in option_sets:
+        pose_pool.warm(dict(DEFAULT_POSE_OPTIONS, **options))
+
+
+def interpolate_landmarks(start, end, t):
+    """
+    Linear blend between two (33, 4) landmark arrays at 0 <= t <= 1.
+    If either side is missing, the earlier landmarks are held.
+    """
+    if start is None or end is None:
+        return start
+    return start + (end - start) * t
+
+
+# ---------- Pipeline stages ----------
+# Decode, inference and encode overlap on separate threads joined by
+# bounded queues: cv2 and the TFLite graph release the GIL, and a full
+# queue blocks the stage upstream of it (backpressure), so memory stays
+# at roughly `depth` frames per queue.
+_END = object()
+
+
+class _StageError:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _put(q, item, stop):
+    """Blocking put that gives up once the consumer has stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def prefetch(iterable, depth):
+    """
+    Iterates `iterable` on a background thread, at most `depth` items
+    ahead of the consumer. Exceptions are re-raised in the consumer;
+    closing the generator stops and joins the producer thread.
+    depth <= 0 just iterates inline.
+    """
+    if depth <= 0:
+        yield from iterable
+        return
+
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(q, item, stop):
+                    return
+        except BaseException as e:
+            _put(q, _StageError(e), stop)
+            return
+        _put(q, _END, stop)
+
+    thread = threading.Thread(target=produce, name="pose-decode", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _END:
+                return
+            if isinstance(item, _StageError):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class FrameWriter:
+    """
+    Video sink (see video_sinks.py) opened on the first frame, so the
+    size comes from the frames actually written; `path` is updated to
+    the file the sink really writes. With depth > 0, encoding runs on
+    its own thread behind a bounded queue; write() blocks when the
+    encoder falls `depth` frames behind.
+    """
+
+    def __init__(self, path, fps, depth=0, output_format="mp4", profile=None):
+        self.path = path
+        self.fps = fps
+        self.output_format = output_format
+        self.profile = profile
+        self.frames = 0
+        self._out = None
+        self._error = None
+        self._queue = None
+        self._stop = threading.Event()
+        if depth > 0:
+            self._queue = queue.Queue(maxsize=depth)
+            self._thread = threading.Thread(target=self._encode, name="pose-encode", daemon=True)
+            self._thread.start()
+
+    @property
+    def opened(self):
+        return self.frames > 0
+
+    def _write_now(self, frame):
+        if self._out is None:
+            h, w = frame.shape[:2]
+            self._out = open_sink(self.path, self.fps, (w, h), self.output_format, self.profile)
+            self.path = self._out.path
+        self._out.write(frame)
+
+    def _encode(self):
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is _END:
+                    return
+                self._write_now(frame)
+        except BaseException as e:
+            self._error = e
+            self._stop.set()
+
+    def write(self, frame):
+        if self._error is not None:
+            raise self._error
+        self.frames += 1
+        if self._queue is None:
+            self._write_now(frame)
+        elif not _put(self._queue, frame, self._stop):
+            raise self._error
+
+    def close(self):
+        """Drains pending frames, releases the writer, re-raises encode errors."""
+        if self._queue is not None:
+            _put(self._queue, _END, self._stop)
+            self._thread.join()
+            self._queue = None
+        if self._out is not None:
+            self._out.release()
+            self._out = None
+        if self._error is not None:
+            raise self._error
+
+
+def decode_frames(cap, stride, render, frame_filter=None, first_index=0):
+    """
+    Yields (is_key, frame) for every frame of an open VideoCapture.
+    Key frames are every `stride`-th one, counted from the start of the
+    clip (`first_index` is the position the capture was seeked to).
+    When not rendering, skipped frames are grabbed without retrieving
+    pixels and yield frame=None.
+    """
+    frame_idx = first_index
+    while True:
+        is_key = frame_idx % stride == 0
+        if not is_key and not render:
+            if not cap.grab():
+                return
+            frame = None
+        else:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            if frame_filter is not None:
+                frame = frame_filter(frame)
+        frame_idx += 1
+        yield is_key, frame
+
+
+def open_at(video_path, index):
+    """
+    VideoCapture whose next read() returns frame `index`. Seeking with
+    CAP_PROP_POS_FRAMES is not frame-accurate for every codec or for
+    variable frame rate streams: when the position read back is off, the
+    clip is reopened and the first `index` frames are grabbed and dropped.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not index or not cap.isOpened():
+        return cap
+    cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == index:
+        return cap
+    cap.release()
+    cap = cv2.VideoCapture(video_path)
+    for _ in range(index):
+        if not cap.grab():
+            break
+    return cap
+
+
+class PoseVideoEngine:
+    """
+    Decode -> pose inference -> counters -> (optional) annotated output.
+
+    counters          : list of RepCounter instances, all fed from one pass
+    pose_options      : kwargs for mp_pose.Pose (confidence, smoothing, ...)
+    frame_filter      : optional fn(frame_bgr) -> frame_bgr applied before
+                        inference and drawing (test.py darkens frames)
+    skeleton_style    : colors/thickness for draw_pose
+    analysis_fps      : run inference at about this rate (None = every frame);
+                        counters see inferred frames only, skipped frames get
+                        interpolated landmarks for the annotated output
+    max_inference_side: downscale frames so the longest side is at most this
+                        many pixels before inference (None = source size)
+    pipeline_depth    : decode and encode run on their own threads with up
+                        to this many frames queued per stage (0 = serial)
+    segment_workers   : for clips longer than two segments, infer landmarks
+                        for time segments in this many processes and stitch
+                        the tracks (0/1 = one sequential pass)
+    segment_seconds   : segment length for segment_workers
+    segment_overlap   : seconds decoded and inferred before each segment so
+                        Pose tracking/smoothing has settled at the boundary
+    output_format     : "mp4" (one file) or "hls" (output_path is a playlist,
+                        segments appear while the clip is processed)
+    output_profile    : overrides for video_sinks.DEFAULT_OUTPUT_PROFILE
+                        (max_side, fps, max_bitrate, codec)
+    """
+
+    def __init__(self, counters, pose_options=None, frame_filter=None,
+                 skeleton_style=DEFAULT_SKELETON_STYLE, analysis_fps=None,
+                 max_inference_side=None, pipeline_depth=PIPELINE_DEPTH,
+                 segment_workers=0, segment_seconds=SEGMENT_SECONDS,
+                 segment_overlap=SEGMENT_OVERLAP, output_format="mp4",
+                 output_profile=None):
+        self.counters = list(counters)
+        self.pose_options = dict(DEFAULT_POSE_OPTIONS, **(pose_options or {}))
+        self.frame_filter = frame_filter
+        self.skeleton_style = skeleton_style
+        self.analysis_fps = analysis_fps
+        self.max_inference_side = max_inference_side
+        self.pipeline_depth = max(0, int(pipeline_depth or 0))
+        self.segment_workers = max(0, int(segment_workers or 0))
+        self.segment_seconds = segment_seconds
+        self.segment_overlap = segment_overlap
+        self.output_format = output_format
+        self.output_profile = output_profile
+
+    def frame_stride(self, fps):
+        """Infer every Nth frame so inference runs at about analysis_fps."""
+        if not self.analysis_fps or self.analysis_fps >= fps:
+            return 1
+        return max(1, int(round(fps / self.analysis_fps)))
+
+    def inference_image(self, frame):
+        """Downscaled, read-only RGB copy of a BGR frame for pose.process()."""
+        h, w = frame.shape[:2]
+        if self.max_inference_side and max(h, w) > self.max_inference_side:
+            scale = self.max_inference_side / float(max(h, w))
+            frame = cv2.resize(
+                frame,
+                (max(1, int(w * scale)), max(1, int(h * scale))),
+                interpolation=cv2.INTER_AREA,
+            )
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        image.flags.writeable = False
+        return image
+
+    def cache_signature(self):
+        """Engine options that change the landmark track (landmark cache key)."""
+        return {
+            "pose_options": self.pose_options,
+            "analysis_fps": self.analysis_fps,
+            "max_inference_side": self.max_inference_side,
+            "frame_filter": getattr(self.frame_filter, "__name__", None),
+        }
+
+    def replay(self, track, progress=None):
+        """Counts only from a cached landmark track: no decoding, no inference."""
+        frame_size = (track["width"], track["height"])
+        for counter in self.counters:
+            counter.update_series(track["landmarks"], frame_size)
+        if progress is not None:
+            progress(1.0)
+
+        return {
+            "counts": {c.name: c.count for c in self.counters},
+            "frames": track["frames"],
+            "fps": track["fps"],
+            "inferred_frames": 0,
+            "output_path": None,
+        }
+
+    def inference_options(self):
+        """Constructor kwargs that reproduce this engine's landmark track."""
+        return {
+            "pose_options": self.pose_options,
+            "frame_filter": self.frame_filter,
+            "analysis_fps": self.analysis_fps,
+            "max_inference_side": self.max_inference_side,
+            "pipeline_depth": self.pipeline_depth,
+        }
+
+    def infer_range(self, video_path, start, end, warmup_from, stride):
+        """
+        Landmarks for the key frames in [start, end) (end=None: to the end
+        of the clip). Decoding and inference begin at warmup_from <= start;
+        the warm-up results only prime Pose tracking and are dropped.
+        Returns a partial track: landmarks, frames (decoded in range),
+        width, height.
+        """
+        cap = open_at(video_path, warmup_from)
+        if not cap.isOpened():
+            raise IOError(f"Cannot open video: {video_path}")
+
+        idx = warmup_from
+        w = h = 0
+        rows = []
+        frames = prefetch(
+            decode_frames(cap, stride, False, self.frame_filter, first_index=warmup_from),
+            self.pipeline_depth,
+        )
+        try:
+            with pose_pool.checkout(self.pose_options) as pose:
+                for is_key, frame in frames:
+                    if end is not None and idx >= end:
+                        break
+                    idx += 1
+                    if not is_key:
+                        continue
+                    h, w = frame.shape[:2]
+                    results = pose.process(self.inference_image(frame))
+                    if idx > start:
+                        rows.append(landmarks_to_array(results.pose_landmarks))
+        finally:
+            frames.close()
+            cap.release()
+
+        return {
+            "landmarks": pack_landmarks(rows),
+            "frames": max(0, idx - start),
+            "width": w,
+            "height": h,
+        }
+
+    def segments(self, total_frames, fps, stride):
+        """
+        [(warmup_from, start, end)] covering the clip, with segment starts
+        on key frames so the stitched track has the sequential stride.
+        The last segment runs to the end of the stream (end=None), since
+        CAP_PROP_FRAME_COUNT is only an estimate.
+        """
+        length = max(stride, int(self.segment_seconds * fps) // stride * stride)
+        warmup = int(math.ceil(self.segment_overlap * fps / stride)) * stride
+        starts = list(range(0, total_frames, length))
+        return [
+            (max(0, start - warmup), start, starts[i + 1] if i + 1 < len(starts) else None)
+            for i, start in enumerate(starts)
+        ]
+
+    def infer_segments(self, video_path, progress=None):
+        """
+        Parallel landmark pass for long clips: every segment is inferred
+        in its own process and the partial tracks are concatenated into
+        one track, identical in layout to a sequential run. Counters then
+        run over the stitched track in order, so reps spanning a segment
+        boundary are counted exactly as in a sequential pass.
+        Returns None when the clip is too short to be worth splitting, or
+        when a segment does not line up (the caller then runs sequentially).
+        """
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if not fps or fps <= 0 or np.isnan(fps):
+            fps = 25.0
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        cap.release()
+
+        stride = self.frame_stride(fps)
+        segments = self.segments(total_frames, fps, stride)
+        if self.segment_workers < 2 or len(segments) < 3:
+            return None
+
+        parts = [None] * len(segments)
+        options = self.inference_options()
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(self.segment_workers, len(segments)),
+                                 mp_context=ctx) as pool:
+            futures = {
+                pool.submit(_infer_segment, options, video_path, start, end, warmup_from, stride): i
+                for i, (warmup_from, start, end) in enumerate(segments)
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                parts[futures[future]] = future.result()
+                if progress is not None:
+                    progress(done / len(segments))
+
+        for (warmup_from, start, end), part in zip(segments, parts):
+            # every segment must hold exactly its frames and key frames,
+            # otherwise the stitched track would not line up with a sequential one
+            if (end is not None and part["frames"] != end - start) or (
+                len(part["landmarks"]) != -(-part["frames"] // stride)
+            ):
+                print(f"Warning: segment {start}-{end} of {video_path} does not line up; "
+                      "analyzing sequentially")
+                return None
+
+        sized = [p for p in parts if p["width"]]
+        return {
+            "landmarks": np.concatenate([p["landmarks"] for p in parts]),
+            "stride": stride,
+            "fps": fps,
+            "frames": sum(p["frames"] for p in parts),
+            "width": sized[0]["width"] if sized else 0,
+            "height": sized[0]["height"] if sized else 0,
+        }
+
+    def run(self, video_path, output_path=None, progress=None, track=None):
+        """
+        Processes the whole clip. When output_path is None nothing is drawn
+        or encoded (counts only) and skipped frames are not even decoded.
+        With a cached `track` (see landmark_cache.py) pose inference is
+        skipped; counts only then never opens the video at all.
+
+        Returns a dict with per-counter `counts`, `frames`, `fps`,
+        `inferred_frames`, `output_path` (None when not rendered) and,
+        when inference ran, the new `track`. Returns None if the video
+        cannot be opened.
+        """
+        render = output_path is not None
+        if track is not None and not render:
+            return self.replay(track, progress)
+
+        if track is None and self.segment_workers > 1:
+            # long clip: parallel landmark pass, then counters (and drawing)
+            # over the stitched track exactly like a cache hit
+            infer_share = 0.6 if render else 1.0
+            track = self.infer_segments(video_path, scaled_progress(progress, 0.0, infer_share))
+            if track is not None:
+                result = self.run(video_path, output_path,
+                                  scaled_progress(progress, infer_share, 1.0), track)
+                if result is not None:
+                    result["inferred_frames"] = len(track["landmarks"])
+                    result["track"] = track
+                return result
+
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return None
+
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if not fps or fps <= 0 or np.isnan(fps):
+            fps = 25.0
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        stride = track["stride"] if track is not None else self.frame_stride(fps)
+        cached_rows = unpack_landmarks(track["landmarks"]) if track is not None else None
+
+        out = None
+        if render:
+            out = FrameWriter(output_path, fps, self.pipeline_depth,
+                              self.output_format, self.output_profile)
+
+        def write(frame, landmarks):
+            if landmarks is not None:
+                draw_pose(frame, landmarks, self.skeleton_style)
+            for slot, counter in enumerate(self.counters):
+                counter.draw(frame, slot)
+            out.write(frame)
+
+        def flush(pending, start, end):
+            # skipped frames between two inferred ones: blended skeleton,
+            # counter overlay as of the earlier inferred frame
+            for i, frame in enumerate(pending, 1):
+                write(frame, interpolate_landmarks(start, end, i / (len(pending) + 1)))
+            pending.clear()
+
+        frame_idx = 0
+        inferred = 0
+        w = h = 0
+        rows = []
+        pending = []
+        prev_landmarks = None
+        # decode on a producer thread, inference + counters + drawing here
+        # (they own the Pose graph and counter state), encode on the writer's
+        frames = prefetch(decode_frames(cap, stride, render, self.frame_filter),
+                          self.pipeline_depth)
+        pose_ctx = pose_pool.checkout(self.pose_options) if track is None else nullcontext()
+        try:
+            with pose_ctx as pose:
+                for is_key, frame in frames:
+                    frame_idx += 1
+                    report_progress(progress, frame_idx, total_frames)
+                    if not is_key:
+                        if render:
+                            pending.append(frame)
+                        continue
+
+                    h, w = frame.shape[:2]
+                    if cached_rows is not None:
+                        landmarks = next(cached_rows, None)
+                    else:
+                        results = pose.process(self.inference_image(frame))
+                        landmarks = landmarks_to_array(results.pose_landmarks)
+                        rows.append(landmarks)
+                        inferred += 1
+
+                    if not render:
+                        # counts only: counters run vectorized over the track below
+                        continue
+
+                    flush(pending, prev_landmarks, landmarks)
+                    for counter in self.counters:
+                        counter.update(landmarks, (w, h))
+                    write(frame, landmarks)
+                    prev_landmarks = landmarks
+
+                if render:
+                    flush(pending, prev_landmarks, None)
+        finally:
+            # stop the decoder before releasing the capture it reads from
+            frames.close()
+            cap.release()
+            if out is not None:
+                out.close()
+
+        packed = pack_landmarks(rows) if track is None else None
+        if not render:
+            for counter in self.counters:
+                counter.update_series(packed, (w, h))
+
+        result = {
+            "counts": {c.name: c.count for c in self.counters},
+            "frames": frame_idx,
+            "fps": fps,
+            "inferred_frames": inferred,
+            "output_path": out.path if out is not None and out.opened else None,
+        }
+        if track is None:
+            result["track"] = {
+                "landmarks": packed,
+                "stride": stride,
+                "fps": fps,
+                "frames": frame_idx,
+                "width": w,
+                "height": h,
+            }
+        return result
+
+
+def _infer_segment(options, video_path, start, end, warmup_from, stride):
+    """Process-pool entry point for PoseVideoEngine.infer_segments()."""
+    engine = PoseVideoEngine([], **options)
+    return engine.infer_range(video_path, start, end, warmup_from, stride)
+
+
+def _track_rep_events(counters, track):
+    """rep_events() of every counter over a track, in time order."""
+    if track is None:
+        return []
+    frame_size = (track["width"], track["height"])
+    events = []
+    for counter in counters:
+        if isinstance(counter, SegmentedCounter):
+            for start, end in counter.ranges:
+                events += rep_events(counter.counter_class, track["landmarks"][start:end],
+                                     frame_size, track["stride"], track["fps"], offset=start)
+        else:
+            events += rep_events(type(counter), track["landmarks"], frame_size,
+                                 track["stride"], track["fps"])
+    events.sort(key=lambda e: e["start_frame"])
+    return events
+
+
+def analyze_video(video_path, output_path, workout_types, progress=None, render=True,
+                  counter_classes=SIMPLE_COUNTERS, cache=None, video_hash=None,
+                  detect=False, **engine_options):
+    """
+    Scores one clip for one or more workout types in a single pose pass.
+    With render=False ("counts only") no annotated video is drawn or
+    encoded and output_path is ignored.
+    With a LandmarkCache, the landmark track for (video_hash, options) is
+    reused when present and stored after a fresh inference pass.
+    detect=True ignores workout_types unless nothing is recognised: the
+    exercises are detected from the track (exercise_detection.py) and
+    each detected segment is counted by its own counter; the result then
+    has `segments`, a `timeline` (with rest intervals, see
+    build_timeline) and counts per detected exercise.
+    `rep_events` lists every counted rep (rep_events.py).
+    The input video is never deleted here: callers drop it once
+    `landmarks_path` is set and no other job uses it (workout_jobs.InputPins).
+
+    Returns the PoseVideoEngine.run() dict (without the raw track, plus
+    `cached` and `landmarks_path`, the stored .lmk track or None), or
+    None if the video could not be opened.
+    Module-level (and free of Flask imports) so job workers can pickle it.
+    """
+    counters = [] if detect else [counter_classes[t]() for t in workout_types]
+    engine = PoseVideoEngine(counters, **engine_options)
+
+    track = None
+    if cache is not None:
+        video_hash = video_hash or hash_file(video_path)
+        track = cache.load(video_hash, engine.cache_signature())
+    cached = track is not None
+
+    new_track = None
+    segments = None
+    if detect:
+        if track is None:
+            # landmarks first (counts only, no counters), then classify
+            infer_share = 0.6 if render else 0.95
+            first = engine.run(video_path, None, scaled_progress(progress, 0.0, infer_share))
+            if first is None:
+                return None
+            track = new_track = first["track"]
+            progress = scaled_progress(progress, infer_share, 1.0)
+        segments = detect_segments(track["landmarks"], (track["width"], track["height"]),
+                                   track["fps"] / track["stride"])
+        engine.counters = segment_counters(segments, counter_classes) or [
+            counter_classes[t]() for t in workout_types
+        ]
+
+    result = engine.run(video_path, output_path if render else None, progress=progress, track=track)
+    if result is None:
+        return None
+
+    new_track = result.pop("track", None) or new_track
+    if new_track is not None:
+        result["inferred_frames"] = len(new_track["landmarks"])
+    result["rep_events"] = _track_rep_events(engine.counters, track or new_track)
+    if segments is not None:
+        result["segments"] = segment_report(segments, engine.counters, track["stride"],
+                                            track["fps"], track["frames"])
+        result["timeline"] = build_timeline(result["segments"], track["frames"], track["fps"])
+    stored = cached
+    if cache is not None and new_track is not None and new_track["frames"]:
+        stored = cache.save(video_hash, engine.cache_signature(), new_track)
+    result["cached"] = cached
+    result["landmarks_path"] = (
+        cache.path_for(video_hash, engine.cache_signature()) if cache is not None and stored else None
+    )
+    return result
@@ -0,0 +1,572 @@
+"""
+Per-exercise rep counters fed by PoseVideoEngine.
+
+A counter never touches MediaPipe objects: each frame it receives a
+(33, 4) float32 array of normalized landmarks (x, y, z, visibility),
+or None when no pose was found, plus the frame size. Counters keep
+their own state machine and know how to draw their overlay.
+
+When no overlay is needed, update_series() consumes a whole (N, 33, 4)
+clip at once: angles come from kinematics.joint_angles and the rep
+state machine runs as kinematics.hysteresis_reps over those arrays.
+
+Two families live here:
+- *Counter   : the simple angle thresholds used by app.py
+- *FormCounter: the stricter counters with live form feedback (test.py)
+"""
+import cv2
+import numpy as np
+
+from kinematics import (
+    NUM_LANDMARKS,
+    LEFT_SHOULDER,
+    RIGHT_SHOULDER,
+    LEFT_ELBOW,
+    RIGHT_ELBOW,
+    LEFT_WRIST,
+    RIGHT_WRIST,
+    LEFT_HIP,
+    RIGHT_HIP,
+    LEFT_KNEE,
+    RIGHT_KNEE,
+    LEFT_ANKLE,
+    RIGHT_ANKLE,
+    JOINTS,
+    calculate_angle,
+    hysteresis_reps,
+    joint_angles,
+    pixel_coords,
+)
+
+# ---------- Overlay colors (BGR) ----------
+PINK = (255, 0, 255)
+NEON_CYAN = (255, 255, 0)
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def pixel_point(landmarks, idx, frame_size):
+    """Integer pixel (x, y) of landmark `idx` for a frame of size (w, h)."""
+    w, h = frame_size
+    return int(landmarks[idx, 0] * w), int(landmarks[idx, 1] * h)
+
+
+class RepCounter:
+    """
+    Base class for rep counters.
+    Subclasses implement update() and draw(); `name` matches the
+    workout_type values posted by workouts.html.
+    """
+
+    name = "exercise"
+    label = "Reps"
+    # rep_signal(): is the rep counted at the peak of the movement (simple
+    # counters) or on the return to the start position (form counters)?
+    counts_on_return = False
+    # which extreme of the rep angle marks the peak ("min" or "max")
+    rep_peak = "min"
+
+    def __init__(self):
+        self.count = 0
+        self.stage = None
+
+    def update(self, landmarks, frame_size):
+        """Advance the state machine with one frame of landmarks (or None)."""
+        raise NotImplementedError
+
+    def update_series(self, landmarks, frame_size):
+        """
+        Advance over a whole (N, 33, 4) clip (NaN rows = no pose).
+        Subclasses override this with a vectorized version.
+        """
+        missing = np.isnan(landmarks[:, 0, 0])
+        for i in range(len(landmarks)):
+            self.update(None if missing[i] else landmarks[i], frame_size)
+
+    def rep_signal(self, landmarks, frame_size):
+        """
+        (enter, complete, angle) over an (N, 33, 4) clip: the two state
+        machine conditions update_series() counts with, and the (N,) joint
+        angle that describes the movement (rep_events.py).
+        """
+        raise NotImplementedError
+
+    def apply_reps(self, enter, complete, enter_stage, complete_stage):
+        """Run hysteresis_reps from the current stage and store the outcome."""
+        rep_frames, last = hysteresis_reps(enter, complete, primed=self.stage == enter_stage)
+        self.count += len(rep_frames)
+        if last == 1:
+            self.stage = enter_stage
+        elif last == 2:
+            self.stage = complete_stage
+        return rep_frames
+
+    def draw(self, image, slot=0):
+        """Draw this counter's overlay; `slot` stacks several counters."""
+        h = image.shape[0]
+        cv2.putText(image, f"{self.label}: {self.count}", (10, h - 20 - 30 * slot),
+                    FONT, 0.9, PINK, 2)
+
+
+# =========================================================
+# Simple counters (app.py thresholds)
+# =========================================================
+class AngleRepCounter(RepCounter):
+    """
+    Counts one rep each time the joint angle goes from extended
+    (> extended_angle) to flexed (< flexed_angle).
+    """
+
+    joints = (RIGHT_SHOULDER, RIGHT_ELBOW, RIGHT_WRIST)
+    angle_label = "Elbow angle"
+    extended_angle = 160
+    flexed_angle = 90
+    extended_stage = "up"
+    flexed_stage = "down"
+
+    def __init__(self, extended_angle=None, flexed_angle=None):
+        super().__init__()
+        if extended_angle is not None:
+            self.extended_angle = extended_angle
+        if flexed_angle is not None:
+            self.flexed_angle = flexed_angle
+        self.angle = None
+
+    def update(self, landmarks, frame_size):
+        if landmarks is None:
+            self.angle = None
+            return
+        w, h = frame_size
+        a, b, c = (landmarks[i, :2] * (w, h) for i in self.joints)
+        angle = calculate_angle(a, b, c)
+        self.angle = angle
+
+        if angle > self.extended_angle:
+            self.stage = self.extended_stage
+        if angle < self.flexed_angle and self.stage == self.extended_stage:
+            self.stage = self.flexed_stage
+            self.count += 1
+
+    def rep_signal(self, landmarks, frame_size):
+        angle = joint_angles(landmarks, frame_size, {"joint": self.joints})["joint"]
+        return angle > self.extended_angle, angle < self.flexed_angle, angle
+
+    def update_series(self, landmarks, frame_size):
+        extended, flexed, angle = self.rep_signal(landmarks, frame_size)
+        self.apply_reps(extended, flexed, self.extended_stage, self.flexed_stage)
+        last = angle[-1] if len(angle) else np.nan
+        self.angle = None if np.isnan(last) else float(last)
+
+    def draw(self, image, slot=0):
+        if self.angle is not None:
+            cv2.putText(image, f"{self.angle_label}: {int(self.angle)}", (10, 30 + 30 * slot),
+                        FONT, 0.7, PINK, 2)
+        super().draw(image, slot)
+
+
+class PushupCounter(AngleRepCounter):
+    name = "pushup"
+    label = "Push-ups"
+
+
+class SquatCounter(AngleRepCounter):
+    name = "squat"
+    label = "Squats"
+    joints = (RIGHT_HIP, RIGHT_KNEE, RIGHT_ANKLE)
+    angle_label = "Knee angle"
+    flexed_angle = 100
+
+
+class PullupCounter(AngleRepCounter):
+    name = "pullup"
+    label = "Pull-ups"
+    angle_label = "Arm angle"
+    extended_angle = 150
+    flexed_angle = 80
+    extended_stage = "down"
+    flexed_stage = "up"
+
+
+class JumpingJackCounter(RepCounter):
+    """Counts feet-together/arms-down -> feet-apart/arms-up transitions."""
+
+    name = "jumping_jack"
+    label = "Jumping Jacks"
+    rep_peak = "max"
+
+    def __init__(self):
+        super().__init__()
+        self.has_pose = False
+
+    def update(self, landmarks, frame_size):
+        self.has_pose = landmarks is not None
+        if landmarks is None:
+            return
+        w, h = frame_size
+        # distances in pixels
+        feet_dist = abs((landmarks[LEFT_ANKLE, 0] - landmarks[RIGHT_ANKLE, 0]) * w)
+        hands_dist = abs((landmarks[LEFT_WRIST, 1] - landmarks[RIGHT_WRIST, 1]) * h)
+
+        if feet_dist < 0.1 * w and hands_dist > 0.6 * h:
+            self.stage = "down"  # arms down, feet together
+        if feet_dist > 0.2 * w and hands_dist < 0.4 * h and self.stage == "down":
+            self.stage = "up"
+            self.count += 1
+
+    def rep_signal(self, landmarks, frame_size):
+        w, h = frame_size
+        feet_dist = np.abs((landmarks[:, LEFT_ANKLE, 0] - landmarks[:, RIGHT_ANKLE, 0]) * w)
+        hands_dist = np.abs((landmarks[:, LEFT_WRIST, 1] - landmarks[:, RIGHT_WRIST, 1]) * h)
+        # arm raise (hip-shoulder-elbow) as the rep angle
+        angle = joint_angles(landmarks, frame_size, {"arm": JOINTS["right_shoulder"]})["arm"]
+        return (
+            (feet_dist < 0.1 * w) & (hands_dist > 0.6 * h),
+            (feet_dist > 0.2 * w) & (hands_dist < 0.4 * h),
+            angle,
+        )
+
+    def update_series(self, landmarks, frame_size):
+        down, up, _angle = self.rep_signal(landmarks, frame_size)
+        self.apply_reps(down, up, "down", "up")
+        self.has_pose = len(landmarks) > 0 and not np.isnan(landmarks[-1, 0, 0])
+
+    def draw(self, image, slot=0):
+        if self.has_pose:
+            cv2.putText(image, f"Jacks: {self.count}", (10, 30 + 30 * slot), FONT, 0.7, PINK, 2)
+        super().draw(image, slot)
+
+
+# =========================================================
+# Form-feedback counters (test.py)
+# =========================================================
+class FormRepCounter(RepCounter):
+    """
+    Base for counters that also coach form.
+    Subclasses set self.feedback_text, self.points and self.readouts
+    in update(); draw() renders the FitSmart overlay boxes.
+
+    Each rep is enter_stage (e.g. the bottom of a squat) followed by a
+    return to complete_stage, which counts it; mid_rep is True between
+    the two. phase_events() gives both conditions for a whole clip.
+    """
+
+    label = "Reps"
+    start_stage = "up"
+    enter_stage = "down"
+    complete_stage = "up"
+    counts_on_return = True
+    rep_joints = (LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST)
+    start_feedback = ""
+    no_pose_feedback = "Make sure your FULL BODY is visible"
+    box_width = 320
+
+    def __init__(self):
+        super().__init__()
+        self.stage = self.start_stage
+        self.mid_rep = False
+        self.feedback_text = self.start_feedback
+        self.points = []
+        self.readouts = []
+
+    def phase_events(self, landmarks, frame_size):
+        """(enter, complete) bool arrays over an (N, 33, 4) clip."""
+        raise NotImplementedError
+
+    def rep_signal(self, landmarks, frame_size):
+        enter, complete = self.phase_events(landmarks, frame_size)
+        angle = joint_angles(landmarks, frame_size, {"rep": self.rep_joints}, integer=True)["rep"]
+        return enter, complete, angle
+
+    def update_series(self, landmarks, frame_size):
+        enter, complete = self.phase_events(landmarks, frame_size)
+        self.apply_reps(enter, complete, self.enter_stage, self.complete_stage)
+        self.mid_rep = self.stage == self.enter_stage
+
+    def update(self, landmarks, frame_size):
+        if landmarks is None:
+            self.points = []
+            self.readouts = []
+            self.feedback_text = self.no_pose_feedback
+            return
+        messages = self.step(landmarks, frame_size)
+        self.feedback_text = " / ".join(messages) if messages else "Form: GOOD ✅"
+
+    def step(self, landmarks, frame_size):
+        """Advance the state machine; return a list of feedback messages."""
+        raise NotImplementedError
+
+    def draw(self, image, slot=0):
+        h, w = image.shape[:2]
+        top = 130 * slot
+
+        for point in self.points:
+            cv2.circle(image, point, 7, PINK, -1)
+        for i, text in enumerate(self.readouts):
+            cv2.putText(image, text, (10, top + 90 + 30 * i), FONT, 0.7, NEON_CYAN, 2)
+
+        cv2.rectangle(image, (0, top), (self.box_width, top + 80), (0, 0, 0), -1)
+        cv2.putText(image, f"{self.label}: {self.count}", (10, top + 30),
+                    FONT, 0.9, (180, 105, 255), 2)
+        cv2.putText(image, f"Stage: {self.stage.upper()}", (10, top + 60),
+                    FONT, 0.8, (200, 200, 200), 2)
+
+        bottom = h - 70 * slot
+        cv2.rectangle(image, (0, bottom - 70), (w, bottom), (0, 0, 0), -1)
+        cv2.putText(image, self.feedback_text, (10, bottom - 25),
+                    FONT, 0.8, (203, 192, 255), 2)
+
+
+class JumpingJackFormCounter(FormRepCounter):
+    name = "jumping_jack"
+    label = "Jacks"
+    start_stage = "closed"
+    enter_stage = "open"
+    complete_stage = "closed"
+    rep_joints = (LEFT_HIP, LEFT_SHOULDER, LEFT_ELBOW)
+    rep_peak = "max"
+    start_feedback = "Stand straight, feet together"
+    box_width = 340
+
+    FEET_APART_THRESH = 0.20
+    FEET_TOGETHER_THRESH = 0.10
+
+    def phase_events(self, landmarks, frame_size):
+        xy = pixel_coords(landmarks, frame_size, integer=True)
+        y = xy[..., 1]
+        arms_up = (y[:, LEFT_WRIST] < y[:, LEFT_SHOULDER] - 20) & (
+            y[:, RIGHT_WRIST] < y[:, RIGHT_SHOULDER] - 20
+        )
+        arms_down = (y[:, LEFT_WRIST] > y[:, LEFT_SHOULDER] + 40) & (
+            y[:, RIGHT_WRIST] > y[:, RIGHT_SHOULDER] + 40
+        )
+        feet_distance = np.abs(xy[:, LEFT_ANKLE, 0] - xy[:, RIGHT_ANKLE, 0]) / float(frame_size[0])
+        return (
+            arms_up & (feet_distance > self.FEET_APART_THRESH),
+            arms_down & (feet_distance < self.FEET_TOGETHER_THRESH),
+        )
+
+    def step(self, landmarks, frame_size):
+        w = frame_size[0]
+        l_shoulder = pixel_point(landmarks, LEFT_SHOULDER, frame_size)
+        r_shoulder = pixel_point(landmarks, RIGHT_SHOULDER, frame_size)
+        l_wrist = pixel_point(landmarks, LEFT_WRIST, frame_size)
+        r_wrist = pixel_point(landmarks, RIGHT_WRIST, frame_size)
+        l_ankle = pixel_point(landmarks, LEFT_ANKLE, frame_size)
+        r_ankle = pixel_point(landmarks, RIGHT_ANKLE, frame_size)
+
+        arms_up = l_wrist[1] < l_shoulder[1] - 20 and r_wrist[1] < r_shoulder[1] - 20
+        arms_down = l_wrist[1] > l_shoulder[1] + 40 and r_wrist[1] > r_shoulder[1] + 40
+
+        feet_distance = abs(l_ankle[0] - r_ankle[0]) / float(w)
+        feet_apart = feet_distance > self.FEET_APART_THRESH
+        feet_together = feet_distance < self.FEET_TOGETHER_THRESH
+
+        open_position = arms_up and feet_apart
+        closed_position = arms_down and feet_together
+
+        if open_position and self.stage == "closed":
+            self.stage = "open"
+            self.mid_rep = True
+
+        if closed_position and self.stage == "open" and self.mid_rep:
+            self.stage = "closed"
+            self.count += 1
+            self.mid_rep = False
+
+        messages = []
+        if self.stage == "closed":
+            if not arms_up:
+                messages.append("Raise your arms overhead")
+            if not feet_apart:
+                messages.append("Jump your feet wider")
+        else:
+            if not arms_down:
+                messages.append("Bring your arms back down")
+            if not feet_together:
+                messages.append("Bring your feet together")
+
+        self.points = [l_shoulder, r_shoulder, l_wrist, r_wrist, l_ankle, r_ankle]
+        self.readouts = [f"Feet dist: {feet_distance:.2f}"]
+        return messages
+
+
+class PullupFormCounter(FormRepCounter):
+    name = "pullup"
+    label = "Reps"
+    start_stage = "down"
+    enter_stage = "up"
+    complete_stage = "down"
+    start_feedback = "Hang from the bar with straight arms"
+    no_pose_feedback = "Make sure your UPPER BODY and BAR are visible"
+
+    ELBOW_TOP_ANGLE = 60
+    ELBOW_BOTTOM_ANGLE = 150
+    MIN_LIFT_PIXELS = 20
+
+    def phase_events(self, landmarks, frame_size):
+        elbow_angle = joint_angles(
+            landmarks, frame_size, {"elbow": (LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST)}, integer=True
+        )["elbow"]
+        y = pixel_coords(landmarks, frame_size, integer=True)[..., 1]
+        wrist_higher_than_shoulder = y[:, LEFT_WRIST] < (y[:, LEFT_SHOULDER] - self.MIN_LIFT_PIXELS)
+        return (
+            (elbow_angle <= self.ELBOW_TOP_ANGLE) & wrist_higher_than_shoulder,
+            elbow_angle >= self.ELBOW_BOTTOM_ANGLE,
+        )
+
+    def step(self, landmarks, frame_size):
+        shoulder = pixel_point(landmarks, LEFT_SHOULDER, frame_size)
+        elbow = pixel_point(landmarks, LEFT_ELBOW, frame_size)
+        wrist = pixel_point(landmarks, LEFT_WRIST, frame_size)
+        hip = pixel_point(landmarks, LEFT_HIP, frame_size)
+
+        elbow_angle = calculate_angle(shoulder, elbow, wrist)
+        wrist_higher_than_shoulder = wrist[1] < (shoulder[1] - self.MIN_LIFT_PIXELS)
+
+        if (
+            elbow_angle <= self.ELBOW_TOP_ANGLE
+            and wrist_higher_than_shoulder
+            and self.stage == "down"
+        ):
+            self.stage = "up"
+            self.mid_rep = True
+
+        if elbow_angle >= self.ELBOW_BOTTOM_ANGLE and self.stage == "up" and self.mid_rep:
+            self.stage = "down"
+            self.count += 1
+            self.mid_rep = False
+
+        messages = []
+        if self.stage == "down" and elbow_angle < self.ELBOW_BOTTOM_ANGLE - 10:
+            messages.append("Straighten your ARMS fully at bottom")
+        if self.stage == "up":
+            if elbow_angle > self.ELBOW_TOP_ANGLE + 10:
+                messages.append("Bend elbows MORE at top")
+            if not wrist_higher_than_shoulder:
+                messages.append("Pull HIGHER – get chin over bar")
+
+        self.points = [shoulder, elbow, wrist, hip]
+        self.readouts = [f"Elbow: {int(elbow_angle)}°"]
+        return messages
+
+
+class PushupFormCounter(FormRepCounter):
+    name = "pushup"
+    label = "Reps"
+    start_stage = "up"
+    start_feedback = "Start in plank position"
+
+    ELBOW_DOWN_ANGLE = 75
+    ELBOW_UP_ANGLE = 160
+    BODY_STRAIGHT_ANGLE = 170
+
+    def phase_events(self, landmarks, frame_size):
+        angles = joint_angles(
+            landmarks,
+            frame_size,
+            {
+                "elbow": (LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST),
+                "hip": (LEFT_SHOULDER, LEFT_HIP, LEFT_ANKLE),
+            },
+            integer=True,
+        )
+        good_body_line = angles["hip"] >= self.BODY_STRAIGHT_ANGLE
+        return (
+            (angles["elbow"] <= self.ELBOW_DOWN_ANGLE) & good_body_line,
+            (angles["elbow"] >= self.ELBOW_UP_ANGLE) & good_body_line,
+        )
+
+    def step(self, landmarks, frame_size):
+        shoulder = pixel_point(landmarks, LEFT_SHOULDER, frame_size)
+        elbow = pixel_point(landmarks, LEFT_ELBOW, frame_size)
+        wrist = pixel_point(landmarks, LEFT_WRIST, frame_size)
+        hip = pixel_point(landmarks, LEFT_HIP, frame_size)
+        knee = pixel_point(landmarks, LEFT_KNEE, frame_size)
+        ankle = pixel_point(landmarks, LEFT_ANKLE, frame_size)
+
+        elbow_angle = calculate_angle(shoulder, elbow, wrist)
+        hip_angle = calculate_angle(shoulder, hip, ankle)
+        good_body_line = hip_angle >= self.BODY_STRAIGHT_ANGLE
+
+        if elbow_angle <= self.ELBOW_DOWN_ANGLE and good_body_line and self.stage == "up":
+            self.stage = "down"
+            self.mid_rep = True
+
+        if (
+            elbow_angle >= self.ELBOW_UP_ANGLE
+            and good_body_line
+            and self.stage == "down"
+            and self.mid_rep
+        ):
+            self.stage = "up"
+            self.count += 1
+            self.mid_rep = False
+
+        messages = []
+        if not good_body_line:
+            messages.append("Keep your body STRAIGHT")
+        if self.stage == "down" and elbow_angle > self.ELBOW_DOWN_ANGLE + 5:
+            messages.append("Go a bit LOWER")
+        if self.stage == "up" and not self.mid_rep and elbow_angle < self.ELBOW_UP_ANGLE - 10:
+            messages.append("Use FULL range of motion")
+
+        self.points = [shoulder, elbow, wrist, hip, knee, ankle]
+        self.readouts = [f"Elbow: {int(elbow_angle)}°", f"Hip: {int(hip_angle)}°"]
+        return messages
+
+
+class SquatFormCounter(FormRepCounter):
+    name = "squat"
+    label = "Squats"
+    start_stage = "up"
+    rep_joints = (LEFT_HIP, LEFT_KNEE, LEFT_ANKLE)
+    start_feedback = "Stand tall to start"
+
+    KNEE_DOWN_ANGLE = 80
+    KNEE_UP_ANGLE = 160
+    CHEST_FOLD_ANGLE = 140
+
+    def phase_events(self, landmarks, frame_size):
+        knee_angle = joint_angles(
+            landmarks, frame_size, {"knee": (LEFT_HIP, LEFT_KNEE, LEFT_ANKLE)}, integer=True
+        )["knee"]
+        return knee_angle <= self.KNEE_DOWN_ANGLE, knee_angle >= self.KNEE_UP_ANGLE
+
+    def step(self, landmarks, frame_size):
+        shoulder = pixel_point(landmarks, LEFT_SHOULDER, frame_size)
+        hip = pixel_point(landmarks, LEFT_HIP, frame_size)
+        knee = pixel_point(landmarks, LEFT_KNEE, frame_size)
+        ankle = pixel_point(landmarks, LEFT_ANKLE, frame_size)
+
+        knee_angle = calculate_angle(hip, knee, ankle)
+        hip_angle = calculate_angle(shoulder, hip, knee)
+
+        if knee_angle <= self.KNEE_DOWN_ANGLE and self.stage == "up":
+            self.stage = "down"
+            self.mid_rep = True
+
+        if knee_angle >= self.KNEE_UP_ANGLE and self.stage == "down" and self.mid_rep:
+            self.stage = "up"
+            self.count += 1
+            self.mid_rep = False
+
+        messages = []
+        if self.stage == "down" and knee_angle > self.KNEE_DOWN_ANGLE + 10:
+            messages.append("Go LOWER for full squat")
+        if self.stage == "up" and not self.mid_rep and knee_angle < self.KNEE_UP_ANGLE - 10:
+            messages.append("Stand fully between reps")
+        if hip_angle < self.CHEST_FOLD_ANGLE:
+            messages.append("Keep your chest UP")
+
+        self.points = [shoulder, hip, knee, ankle]
+        self.readouts = [f"Knee: {int(knee_angle)}°", f"Hip: {int(hip_angle)}°"]
+        return messages
+
+
+# workout_type -> counter class
+SIMPLE_COUNTERS = {
+    c.name: c for c in (PushupCounter, SquatCounter, PullupCounter, JumpingJackCounter)
+}
+FORM_COUNTERS = {
+    c.name: c
+    for c in (PushupFormCounter, SquatFormCounter, PullupFormCounter, JumpingJackFormCounter)
+}
@@ -0,0 +1,213 @@
+"""
+Per-rep event log.
+
+After an analysis the landmark track is walked once more per counter to
+describe every counted rep instead of just the total: start / peak
+("bottom") / end frame, tempo (and its down / up split), the minimum
+and maximum of the counter's joint angle, and, for the form-coaching
+counters, which feedback messages showed up during the rep.
+
+Records are stored column by column in a compact blob (REP_COLUMNS,
+one contiguous little-endian array each) next to the JSON summary in
+the `logs` table, so the progress page can chart rep quality without
+touching the videos again:
+
+  offset 0   magic     b"FSREPS1\\n"
+  offset 8   uint32 LE header length H
+  offset 12  H bytes   JSON: {"version", "rows", "fps", "exercises": [...],
+                              "flags": [...], "columns": [[name, dtype], ...]}
+  then       each column's raw array, in header order
+
+`exercise` indexes header["exercises"]; bit i of `flags` is header["flags"][i].
+"""
+import json
+import struct
+
+import numpy as np
+
+from kinematics import hysteresis_reps
+
+MAGIC = b"FSREPS1\n"
+VERSION = 1
+_PREFIX = struct.Struct("<8sI")
+
+REP_COLUMNS = (
+    ("exercise", "<u1"),
+    ("start_frame", "<i4"),
+    ("bottom_frame", "<i4"),
+    ("end_frame", "<i4"),
+    ("tempo", "<f4"),
+    ("down_seconds", "<f4"),
+    ("up_seconds", "<f4"),
+    ("min_angle", "<f4"),
+    ("max_angle", "<f4"),
+    ("flags", "<u4"),
+)
+FLAG_BITS = np.dtype(dict(REP_COLUMNS)["flags"]).itemsize * 8
+
+# per-frame feedback that is not a form fault (plus each counter's
+# start_feedback / no_pose_feedback prompts)
+NEUTRAL_FEEDBACK = {"Form: GOOD ✅", ""}
+
+
+def _feedback_rows(counter_class, landmarks, frame_size):
+    """
+    Form faults shown on each row by a fresh form counter. Rows without
+    a pose only say tracking was lost, so they never flag a rep.
+    """
+    counter = counter_class()
+    neutral = NEUTRAL_FEEDBACK | {counter.start_feedback, counter.no_pose_feedback}
+    missing = np.isnan(landmarks[:, 0, 0])
+    rows = []
+    for i in range(len(landmarks)):
+        counter.update(None if missing[i] else landmarks[i], frame_size)
+        rows.append(set() if missing[i] else set(counter.feedback_text.split(" / ")) - neutral)
+    return rows
+
+
+def rep_events(counter_class, landmarks, frame_size, stride, fps, offset=0):
+    """
+    One dict per rep a fresh `counter_class` counts over `landmarks`
+    (track rows; `offset` = row of landmarks[0] in the full track).
+    Frames are video frame numbers, times in seconds, angles in degrees.
+    """
+    counter = counter_class()
+    enter, complete, angle = counter.rep_signal(landmarks, frame_size)
+    rep_rows, _last = hysteresis_reps(enter, complete)
+    if not len(rep_rows):
+        return []
+
+    enter_rows = np.flatnonzero(enter)
+    complete_rows = np.flatnonzero(complete)
+    coaching = hasattr(counter, "feedback_text")
+    feedback = _feedback_rows(counter_class, landmarks, frame_size) if coaching else None
+    rate = fps / stride
+
+    events = []
+    for row in rep_rows:
+        if counter.counts_on_return:
+            # start position -> peak (enter) -> back (complete, counted)
+            before = complete_rows[complete_rows < row]
+            start = before[-1] if len(before) else enter_rows[enter_rows < row][0]
+            end = row
+        else:
+            # start position (enter) -> peak (complete, counted) -> back
+            start = enter_rows[enter_rows < row][-1]
+            after = enter_rows[enter_rows > row]
+            end = after[0] if len(after) else row
+
+        span = angle[start:end + 1]
+        if np.isnan(span).all():
+            bottom, low, high = row, np.nan, np.nan
+        else:
+            pick = np.nanargmax if counter.rep_peak == "max" else np.nanargmin
+            bottom = start + int(pick(span))
+            low, high = float(np.nanmin(span)), float(np.nanmax(span))
+
+        flags = set()
+        if feedback is not None:
+            for messages in feedback[start:end + 1]:
+                flags |= messages
+
+        events.append({
+            "exercise": counter.name,
+            "start_frame": int(offset + start) * stride,
+            "bottom_frame": int(offset + bottom) * stride,
+            "end_frame": int(offset + end) * stride,
+            "tempo": round(float(end - start) / rate, 3),
+            "down_seconds": round(float(bottom - start) / rate, 3),
+            "up_seconds": round(float(end - bottom) / rate, 3),
+            "min_angle": None if np.isnan(low) else round(low, 1),
+            "max_angle": None if np.isnan(high) else round(high, 1),
+            "flags": sorted(flags),
+        })
+    return events
+
+
+def encode_rep_log(events, fps):
+    """rep_events() dicts -> columnar blob (see module docstring)."""
+    exercises = sorted({e["exercise"] for e in events})
+    flag_names = sorted({flag for e in events for flag in e["flags"]})
+    if len(flag_names) > FLAG_BITS:
+        print(f"Warning: rep log keeps {FLAG_BITS} of {len(flag_names)} feedback flags, dropped:",
+              flag_names[FLAG_BITS:])
+        flag_names = flag_names[:FLAG_BITS]
+    flag_bits = {flag: 1 << i for i, flag in enumerate(flag_names)}
+
+    columns = []
+    for name, dtype in REP_COLUMNS:
+        if name == "exercise":
+            values = [exercises.index(e["exercise"]) for e in events]
+        elif name == "flags":
+            values = [sum(flag_bits.get(f, 0) for f in e["flags"]) for e in events]
+        else:
+            values = [np.nan if e[name] is None else e[name] for e in events]
+        columns.append(np.asarray(values, dtype=dtype))
+
+    header = json.dumps({
+        "version": VERSION,
+        "rows": len(events),
+        "fps": fps,
+        "exercises": exercises,
+        "flags": flag_names,
+        "columns": [list(c) for c in REP_COLUMNS],
+    }, separators=(",", ":")).encode("utf-8")
+    return b"".join([_PREFIX.pack(MAGIC, len(header)), header, *(c.tobytes() for c in columns)])
+
+
+def decode_rep_log(blob):
+    """
+    Columnar blob -> ({column name: (rows,) array}, header). The arrays
+    are read-only views of `blob`. Raises ValueError for other data.
+    """
+    blob = memoryview(blob)
+    if len(blob) < _PREFIX.size or bytes(blob[:len(MAGIC)]) != MAGIC:
+        raise ValueError("not a rep log")
+    _magic, length = _PREFIX.unpack_from(blob)
+    header = json.loads(bytes(blob[_PREFIX.size:_PREFIX.size + length]).decode("utf-8"))
+    if header.get("version") != VERSION:
+        raise ValueError(f"unsupported rep log version {header.get('version')}")
+
+    offset = _PREFIX.size + length
+    columns = {}
+    for name, dtype in header["columns"]:
+        dtype = np.dtype(dtype)
+        columns[name] = np.frombuffer(blob, dtype=dtype, count=header["rows"], offset=offset)
+        offset += dtype.itemsize * header["rows"]
+    return columns, header
+
+
+def summarize_reps(events):
+    """Per-exercise averages for the JSON side of a log entry."""
+    summary = {}
+    for name in dict.fromkeys(e["exercise"] for e in events):
+        reps = [e for e in events if e["exercise"] == name]
+        ranges = [e["max_angle"] - e["min_angle"] for e in reps if e["min_angle"] is not None]
+        summary[name] = {
+            "reps": len(reps),
+            "avg_tempo": round(float(np.mean([e["tempo"] for e in reps])), 2),
+            "avg_range_of_motion": round(float(np.mean(ranges)), 1) if ranges else None,
+            "clean_reps": sum(1 for e in reps if not e["flags"]),
+        }
+    return summary
+
+
+def rep_log_series(blob):
+    """
+    A stored rep log as JSON-friendly columns for charts: exercise name,
+    tempo, down / up seconds, range of motion (max - min angle) and the
+    feedback flags of every rep.
+    """
+    columns, header = decode_rep_log(blob)
+    rom = columns["max_angle"] - columns["min_angle"]
+    return {
+        "exercise": [header["exercises"][i] for i in columns["exercise"]],
+        "tempo": [round(float(v), 3) for v in columns["tempo"]],
+        "down_seconds": [round(float(v), 3) for v in columns["down_seconds"]],
+        "up_seconds": [round(float(v), 3) for v in columns["up_seconds"]],
+        "range_of_motion": [None if np.isnan(v) else round(float(v), 1) for v in rom],
+        "flags": [
+            [name for i, name in enumerate(header["flags"]) if bits >> i & 1]
+            for bits in columns["flags"].tolist()
+        ],
+    }
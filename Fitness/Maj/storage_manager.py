@@ -0,0 +1,213 @@
+"""
+Retention for uploaded videos, rendered outputs and landmark tracks.
+
+Each folder is a StoragePool with an optional size quota and maximum
+age. Its entries are the top-level files and folders (an HLS stream
+folder is one entry). A sweep first drops entries that have not been
+used for max_age, then evicts least recently used entries until the
+pool fits in max_bytes. "Used" is the newest atime/mtime in an entry;
+serving code calls touch() so recently watched videos survive.
+Entries modified within the grace period are never touched, so
+uploads and jobs still being written are safe; entries in `pinned`
+(e.g. the InputPins of queued jobs) are skipped however old they are.
+"""
+import os
+import time
+import shutil
+import threading
+
+# in-progress uploads / renders are younger than this (seconds)
+DEFAULT_GRACE = float(os.getenv("STORAGE_GRACE_SECONDS", "900"))
+
+
+def _entry_stats(path):
+    """(bytes, files, last_used, last_modified) for a file or folder tree."""
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return st.st_size, 1, max(st.st_atime, st.st_mtime), st.st_mtime
+
+    size = files = 0
+    st = os.stat(path)
+    last_used = last_modified = st.st_mtime
+    for folder, _dirs, names in os.walk(path):
+        for name in names:
+            try:
+                st = os.stat(os.path.join(folder, name))
+            except FileNotFoundError:
+                continue
+            size += st.st_size
+            files += 1
+            last_used = max(last_used, st.st_atime, st.st_mtime)
+            last_modified = max(last_modified, st.st_mtime)
+    return size, files, last_used, last_modified
+
+
+class StoragePool:
+    """
+    One folder under a quota.
+
+    max_bytes : evict LRU entries above this total (None = no limit)
+    max_age   : remove entries unused for this many seconds (None = keep)
+    grace     : never remove entries modified this recently
+    exclude   : top-level names to leave alone (e.g. a nested cache folder)
+    pinned    : container of paths in use (`path in pinned`), never removed
+    """
+
+    def __init__(self, name, root, max_bytes=None, max_age=None,
+                 grace=DEFAULT_GRACE, exclude=(), pinned=None):
+        self.name = name
+        self.root = root
+        self.max_bytes = max_bytes or None
+        self.max_age = max_age or None
+        self.grace = grace
+        self.exclude = set(exclude)
+        self.pinned = pinned
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.last_sweep = None
+        os.makedirs(root, exist_ok=True)
+
+    def entries(self):
+        """Dicts with path, bytes, files, last_used, modified; oldest use first."""
+        entries = []
+        with os.scandir(self.root) as it:
+            for item in it:
+                if item.name in self.exclude:
+                    continue
+                try:
+                    size, files, last_used, modified = _entry_stats(item.path)
+                except FileNotFoundError:
+                    continue
+                entries.append({
+                    "path": item.path,
+                    "bytes": size,
+                    "files": files,
+                    "last_used": last_used,
+                    "modified": modified,
+                })
+        entries.sort(key=lambda e: e["last_used"])
+        return entries
+
+    def _remove(self, entry):
+        try:
+            if os.path.isdir(entry["path"]):
+                shutil.rmtree(entry["path"])
+            else:
+                os.remove(entry["path"])
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print("Warning: could not evict", entry["path"], e)
+            return False
+        self.evicted_files += entry["files"]
+        self.evicted_bytes += entry["bytes"]
+        return True
+
+    def sweep(self, now=None):
+        """Applies the age then the size quota; returns bytes freed."""
+        now = now or time.time()
+        entries = self.entries()
+        total = sum(e["bytes"] for e in entries)
+        freed = 0
+        for entry in entries:
+            if now - entry["modified"] < self.grace:
+                continue
+            if self.pinned is not None and entry["path"] in self.pinned:
+                continue
+            expired = self.max_age is not None and now - entry["last_used"] > self.max_age
+            over_quota = self.max_bytes is not None and total > self.max_bytes
+            if not (expired or over_quota):
+                continue
+            if self._remove(entry):
+                total -= entry["bytes"]
+                freed += entry["bytes"]
+        self.last_sweep = now
+        return freed
+
+    def contains(self, path):
+        root = os.path.abspath(self.root)
+        return os.path.abspath(path).startswith(root + os.sep)
+
+    def metrics(self):
+        entries = self.entries()
+        now = time.time()
+        return {
+            "path": self.root,
+            "bytes": sum(e["bytes"] for e in entries),
+            "files": sum(e["files"] for e in entries),
+            "entries": len(entries),
+            "oldest_use_seconds": round(now - entries[0]["last_used"]) if entries else None,
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age,
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes,
+            "last_sweep": self.last_sweep,
+        }
+
+
+class StorageManager:
+    """Sweeps a set of StoragePools now and then on a daemon thread."""
+
+    def __init__(self, pools, interval=600):
+        self.pools = list(pools)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()  # not _lock: start() must not wait for a sweep
+        self._thread = None
+
+    def sweep(self):
+        """Sweeps every pool; returns {pool name: bytes freed}."""
+        freed = {}
+        with self._lock:
+            for pool in self.pools:
+                try:
+                    freed[pool.name] = pool.sweep()
+                except OSError as e:
+                    print("Warning: storage sweep failed for", pool.root, e)
+        return freed
+
+    def start(self):
+        """Starts the periodic sweep (idempotent, safe to call from several threads)."""
+        if not self.interval:
+            return
+
+        def loop():
+            while True:
+                self.sweep()
+                time.sleep(self.interval)
+
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=loop, name="storage-sweep", daemon=True)
+            self._thread.start()
+
+    def touch(self, path):
+        """Marks a served file as just used, for LRU eviction."""
+        for pool in self.pools:
+            if pool.contains(path):
+                try:
+                    # ns: keep mtime exact, it is part of the media ETag
+                    os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+                except OSError:
+                    pass
+                return
+
+    def metrics(self):
+        pools = {pool.name: pool.metrics() for pool in self.pools}
+        return {
+            "total_bytes": sum(p["bytes"] for p in pools.values()),
+            "pools": pools,
+        }
+
+
+def megabytes(value):
+    """Env helper: MB -> bytes (0 / empty = None, no quota)."""
+    value = float(value or 0)
+    return int(value * 1024 * 1024) or None
+
+
+def days(value):
+    """Env helper: days -> seconds (0 / empty = None, no age limit)."""
+    value = float(value or 0)
+    return value * 86400 or None
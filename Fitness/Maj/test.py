@@ -1,10 +1,10 @@
 import os
+import math
 import uuid
 import base64
 import json
 import datetime
 
-from io import BytesIO
 from flask import (
     Flask,
     render_template,
@@ -14,18 +14,29 @@ from flask import (
     flash,
     session,
     jsonify,
-    send_from_directory,
 )
 import sqlite3
-from PIL import Image
 
 # ===== OpenAI =====
-from openai import OpenAI, OpenAIError
+from openai import OpenAIError
 
 # ===== Workout Analyzer deps =====
 import cv2
 import numpy as np
-import mediapipe as mp
+from pose_engine import analyze_video, PINK_SKELETON_STYLE
+from rep_counters import FORM_COUNTERS
+from landmark_cache import LandmarkCache
+from storage_manager import StorageManager, StoragePool, megabytes, days
+from media_serving import send_media
+from video_uploads import UploadRejected, save_video_upload, streaming_upload_request
+from landmark_uploads import LandmarkUploadError, read_landmark_upload, score_landmarks
+from workout_jobs import InputPins
+from rep_events import encode_rep_log, rep_log_series, summarize_reps
+from nutrition_cache import NutritionCache, image_digest
+from frame_dedup import LiveFrameDeduper
+from vision_images import normalize_image
+from vision_gateway import ModelsUnavailable, VisionGateway, VisionTimeout
+from werkzeug.exceptions import RequestEntityTooLarge
 
 # ============================
 # Flask setup
@@ -45,14 +56,62 @@ OUTPUT_FOLDER = os.path.join(BASE_DIR, "static", "outputs")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# Videos stream straight into UPLOAD_FOLDER and are probed from their
+# first bytes (see video_uploads.py); 0 disables the size cap
+MAX_UPLOAD_MB = int(os.getenv("WORKOUT_MAX_UPLOAD_MB", "500"))
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024 or None
+app.request_class = streaming_upload_request(UPLOAD_FOLDER, {"upload_workout"})
+
+LANDMARK_FOLDER = os.path.join(UPLOAD_FOLDER, "landmarks")
+landmark_cache = LandmarkCache(LANDMARK_FOLDER)
+
+# Retention (see storage_manager.py): raw uploads go once their landmarks
+# are cached unless WORKOUT_KEEP_UPLOADS=1; quotas in MB / days, 0 = none
+# (uploads being analyzed are pinned: concurrent requests may share one)
+KEEP_UPLOADS = os.getenv("WORKOUT_KEEP_UPLOADS", "0") == "1"
+upload_pins = InputPins()
+storage = StorageManager(
+    [
+        StoragePool(
+            "uploads",
+            UPLOAD_FOLDER,
+            max_bytes=megabytes(os.getenv("WORKOUT_UPLOAD_QUOTA_MB", "4096")),
+            max_age=days(os.getenv("WORKOUT_UPLOAD_MAX_AGE_DAYS", "2")),
+            exclude={"landmarks"},
+            pinned=upload_pins,
+        ),
+        StoragePool(
+            "outputs",
+            OUTPUT_FOLDER,
+            max_bytes=megabytes(os.getenv("WORKOUT_OUTPUT_QUOTA_MB", "2048")),
+            max_age=days(os.getenv("WORKOUT_OUTPUT_MAX_AGE_DAYS", "7")),
+        ),
+        StoragePool(
+            "landmarks",
+            LANDMARK_FOLDER,
+            max_bytes=megabytes(os.getenv("LANDMARK_CACHE_QUOTA_MB", "1024")),
+            max_age=days(os.getenv("LANDMARK_CACHE_MAX_AGE_DAYS", "90")),
+        ),
+    ],
+    interval=float(os.getenv("STORAGE_SWEEP_SECONDS", "600")),
+)
+
+
+@app.before_request
+def _start_storage_sweeps():
+    storage.start()
+
 # ============================
-# Mediapipe setup (workouts)
+# Pose engine setup (workouts)
 # ============================
-mp_drawing = mp.solutions.drawing_utils
-mp_pose = mp.solutions.pose
-
-PINK = (255, 0, 255)
-NEON_CYAN = (255, 255, 0)
+POSE_OPTIONS = {
+    "min_detection_confidence": 0.7,
+    "min_tracking_confidence": 0.7,
+    "smooth_landmarks": True,
+}
+# Infer at ~15 fps on frames capped at 640px (0 disables)
+ANALYSIS_FPS = float(os.getenv("WORKOUT_ANALYSIS_FPS", "15"))
+MAX_INFERENCE_SIDE = int(os.getenv("WORKOUT_MAX_INFERENCE_SIDE", "640"))
 
 # ---------- OpenAI config ----------
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
@@ -65,15 +124,58 @@ if not OPENAI_API_KEY:
 client_kwargs = {"api_key": OPENAI_API_KEY}
 if OPENAI_PROJECT:
     client_kwargs["project"] = OPENAI_PROJECT
-client = OpenAI(**client_kwargs)
+
+# Vision calls run on a background asyncio loop with one pooled client
+# (see vision_gateway.py): deadline per request, bounded concurrency,
+# and optionally a hedged request to the fallback model (0 = off).
+# When every slot stays busy for VISION_QUEUE_TIMEOUT_SECONDS the call
+# fails fast with 503 instead of holding the web worker.
+# Per-model circuit breakers: a model without access is skipped for
+# VISION_MODEL_UNAVAILABLE_SECONDS; rate limits and repeated errors back
+# off exponentially from VISION_BREAKER_COOLDOWN_SECONDS
+vision_gateway = VisionGateway(
+    client_kwargs,
+    deadline=float(os.getenv("VISION_DEADLINE_SECONDS", "15")),
+    max_concurrency=int(os.getenv("VISION_MAX_CONCURRENCY", "8")),
+    queue_timeout=float(os.getenv("VISION_QUEUE_TIMEOUT_SECONDS", "2")),
+    hedge_after=float(os.getenv("VISION_HEDGE_AFTER_SECONDS", "0")),
+    breaker_options={
+        "failures": int(os.getenv("VISION_BREAKER_FAILURES", "3")),
+        "cooldown": float(os.getenv("VISION_BREAKER_COOLDOWN_SECONDS", "15")),
+        "max_cooldown": float(os.getenv("VISION_BREAKER_MAX_COOLDOWN_SECONDS", "600")),
+        "unavailable_for": float(os.getenv("VISION_MODEL_UNAVAILABLE_SECONDS", "600")),
+    },
+)
+
+# Same photo + model -> cached result (nutrition_cache.py); 0 = no bound
+nutrition_cache = NutritionCache(
+    os.getenv("NUTRITION_CACHE_DB", os.path.join(BASE_DIR, "nutrition_cache.db")),
+    ttl=float(os.getenv("NUTRITION_CACHE_TTL_HOURS", "720")) * 3600,
+    max_entries=int(os.getenv("NUTRITION_CACHE_MAX_ENTRIES", "5000")),
+)
+
+# Live camera: frames within LIVE_FRAME_DEDUP_BITS (of a 64-bit perceptual
+# hash) of the session's last analyzed frame reuse its result for up to
+# LIVE_FRAME_DEDUP_SECONDS (see frame_dedup.py); 0 bits = identical hashes only
+live_frames = LiveFrameDeduper(
+    method=os.getenv("LIVE_FRAME_HASH", "dhash"),
+    threshold=int(os.getenv("LIVE_FRAME_DEDUP_BITS", "6")),
+    max_age=float(os.getenv("LIVE_FRAME_DEDUP_SECONDS", "60")),
+)
+
+# Images sent to the vision model: longest side capped, EXIF stripped,
+# re-encoded as JPEG at this quality (see vision_images.py)
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "768"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "80"))
 
 
 # --- Database Setup ---
 def init_db():
     """
     Creates `users` and `logs` tables if DB does not exist.
-    logs table stores JSON blobs for assessment/nutrition entries
-    linked to users.id (user_id may be NULL for anonymous).
+    logs table stores JSON blobs for assessment/nutrition/workout entries
+    linked to users.id (user_id may be NULL for anonymous); workout
+    entries also carry a per-rep columnar log in `blob` (rep_events.py).
     """
     if not os.path.exists(DB_NAME):
         conn = sqlite3.connect(DB_NAME)
@@ -99,6 +201,7 @@ def init_db():
             date TEXT NOT NULL,
             type TEXT NOT NULL,
             data TEXT NOT NULL,
+            blob BLOB,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
         """
@@ -106,6 +209,14 @@ def init_db():
         conn.commit()
         conn.close()
 
+    # older logs tables: add the binary column used by workout rep logs
+    conn = sqlite3.connect(DB_NAME)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(logs)")]
+    if columns and "blob" not in columns:
+        conn.execute("ALTER TABLE logs ADD COLUMN blob BLOB")
+        conn.commit()
+    conn.close()
+
 
 init_db()
 
@@ -127,27 +238,6 @@ def get_current_user_id():
     return row[0] if row else None
 
 
-# ============================
-# Workout helper: joint angle
-# ============================
-def calculate_angle(a, b, c):
-    """
-    Calculates the angle (in degrees) at point b given three points a, b, c.
-    Each point is (x, y).
-    """
-    a = np.array(a)
-    b = np.array(b)
-    c = np.array(c)
-
-    ba = a - b
-    bc = c - b
-
-    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc) + 1e-8)
-    cosine_angle = np.clip(cosine_angle, -1.0, 1.0)
-    angle = np.degrees(np.arccos(cosine_angle))
-    return angle
-
-
 # --- Routes ---
 @app.route("/")
 def home():
@@ -416,33 +506,6 @@ def nutrition():
 
 
 # ------- OpenAI Vision helper --------
-def _vision_call_with_model(model_name, img_b64):
-    prompt = (
-        "You are a nutrition expert. Look at the food photo and respond ONLY as strict JSON with this schema: "
-        '{"is_food": true|false, "items": [{"name": string, "calories": integer, "protein": number, "carbs": number, "fat": number}]}'
-    )
-
-    return client.chat.completions.create(
-        model=model_name,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": "You are a nutrition assistant."},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"},
-                    },
-                ],
-            },
-        ],
-        max_tokens=500,
-        temperature=0.2,
-    )
-
-
 def _try_models_with_image_b64(img_b64):
     if not OPENAI_API_KEY:
         raise OpenAIError("OpenAI key not set on server. Set OPENAI_API_KEY.")
@@ -450,21 +513,14 @@ def _try_models_with_image_b64(img_b64):
         "gpt-4o",
         "gpt-4o-mini",
     ]
-    last_err = None
-    for m in models_to_try:
-        try:
-            resp = _vision_call_with_model(m, img_b64)
-            raw = resp.choices[0].message.content.strip()
-            return json.loads(raw)
-        except OpenAIError as e:
-            last_err = e
-            msg = str(e).lower()
-            if ("model" in msg) or ("access" in msg) or ("403" in msg):
-                continue
-            raise
-    if last_err:
-        raise last_err
-    raise OpenAIError("Unknown OpenAI error")
+    digest = image_digest(base64.b64decode(img_b64))
+    _model, cached = nutrition_cache.get(digest, models_to_try)
+    if cached is not None:
+        return cached
+
+    model, data = vision_gateway.analyze(img_b64, models_to_try)
+    nutrition_cache.put(digest, model, data)
+    return data
 
 
 # --- Upload-based nutrition ---
@@ -480,10 +536,8 @@ def analyze_nutrition():
         return redirect(url_for("nutrition"))
 
     try:
-        img = Image.open(file.stream).convert("RGB")
-        buffered = BytesIO()
-        img.save(buffered, format="JPEG")
-        img_b64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        img_bytes = normalize_image(file.stream, VISION_MAX_SIDE, VISION_JPEG_QUALITY)
+        img_b64 = base64.b64encode(img_bytes).decode("utf-8")
 
         data = _try_models_with_image_b64(img_b64)
 
@@ -558,6 +612,14 @@ def analyze_nutrition():
         return redirect(url_for("nutrition"))
 
 
+def _live_session_id(payload):
+    """Camera session sent by the page, else one per browser session."""
+    session_id = str(payload.get("session_id") or "")[:64]
+    if not session_id:
+        session_id = session.setdefault("live_frame_session", uuid.uuid4().hex)
+    return session_id
+
+
 # --- Live camera frame nutrition (JSON) ---
 @app.route("/analyze_nutrition_frame", methods=["POST"])
 def analyze_nutrition_frame():
@@ -568,16 +630,36 @@ def analyze_nutrition_frame():
         if not img_b64:
             return jsonify({"ok": False, "error": "image_b64 missing"}), 400
 
+        dedup_threshold = payload.get("dedup_threshold")
+        if dedup_threshold is not None:
+            try:
+                dedup_threshold = int(dedup_threshold)
+            except (TypeError, ValueError, OverflowError):
+                return jsonify({"ok": False, "error": "dedup_threshold must be an integer"}), 400
+
         if "," in img_b64:
             img_b64 = img_b64.split(",", 1)[1]
 
-        data = _try_models_with_image_b64(img_b64)
+        frame = normalize_image(base64.b64decode(img_b64), VISION_MAX_SIDE, VISION_JPEG_QUALITY)
+        img_b64 = base64.b64encode(frame).decode("utf-8")
+
+        # same plate as the last analyzed frame of this camera session?
+        session_id = _live_session_id(payload)
+        if dedup_threshold is not None:
+            live_frames.set_threshold(session_id, dedup_threshold)
+        frame_hash = live_frames.hash(frame)
+        data = live_frames.lookup(session_id, frame_hash)
+        deduped = data is not None
+        if not deduped:
+            data = _try_models_with_image_b64(img_b64)
+            live_frames.store(session_id, frame_hash, data)
 
         if not data.get("is_food"):
             return jsonify(
                 {
                     "ok": True,
                     "is_food": False,
+                    "deduped": deduped,
                     "items": [],
                     "totals": {
                         "calories": 0,
@@ -595,8 +677,18 @@ def analyze_nutrition_frame():
             "carbs": float(sum(float(i.get("carbs", 0)) for i in items)),
             "fat": float(sum(float(i.get("fat", 0)) for i in items)),
         }
-        return jsonify({"ok": True, "is_food": True, "items": items, "totals": totals})
+        return jsonify(
+            {"ok": True, "is_food": True, "deduped": deduped, "items": items, "totals": totals}
+        )
 
+    except VisionTimeout as e:
+        return jsonify({"ok": False, "error": str(e)}), 504
+    except ModelsUnavailable as e:
+        # circuits open or every slot busy: tell the camera loop when to come back
+        retry_after = max(1, math.ceil(e.retry_after))
+        response = jsonify({"ok": False, "error": str(e), "retry_after": retry_after})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 503
     except OpenAIError as e:
         msg = str(e)
         if (
@@ -619,7 +711,7 @@ def analyze_nutrition_frame():
 @app.route("/progress", methods=["GET"])
 def progress():
     logs = []
-    series = {"assessments": [], "nutrition": []}
+    series = {"assessments": [], "nutrition": [], "workouts": []}
 
     user_id = get_current_user_id()
     if user_id:
@@ -627,13 +719,13 @@ def progress():
             conn = sqlite3.connect(DB_NAME)
             c = conn.cursor()
             c.execute(
-                "SELECT date, type, data FROM logs WHERE user_id=? ORDER BY date ASC",
+                "SELECT date, type, data, blob FROM logs WHERE user_id=? ORDER BY date ASC",
                 (user_id,),
             )
             rows = c.fetchall()
             conn.close()
 
-            for d, t, data_json in rows:
+            for d, t, data_json, blob in rows:
                 parsed = json.loads(data_json)
                 logs.append({"date": d, "type": t, "data": parsed})
                 if t == "assessment":
@@ -643,6 +735,16 @@ def progress():
                 elif t == "nutrition":
                     totals = parsed.get("totals") or {}
                     series["nutrition"].append({"date": d, "totals": totals})
+                elif t == "workout":
+                    series["workouts"].append(
+                        {
+                            "date": d,
+                            "workout_type": parsed.get("workout_type"),
+                            "reps": parsed.get("reps"),
+                            "summary": parsed.get("summary") or {},
+                            "per_rep": rep_log_series(blob) if blob else None,
+                        }
+                    )
         except Exception as e:
             print("Warning: failed to load progress logs:", e)
 
@@ -669,7 +771,18 @@ def workouts():
 
 @app.route("/upload_workout", methods=["POST"])
 def upload_workout():
-    workout_type = request.form.get("workout_type", "pushup")
+    try:
+        # parses the multipart body: the video is streamed to disk here
+        workout_type = request.form.get("workout_type", "pushup")
+    except (UploadRejected, RequestEntityTooLarge) as e:
+        error = f"Video is too large (max {MAX_UPLOAD_MB} MB)" if e.code == 413 else e.description
+        return render_template(
+            "workout.html",
+            video_url=None,
+            reps=None,
+            error=error,
+            selected_workout="pushup",
+        ), e.code
 
     if "video" not in request.files:
         return render_template(
@@ -700,15 +813,31 @@ def upload_workout():
             selected_workout=workout_type,
         )
 
-    input_filename = f"{uuid.uuid4().hex}{ext}"
-    input_path = os.path.join(UPLOAD_FOLDER, input_filename)
-    file.save(input_path)
+    # Stored under its content hash so re-uploads reuse cached landmarks
+    try:
+        with upload_pins.saving():
+            input_path, video_hash = save_video_upload(file, UPLOAD_FOLDER, ext)
+            upload_pins.pin(input_path)
+    except UploadRejected as e:
+        return render_template(
+            "workout.html",
+            video_url=None,
+            reps=None,
+            error=e.description,
+            selected_workout=workout_type,
+        ), e.code
 
     output_filename = f"{uuid.uuid4().hex}.mp4"
     output_path = os.path.join(OUTPUT_FOLDER, output_filename)
 
-    reps = process_video(input_path, output_path, workout_type)
-    video_url = url_for("outputs", filename=output_filename)
+    # "Counts only": skip drawing + encoding the annotated video
+    render = request.form.get("render", "1").lower() not in ("0", "false", "no", "off")
+
+    reps, processed_path = process_video(
+        input_path, output_path, workout_type, render=render, video_hash=video_hash
+    )
+    # the encoder picks the extension (.mp4 / .webm), so use the path it wrote
+    video_url = url_for("outputs", filename=os.path.basename(processed_path)) if processed_path else None
 
     return render_template(
         "workout.html",
@@ -719,697 +848,153 @@ def upload_workout():
     )
 
 
-@app.route("/outputs/<path:filename>")
-def outputs(filename):
-    """Serve processed workout videos."""
-    return send_from_directory(OUTPUT_FOLDER, filename)
-
-
-def process_video(input_path, output_path, workout_type):
-    workout_type = (workout_type or "pushup").lower()
-
-    if workout_type == "jumping_jack":
-        return process_jumping_jack_video(input_path, output_path)
-    elif workout_type == "pullup":
-        return process_pullup_video(input_path, output_path)
-    elif workout_type == "squat":
-        return process_squat_video(input_path, output_path)
-    else:
-        return process_pushup_video(input_path, output_path)
-
-
-# === 1) Jumping Jacks ===
-def process_jumping_jack_video(input_path, output_path):
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
-        print("Could not open input video")
-        return 0
-
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps <= 0 or np.isnan(fps):
-        fps = 25.0
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-
-    counter = 0
-    stage = "closed"
-    feedback_text = "Stand straight, feet together"
-    reached_open = False
-
-    with mp_pose.Pose(
-        min_detection_confidence=0.7,
-        min_tracking_confidence=0.7,
-        smooth_landmarks=True,
-    ) as pose:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame = cv2.addWeighted(frame, 0.4, np.zeros_like(frame), 0.6, 0)
-
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image.flags.writeable = False
-            results = pose.process(image)
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-            h, w, _ = image.shape
-            current_feedback = feedback_text
-
-            if results.pose_landmarks:
-                landmarks = results.pose_landmarks.landmark
-
-                LEFT_SHOULDER = 11
-                RIGHT_SHOULDER = 12
-                LEFT_WRIST = 15
-                RIGHT_WRIST = 16
-                LEFT_ANKLE = 27
-                RIGHT_ANKLE = 28
-
-                def get_point(idx):
-                    lm = landmarks[idx]
-                    return int(lm.x * w), int(lm.y * h)
-
-                l_shoulder = get_point(LEFT_SHOULDER)
-                r_shoulder = get_point(RIGHT_SHOULDER)
-                l_wrist = get_point(LEFT_WRIST)
-                r_wrist = get_point(RIGHT_WRIST)
-                l_ankle = get_point(LEFT_ANKLE)
-                r_ankle = get_point(RIGHT_ANKLE)
-
-                arms_up = (
-                    l_wrist[1] < l_shoulder[1] - 20
-                    and r_wrist[1] < r_shoulder[1] - 20
-                )
-                arms_down = (
-                    l_wrist[1] > l_shoulder[1] + 40
-                    and r_wrist[1] > r_shoulder[1] + 40
-                )
-
-                feet_distance = abs(l_ankle[0] - r_ankle[0]) / float(w)
-
-                FEET_APART_THRESH = 0.20
-                FEET_TOGETHER_THRESH = 0.10
-
-                feet_apart = feet_distance > FEET_APART_THRESH
-                feet_together = feet_distance < FEET_TOGETHER_THRESH
-
-                open_position = arms_up and feet_apart
-                closed_position = arms_down and feet_together
-
-                if open_position and stage == "closed":
-                    stage = "open"
-                    reached_open = True
-
-                if closed_position and stage == "open" and reached_open:
-                    stage = "closed"
-                    counter += 1
-                    reached_open = False
-
-                feedback_messages = []
-                if stage == "closed":
-                    if not arms_up:
-                        feedback_messages.append("Raise your arms overhead")
-                    if not feet_apart:
-                        feedback_messages.append("Jump your feet wider")
-                else:
-                    if not arms_down:
-                        feedback_messages.append("Bring your arms back down")
-                    if not feet_together:
-                        feedback_messages.append("Bring your feet together")
-
-                if not feedback_messages:
-                    current_feedback = "Form: GOOD ✅"
-                else:
-                    current_feedback = " / ".join(feedback_messages)
-
-                feedback_text = current_feedback
-
-                mp_drawing.draw_landmarks(
-                    image,
-                    results.pose_landmarks,
-                    mp_pose.POSE_CONNECTIONS,
-                    mp_drawing.DrawingSpec(color=PINK, thickness=3, circle_radius=4),
-                    mp_drawing.DrawingSpec(color=PINK, thickness=2, circle_radius=2),
-                )
-
-                for point in [
-                    l_shoulder,
-                    r_shoulder,
-                    l_wrist,
-                    r_wrist,
-                    l_ankle,
-                    r_ankle,
-                ]:
-                    cv2.circle(image, point, 7, PINK, -1)
-
-                cv2.putText(
-                    image,
-                    f"Feet dist: {feet_distance:.2f}",
-                    (10, 90),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.7,
-                    NEON_CYAN,
-                    2,
-                )
-            else:
-                feedback_text = "Make sure your FULL BODY is visible"
-
-            cv2.rectangle(image, (0, 0), (340, 80), (0, 0, 0), -1)
-            cv2.putText(
-                image,
-                f"Jacks: {counter}",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.9,
-                (180, 105, 255),
-                2,
-            )
-            cv2.putText(
-                image,
-                f"Stage: {stage.upper()}",
-                (10, 60),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (200, 200, 200),
-                2,
-            )
-
-            cv2.rectangle(image, (0, h - 70), (w, h), (0, 0, 0), -1)
-            cv2.putText(
-                image,
-                feedback_text,
-                (10, h - 25),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (203, 192, 255),
-                2,
-            )
-
-            out.write(image)
-
-    cap.release()
-    out.release()
-    return counter
-
-
-# === 2) Pull-ups ===
-def process_pullup_video(input_path, output_path):
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
-        print("Could not open input video")
-        return 0
-
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps <= 0 or np.isnan(fps):
-        fps = 25.0
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-
-    counter = 0
-    stage = "down"
-    feedback_text = "Hang from the bar with straight arms"
-    reached_top = False
-
-    ELBOW_TOP_ANGLE = 60
-    ELBOW_BOTTOM_ANGLE = 150
-    MIN_LIFT_PIXELS = 20
-
-    with mp_pose.Pose(
-        min_detection_confidence=0.7,
-        min_tracking_confidence=0.7,
-        smooth_landmarks=True,
-    ) as pose:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame = cv2.addWeighted(frame, 0.4, np.zeros_like(frame), 0.6, 0)
-
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image.flags.writeable = False
-            results = pose.process(image)
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-            h, w, _ = image.shape
-            current_feedback = feedback_text
-
-            if results.pose_landmarks:
-                landmarks = results.pose_landmarks.landmark
-
-                LEFT_SHOULDER = 11
-                LEFT_ELBOW = 13
-                LEFT_WRIST = 15
-                LEFT_HIP = 23
-
-                def get_point(idx):
-                    lm = landmarks[idx]
-                    return int(lm.x * w), int(lm.y * h)
-
-                shoulder = get_point(LEFT_SHOULDER)
-                elbow = get_point(LEFT_ELBOW)
-                wrist = get_point(LEFT_WRIST)
-                hip = get_point(LEFT_HIP)
-
-                elbow_angle = calculate_angle(shoulder, elbow, wrist)
-                wrist_higher_than_shoulder = wrist[1] < (shoulder[1] - MIN_LIFT_PIXELS)
-
-                if (
-                    elbow_angle <= ELBOW_TOP_ANGLE
-                    and wrist_higher_than_shoulder
-                    and stage == "down"
-                ):
-                    stage = "up"
-                    reached_top = True
-
-                if elbow_angle >= ELBOW_BOTTOM_ANGLE and stage == "up" and reached_top:
-                    stage = "down"
-                    counter += 1
-                    reached_top = False
-
-                feedback_messages = []
-
-                if stage == "down" and elbow_angle < ELBOW_BOTTOM_ANGLE - 10:
-                    feedback_messages.append("Straighten your ARMS fully at bottom")
-
-                if stage == "up":
-                    if elbow_angle > ELBOW_TOP_ANGLE + 10:
-                        feedback_messages.append("Bend elbows MORE at top")
-                    if not wrist_higher_than_shoulder:
-                        feedback_messages.append("Pull HIGHER – get chin over bar")
-
-                if not feedback_messages:
-                    current_feedback = "Form: GOOD ✅"
-                else:
-                    current_feedback = " / ".join(feedback_messages)
-
-                feedback_text = current_feedback
-
-                mp_drawing.draw_landmarks(
-                    image,
-                    results.pose_landmarks,
-                    mp_pose.POSE_CONNECTIONS,
-                    mp_drawing.DrawingSpec(color=PINK, thickness=3, circle_radius=4),
-                    mp_drawing.DrawingSpec(color=PINK, thickness=2, circle_radius=2),
-                )
-
-                for point in [shoulder, elbow, wrist, hip]:
-                    cv2.circle(image, point, 7, PINK, -1)
-
-                cv2.putText(
-                    image,
-                    f"Elbow: {int(elbow_angle)}°",
-                    (10, 90),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.7,
-                    NEON_CYAN,
-                    2,
-                )
-            else:
-                feedback_text = "Make sure your UPPER BODY and BAR are visible"
-
-            cv2.rectangle(image, (0, 0), (320, 80), (0, 0, 0), -1)
-            cv2.putText(
-                image,
-                f"Reps: {counter}",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.9,
-                (180, 105, 255),
-                2,
-            )
-            cv2.putText(
-                image,
-                f"Stage: {stage.upper()}",
-                (10, 60),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (200, 200, 200),
-                2,
-            )
-
-            cv2.rectangle(image, (0, h - 70), (w, h), (0, 0, 0), -1)
-            cv2.putText(
-                image,
-                feedback_text,
-                (10, h - 25),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (203, 192, 255),
-                2,
-            )
-
-            out.write(image)
-
-    cap.release()
-    out.release()
-    return counter
+@app.route("/api/workout_landmarks", methods=["POST"])
+def workout_landmarks():
+    """
+    Counts reps + form feedback from landmarks computed on the device
+    (JSON or raw float16/float32 N x 33 x 4, see landmark_uploads.py).
+    No video, no pose inference on the server.
+    """
+    try:
+        landmarks, options = read_landmark_upload(request)
+    except (LandmarkUploadError, RequestEntityTooLarge) as e:
+        return jsonify({"ok": False, "error": e.description}), e.code
+
+    workout_type = (options["workout_type"] or "pushup").lower()
+    if workout_type not in FORM_COUNTERS:
+        return jsonify({"ok": False, "error": f"Unknown workout_type: {workout_type}"}), 400
+
+    scored = score_landmarks(
+        landmarks,
+        [workout_type],
+        options["frame_size"],
+        counter_classes=FORM_COUNTERS,
+        feedback=options["feedback"],
+    )
+    return jsonify({
+        "ok": True,
+        "workout_type": workout_type,
+        "reps": scored["counts"][workout_type],
+        "stage": scored["stages"][workout_type],
+        "feedback": scored["feedback"].get(workout_type),
+        "frames": len(landmarks),
+        "pose_frames": int((~np.isnan(landmarks[:, 0, 0])).sum()),
+        "duration_seconds": round(len(landmarks) / options["fps"], 2),
+    })
 
 
-# === 3) Push-ups ===
-def process_pushup_video(input_path, output_path):
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
-        print("Could not open input video")
-        return 0
-
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps <= 0 or np.isnan(fps):
-        fps = 25.0
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-
-    counter = 0
-    stage = "up"
-    feedback_text = "Start in plank position"
-    reached_bottom = False
-
-    ELBOW_DOWN_ANGLE = 75
-    ELBOW_UP_ANGLE = 160
-    BODY_STRAIGHT_ANGLE = 170
-
-    with mp_pose.Pose(
-        min_detection_confidence=0.7,
-        min_tracking_confidence=0.7,
-        smooth_landmarks=True,
-    ) as pose:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame = cv2.addWeighted(frame, 0.4, np.zeros_like(frame), 0.6, 0)
-
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image.flags.writeable = False
-            results = pose.process(image)
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-            h, w, _ = image.shape
-            current_feedback = feedback_text
-
-            if results.pose_landmarks:
-                landmarks = results.pose_landmarks.landmark
-
-                LEFT_SHOULDER = 11
-                LEFT_ELBOW = 13
-                LEFT_WRIST = 15
-                LEFT_HIP = 23
-                LEFT_KNEE = 25
-                LEFT_ANKLE = 27
-
-                def get_point(idx):
-                    lm = landmarks[idx]
-                    return int(lm.x * w), int(lm.y * h)
-
-                shoulder = get_point(LEFT_SHOULDER)
-                elbow = get_point(LEFT_ELBOW)
-                wrist = get_point(LEFT_WRIST)
-                hip = get_point(LEFT_HIP)
-                knee = get_point(LEFT_KNEE)
-                ankle = get_point(LEFT_ANKLE)
-
-                elbow_angle = calculate_angle(shoulder, elbow, wrist)
-                hip_angle = calculate_angle(shoulder, hip, ankle)
-
-                good_body_line = hip_angle >= BODY_STRAIGHT_ANGLE
-
-                if elbow_angle <= ELBOW_DOWN_ANGLE and good_body_line and stage == "up":
-                    stage = "down"
-                    reached_bottom = True
-
-                if (
-                    elbow_angle >= ELBOW_UP_ANGLE
-                    and good_body_line
-                    and stage == "down"
-                    and reached_bottom
-                ):
-                    stage = "up"
-                    counter += 1
-                    reached_bottom = False
-
-                feedback_messages = []
-
-                if not good_body_line:
-                    feedback_messages.append("Keep your body STRAIGHT")
-
-                if stage == "down" and elbow_angle > ELBOW_DOWN_ANGLE + 5:
-                    feedback_messages.append("Go a bit LOWER")
-
-                if stage == "up" and not reached_bottom and elbow_angle < ELBOW_UP_ANGLE - 10:
-                    feedback_messages.append("Use FULL range of motion")
-
-                if not feedback_messages:
-                    current_feedback = "Form: GOOD ✅"
-                else:
-                    current_feedback = " / ".join(feedback_messages)
-
-                feedback_text = current_feedback
-
-                mp_drawing.draw_landmarks(
-                    image,
-                    results.pose_landmarks,
-                    mp_pose.POSE_CONNECTIONS,
-                    mp_drawing.DrawingSpec(color=PINK, thickness=3, circle_radius=4),
-                    mp_drawing.DrawingSpec(color=PINK, thickness=2, circle_radius=2),
-                )
-
-                for point in [shoulder, elbow, wrist, hip, knee, ankle]:
-                    cv2.circle(image, point, 7, PINK, -1)
-
-                cv2.putText(
-                    image,
-                    f"Elbow: {int(elbow_angle)}°",
-                    (10, 90),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.7,
-                    NEON_CYAN,
-                    2,
-                )
-                cv2.putText(
-                    image,
-                    f"Hip: {int(hip_angle)}°",
-                    (10, 120),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.7,
-                    NEON_CYAN,
-                    2,
-                )
-            else:
-                feedback_text = "Make sure your FULL BODY is visible"
-
-            cv2.rectangle(image, (0, 0), (320, 80), (0, 0, 0), -1)
-            cv2.putText(
-                image,
-                f"Reps: {counter}",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.9,
-                (180, 105, 255),
-                2,
-            )
-            cv2.putText(
-                image,
-                f"Stage: {stage.upper()}",
-                (10, 60),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (200, 200, 200),
-                2,
-            )
+@app.route("/outputs/<path:filename>")
+def outputs(filename):
+    """Serve processed workout videos (ETag, immutable caching, Range)."""
+    response = send_media(OUTPUT_FOLDER, filename)
+    storage.touch(os.path.join(OUTPUT_FOLDER, filename))
+    return response
+
+
+@app.route("/storage/metrics")
+def storage_metrics():
+    """Bytes held per folder and eviction counters (JSON)."""
+    return jsonify({"ok": True, **storage.metrics()})
+
+
+@app.route("/nutrition/cache/metrics")
+def nutrition_cache_metrics():
+    """Vision result cache size and hit / miss / eviction counters (JSON)."""
+    return jsonify(
+        {
+            "ok": True,
+            **nutrition_cache.metrics(),
+            "live_frames": live_frames.metrics(),
+            "vision_models": vision_gateway.metrics(),
+        }
+    )
 
-            cv2.rectangle(image, (0, h - 70), (w, h), (0, 0, 0), -1)
-            cv2.putText(
-                image,
-                feedback_text,
-                (10, h - 25),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (203, 192, 255),
-                2,
-            )
 
-            out.write(image)
+def _darken(frame):
+    """Dim the clip so the pink skeleton and overlays stand out."""
+    return cv2.addWeighted(frame, 0.4, np.zeros_like(frame), 0.6, 0)
 
-    cap.release()
-    out.release()
-    return counter
 
+def process_video(input_path, output_path, workout_type, render=True, video_hash=None):
+    """
+    Returns (reps, processed_path); render=False skips writing the video
+    (processed_path is then None). The output size, fps and codec follow
+    the output profile in video_sinks.py.
+    Landmarks are cached per video content hash, so re-scoring the same
+    clip for another exercise skips pose inference.
+    workout_type="auto" detects the exercise(s) in the clip; reps are
+    then summed over every detected segment.
+    Each analysis is saved to the logs table with its per-rep events.
+    input_path must be pinned in upload_pins by the caller; the pin is
+    released here, and the upload deleted once its landmarks are cached
+    (unless KEEP_UPLOADS or another request still uses it).
+    """
+    workout_type = (workout_type or "pushup").lower()
+    detect = workout_type == "auto"
+    if workout_type not in FORM_COUNTERS:
+        workout_type = "pushup"
 
-# === 4) Squats ===
-def process_squat_video(input_path, output_path):
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
+    result = None
+    try:
+        result = analyze_video(
+            input_path,
+            output_path,
+            [workout_type],
+            render=render,
+            detect=detect,
+            counter_classes=FORM_COUNTERS,
+            cache=landmark_cache,
+            video_hash=video_hash,
+            pose_options=POSE_OPTIONS,
+            frame_filter=_darken,
+            skeleton_style=PINK_SKELETON_STYLE,
+            analysis_fps=ANALYSIS_FPS or None,
+            max_inference_side=MAX_INFERENCE_SIDE or None,
+        )
+    finally:
+        stored = bool(result and result.get("landmarks_path"))
+        upload_pins.release(input_path, discard=stored and not KEEP_UPLOADS)
+    if result is None:
         print("Could not open input video")
-        return 0
-
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps <= 0 or np.isnan(fps):
-        fps = 25.0
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-
-    counter = 0
-    stage = "up"
-    feedback_text = "Stand tall to start"
-    reached_bottom = False
-
-    KNEE_DOWN_ANGLE = 80
-    KNEE_UP_ANGLE = 160
-    CHEST_FOLD_ANGLE = 140
-
-    with mp_pose.Pose(
-        min_detection_confidence=0.7,
-        min_tracking_confidence=0.7,
-        smooth_landmarks=True,
-    ) as pose:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame = cv2.addWeighted(frame, 0.4, np.zeros_like(frame), 0.6, 0)
-
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image.flags.writeable = False
-            results = pose.process(image)
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-            h, w, _ = image.shape
-            current_feedback = feedback_text
-
-            if results.pose_landmarks:
-                landmarks = results.pose_landmarks.landmark
-
-                LEFT_SHOULDER = 11
-                LEFT_HIP = 23
-                LEFT_KNEE = 25
-                LEFT_ANKLE = 27
-
-                def get_point(idx):
-                    lm = landmarks[idx]
-                    return int(lm.x * w), int(lm.y * h)
-
-                shoulder = get_point(LEFT_SHOULDER)
-                hip = get_point(LEFT_HIP)
-                knee = get_point(LEFT_KNEE)
-                ankle = get_point(LEFT_ANKLE)
-
-                knee_angle = calculate_angle(hip, knee, ankle)
-                hip_angle = calculate_angle(shoulder, hip, knee)
-
-                if knee_angle <= KNEE_DOWN_ANGLE and stage == "up":
-                    stage = "down"
-                    reached_bottom = True
-
-                if knee_angle >= KNEE_UP_ANGLE and stage == "down" and reached_bottom:
-                    stage = "up"
-                    counter += 1
-                    reached_bottom = False
-
-                feedback_messages = []
-
-                if stage == "down" and knee_angle > KNEE_DOWN_ANGLE + 10:
-                    feedback_messages.append("Go LOWER for full squat")
-
-                if stage == "up" and not reached_bottom and knee_angle < KNEE_UP_ANGLE - 10:
-                    feedback_messages.append("Stand fully between reps")
-
-                if hip_angle < CHEST_FOLD_ANGLE:
-                    feedback_messages.append("Keep your chest UP")
-
-                if not feedback_messages:
-                    current_feedback = "Form: GOOD ✅"
-                else:
-                    current_feedback = " / ".join(feedback_messages)
-
-                feedback_text = current_feedback
-
-                mp_drawing.draw_landmarks(
-                    image,
-                    results.pose_landmarks,
-                    mp_pose.POSE_CONNECTIONS,
-                    mp_drawing.DrawingSpec(color=PINK, thickness=3, circle_radius=4),
-                    mp_drawing.DrawingSpec(color=PINK, thickness=2, circle_radius=2),
-                )
-
-                for point in [shoulder, hip, knee, ankle]:
-                    cv2.circle(image, point, 7, PINK, -1)
-
-                cv2.putText(
-                    image,
-                    f"Knee: {int(knee_angle)}°",
-                    (10, 90),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.7,
-                    NEON_CYAN,
-                    2,
-                )
-                cv2.putText(
-                    image,
-                    f"Hip: {int(hip_angle)}°",
-                    (10, 120),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.7,
-                    NEON_CYAN,
-                    2,
-                )
-            else:
-                feedback_text = "Make sure your FULL BODY is visible"
-
-            cv2.rectangle(image, (0, 0), (320, 80), (0, 0, 0), -1)
-            cv2.putText(
-                image,
-                f"Squats: {counter}",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.9,
-                (180, 105, 255),
-                2,
-            )
-            cv2.putText(
-                image,
-                f"Stage: {stage.upper()}",
-                (10, 60),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (200, 200, 200),
-                2,
-            )
-
-            cv2.rectangle(image, (0, h - 70), (w, h), (0, 0, 0), -1)
-            cv2.putText(
-                image,
-                feedback_text,
-                (10, h - 25),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (203, 192, 255),
-                2,
-            )
+        return 0, None
+    if detect:
+        workout_type = "auto"
+        reps = sum(result["counts"].values())
+    else:
+        reps = result["counts"][workout_type]
+    try:
+        log_workout(workout_type, reps, result)
+    except Exception as e:
+        print("Warning: failed to save workout log:", e)
+    return reps, result["output_path"]
 
-            out.write(image)
 
-    cap.release()
-    out.release()
-    return counter
+def log_workout(workout_type, reps, result):
+    """
+    Saves an analysis for the progress page: the JSON summary in `data`,
+    every rep (rep_events.py) as a columnar blob in `blob`.
+    """
+    events = result.get("rep_events") or []
+    log_payload = {
+        "workout_type": workout_type,
+        "reps": reps,
+        "counts": result["counts"],
+        "summary": summarize_reps(events),
+    }
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO logs (user_id, date, type, data, blob) VALUES (?,?,?,?,?)",
+        (
+            get_current_user_id(),
+            datetime.date.today().isoformat(),
+            "workout",
+            json.dumps(log_payload),
+            encode_rep_log(events, result.get("fps")),
+        ),
+    )
+    conn.commit()
+    conn.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+"""
+Output sinks for annotated workout videos.
+
+A sink takes BGR frames of one fixed size and writes them somewhere:
+OpenCVSink is the plain cv2.VideoWriter (mp4v), FfmpegSink pipes raw
+frames into a local ffmpeg process. With output_format="hls" ffmpeg
+cuts the stream into fragmented-MP4 segments and keeps an "event"
+playlist up to date while processing runs, so the first annotated
+reps can be watched before the whole video is done. Without ffmpeg
+every format falls back to OpenCVSink.
+
+Every sink is sized by an output profile: frames are downscaled to
+max_side and thinned to the profile fps before encoding, and ffmpeg
+encodes H.264 (.mp4, faststart) or VP9 (.webm) under a bitrate cap.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+import cv2
+import numpy as np
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN") or shutil.which("ffmpeg")
+HLS_SEGMENT_SECONDS = float(os.getenv("HLS_SEGMENT_SECONDS", "2"))
+
+HLS_PLAYLIST = "index.m3u8"
+HLS_INIT_SEGMENT = "init.mp4"
+
+# ---------- Output profile (read from env) ----------
+# max_side / fps of 0 keep the source size / frame rate
+DEFAULT_OUTPUT_PROFILE = {
+    "max_side": int(os.getenv("OUTPUT_MAX_SIDE", "720")),
+    "fps": float(os.getenv("OUTPUT_FPS", "24")),
+    "max_bitrate": os.getenv("OUTPUT_MAX_BITRATE", "1500k"),
+    "codec": os.getenv("OUTPUT_CODEC", "h264").lower(),  # "h264" or "vp9"
+}
+
+CODEC_EXTENSIONS = {"h264": ".mp4", "vp9": ".webm"}
+
+
+class OpenCVSink:
+    """cv2.VideoWriter with the mp4v codec."""
+
+    def __init__(self, path, fps, size):
+        self.path = path
+        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+        self._out = cv2.VideoWriter(path, fourcc, fps, size)
+
+    def write(self, frame):
+        self._out.write(frame)
+
+    def release(self):
+        self._out.release()
+
+
+class FfmpegSink:
+    """
+    Raw bgr24 frames on ffmpeg's stdin; `output_args` pick the codec
+    and container. release() waits for ffmpeg and raises IOError (with
+    the tail of its log) if it failed.
+    """
+
+    def __init__(self, path, fps, size, output_args):
+        self.path = path
+        w, h = size
+        cmd = [
+            FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{w}x{h}", "-r", f"{fps:g}",
+            "-i", "-",
+            *output_args,
+            path,
+        ]
+        self._log = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                      stdout=subprocess.DEVNULL, stderr=self._log)
+
+    def write(self, frame):
+        try:
+            self._proc.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self.release()
+            raise
+
+    def release(self):
+        if self._log.closed:
+            return
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        code = self._proc.wait()
+        self._log.seek(0)
+        log = self._log.read().decode("utf-8", "replace").strip()
+        self._log.close()
+        if code != 0:
+            raise IOError(f"ffmpeg exited with {code}: {log[-500:]}")
+
+
+def bitrate_kbps(value):
+    """'1500k' / '2M' / 1500000 -> kbit/s."""
+    text = str(value).strip().lower()
+    if text.endswith("k"):
+        return int(float(text[:-1]))
+    if text.endswith("m"):
+        return int(float(text[:-1]) * 1000)
+    return int(float(text) / 1000)
+
+
+def codec_args(profile):
+    """ffmpeg encoder options for the profile codec, capped at max_bitrate."""
+    rate = bitrate_kbps(profile["max_bitrate"])
+    if profile["codec"] == "vp9":
+        # constrained quality: CRF, never above the cap
+        return [
+            "-c:v", "libvpx-vp9", "-crf", "36", "-b:v", f"{rate}k",
+            "-deadline", "realtime", "-cpu-used", "8", "-row-mt", "1",
+            "-pix_fmt", "yuv420p",
+        ]
+    return [
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+        "-maxrate", f"{rate}k", "-bufsize", f"{rate * 2}k",
+        "-pix_fmt", "yuv420p",
+    ]
+
+
+def mp4_output_args(profile):
+    """Single file; moov up front so browsers can start playing at once."""
+    args = codec_args(profile)
+    if profile["codec"] != "vp9":
+        args += ["-movflags", "+faststart"]
+    return args
+
+
+def hls_output_args(folder, profile, segment_seconds=HLS_SEGMENT_SECONDS):
+    """H.264 in fMP4 HLS segments, one keyframe at every segment start."""
+    return [
+        *codec_args(dict(profile, codec="h264")),
+        "-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds:g})",
+        "-f", "hls",
+        "-hls_time", f"{segment_seconds:g}",
+        "-hls_playlist_type", "event",
+        "-hls_segment_type", "fmp4",
+        "-hls_fmp4_init_filename", HLS_INIT_SEGMENT,
+        "-hls_segment_filename", os.path.join(folder, "seg_%05d.m4s"),
+        "-hls_flags", "independent_segments+temp_file",
+    ]
+
+
+def output_size(size, max_side):
+    """(w, h) scaled so the longest side is at most max_side, kept even for yuv420p."""
+    w, h = size
+    if max_side and max(w, h) > max_side:
+        scale = max_side / float(max(w, h))
+        w, h = int(w * scale), int(h * scale)
+    return max(2, w - w % 2), max(2, h - h % 2)
+
+
+class ResampledSink:
+    """
+    Downscales frames to `size` and drops frames to get from `src_fps`
+    to `fps` before handing them to the wrapped sink.
+    """
+
+    def __init__(self, sink, src_fps, fps, size):
+        self.sink = sink
+        self.path = sink.path
+        self.size = size
+        self._step = src_fps / fps
+        self._next = 0.0
+        self._index = 0
+
+    def write(self, frame):
+        index = self._index
+        self._index += 1
+        if index + 1e-6 < self._next:
+            return
+        self._next += self._step
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        self.sink.write(frame)
+
+    def release(self):
+        self.sink.release()
+
+
+def open_sink(path, fps, size, output_format="mp4", profile=None):
+    """
+    Sink for `path` in `output_format` ("mp4" or "hls"; for hls, path is
+    the playlist inside the stream's own folder), sized and encoded per
+    `profile` (DEFAULT_OUTPUT_PROFILE). The extension follows the codec
+    (VP9 -> .webm). Without ffmpeg, everything falls back to an mp4v
+    file (for hls, next to the playlist); check sink.path.
+    """
+    profile = dict(DEFAULT_OUTPUT_PROFILE, **(profile or {}))
+    out_size = output_size(size, profile["max_side"])
+    out_fps = min(fps, profile["fps"]) if profile["fps"] else fps
+
+    if output_format == "hls":
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        if FFMPEG_BIN:
+            sink = FfmpegSink(path, out_fps, out_size, hls_output_args(folder, profile))
+        else:
+            sink = OpenCVSink(os.path.splitext(path)[0] + ".mp4", out_fps, out_size)
+    elif FFMPEG_BIN:
+        path = os.path.splitext(path)[0] + CODEC_EXTENSIONS.get(profile["codec"], ".mp4")
+        sink = FfmpegSink(path, out_fps, out_size, mp4_output_args(profile))
+    else:
+        sink = OpenCVSink(os.path.splitext(path)[0] + ".mp4", out_fps, out_size)
+
+    if out_size == tuple(size) and out_fps == fps:
+        return sink
+    return ResampledSink(sink, fps, out_fps, out_size)
@@ -0,0 +1,186 @@
+"""
+Streaming video uploads.
+
+Werkzeug normally spools each uploaded file to a temporary file and
+the view then copies it to its final place. For workout videos the
+multipart parser instead writes straight into the upload folder
+through HashedUploadFile, which hashes the bytes as they arrive and
+probes the container header from the first chunk, so a file that is
+not a video is rejected (415) before the rest of the body is stored.
+The overall size cap is Flask's MAX_CONTENT_LENGTH (413).
+"""
+import os
+import uuid
+import hashlib
+
+from flask import Request
+from werkzeug.exceptions import UnsupportedMediaType
+
+from landmark_cache import save_stream_hashed
+
+# enough for every container signature below, and for the ftyp box
+PROBE_BYTES = 64 * 1024
+
+# ftyp brands of still images / audio-only files in an MP4-family box
+NON_VIDEO_BRANDS = {b"heic", b"heix", b"heim", b"heis", b"mif1", b"msf1",
+                    b"avif", b"avis", b"M4A ", b"M4B ", b"M4P "}
+# leading atoms of QuickTime files written without an ftyp box
+QUICKTIME_ATOMS = {b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+
+
+class UploadRejected(UnsupportedMediaType):
+    """The upload is not a video container we can decode."""
+
+    description = "Please upload a video file (mp4/mov/avi/mkv/webm)."
+
+
+def probe_video_header(head):
+    """
+    Identifies the video container from the first bytes of a file.
+    Returns a short name ("mp4", "mov", "mkv", "webm", "avi", ...) or
+    None when the bytes don't look like a video container.
+    """
+    if len(head) >= 12 and head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in NON_VIDEO_BRANDS:
+            return None
+        return "mov" if brand == b"qt  " else "mp4"
+    if len(head) >= 8 and head[4:8] in QUICKTIME_ATOMS:
+        return "mov"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm" if b"webm" in head[:64] else "mkv"
+    if head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+        return "avi"
+    if head.startswith(b"\x00\x00\x01\xba"):
+        return "mpeg"
+    if len(head) > 188 and head[0] == 0x47 and head[188] == 0x47:
+        return "ts"
+    if head.startswith(b"FLV"):
+        return "flv"
+    if head.startswith(b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"):
+        return "asf"
+    return None
+
+
+class HashedUploadFile:
+    """
+    Writable file for Werkzeug's multipart parser.
+
+    Data goes to a hidden .part file in `folder` while it is SHA-256
+    hashed; once PROBE_BYTES have arrived (or the part ends) the header
+    is probed and UploadRejected aborts the request. finalize() renames
+    the part to <sha256><ext>, so saving never copies the video again.
+    """
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, f".{uuid.uuid4().hex}.part")
+        self.container = None
+        self._file = open(self.path, "w+b")
+        self._digest = hashlib.sha256()
+        self._head = b""
+        self._final_path = None
+
+    def _probe(self):
+        self.container = probe_video_header(self._head)
+        self._head = b""
+        if self.container is None:
+            self.discard()
+            raise UploadRejected()
+
+    def write(self, data):
+        if self.container is None:
+            self._head += data
+            if len(self._head) >= PROBE_BYTES:
+                self._probe()
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def seek(self, offset, whence=0):
+        # the parser seeks back to 0 once the part is complete
+        if self.container is None:
+            self._probe()
+        return self._file.seek(offset, whence)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def finalize(self, ext):
+        """Move the upload to <sha256><ext>; returns (path, sha256)."""
+        if self._final_path is None:
+            video_hash = self._digest.hexdigest()
+            self._file.flush()
+            self._final_path = os.path.join(os.path.dirname(self.path), f"{video_hash}{ext}")
+            os.replace(self.path, self._final_path)
+        return self._final_path, self._digest.hexdigest()
+
+    def discard(self):
+        self._file.close()
+        if self._final_path is None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        # request teardown: uploads the view never saved are removed
+        self.discard()
+
+
+def streaming_upload_request(folder, endpoints):
+    """
+    Flask request class whose file uploads to `endpoints` are streamed
+    into `folder` as HashedUploadFile (other routes keep the default).
+    Use as `app.request_class`.
+    """
+    endpoints = set(endpoints)
+
+    class StreamingUploadRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type,
+                             filename=None, content_length=None):
+            if filename and self.endpoint in endpoints:
+                part = HashedUploadFile(folder)
+                self.__dict__.setdefault("_upload_parts", []).append(part)
+                return part
+            return super()._get_file_stream(
+                total_content_length, content_type, filename, content_length
+            )
+
+        def _load_form_data(self):
+            # a body cut short (413 partway, client gone, 415 probe) never
+            # reaches request.files, so its .part files would never be closed
+            try:
+                super()._load_form_data()
+            except BaseException:
+                for part in self.__dict__.pop("_upload_parts", ()):
+                    part.discard()
+                raise
+
+        def close(self):
+            # teardown: also parts the parser dropped without raising
+            # (discard() leaves finalized uploads alone)
+            super().close()
+            for part in self.__dict__.pop("_upload_parts", ()):
+                part.discard()
+
+    return StreamingUploadRequest
+
+
+def save_video_upload(file_storage, folder, ext):
+    """
+    Stores an uploaded video as <sha256><ext> in `folder`; returns
+    (path, sha256). Streamed uploads are just renamed; anything else is
+    probed and copied in chunks. Raises UploadRejected for non-videos.
+    """
+    stream = file_storage.stream
+    if isinstance(stream, HashedUploadFile):
+        return stream.finalize(ext)
+
+    head = stream.read(PROBE_BYTES)
+    if probe_video_header(head) is None:
+        raise UploadRejected()
+    stream.seek(0)
+    return save_stream_hashed(stream, folder, ext)
+
@@ -0,0 +1,363 @@
+"""
+Asynchronous gateway to the OpenAI vision model.
+
+Flask request threads used to call the blocking client one model after
+another with the SDK's default 10 minute timeout, so a slow API could
+hold every web worker. Calls now run on one asyncio event loop in a
+background thread with a single AsyncOpenAI client (one shared HTTP
+connection pool):
+
+  - every analyze() has a deadline; the request thread gets
+    VisionTimeout once it passes, and the upstream call is cancelled;
+  - at most max_concurrency vision calls are in flight; the rest wait
+    up to queue_timeout seconds for a slot and then fail fast with
+    VisionBusy, so a slow upstream cannot pile up waiting web workers;
+  - models are tried in order: a model-access error (403 / unknown
+    model) moves on to the next one right away, and with hedge_after
+    set, a primary that has not answered after that many seconds gets
+    a parallel request to the next model: the first answer wins and
+    the other call is cancelled.
+
+Each model also has a CircuitBreaker, so failures are remembered across
+requests instead of being rediscovered by every call:
+
+  - a model-access error (403 / model not found) marks the model
+    unavailable for a while; requests go straight to the fallback;
+  - rate limits open the circuit for the server's Retry-After, or an
+    exponentially growing cooldown;
+  - other errors open it after `failures` in a row, again with an
+    exponential cooldown;
+  - once the cooldown is over a single probe request is let through
+    (half-open): success closes the circuit, failure re-opens it.
+
+While every model's circuit is open, analyze() fails at once with
+ModelsUnavailable (and a retry_after) instead of calling upstream.
+"""
+import asyncio
+import json
+import math
+import threading
+import time
+
+from openai import (
+    AsyncOpenAI,
+    NotFoundError,
+    OpenAIError,
+    PermissionDeniedError,
+    RateLimitError,
+)
+
+PROMPT = (
+    "You are a nutrition expert. Look at the food photo and respond ONLY as strict JSON with this schema: "
+    '{"is_food": true|false, "items": [{"name": string, "calories": integer, "protein": number, "carbs": number, "fat": number}]}'
+)
+
+
+class VisionTimeout(OpenAIError):
+    """No model answered before the request deadline."""
+
+
+class ModelsUnavailable(OpenAIError):
+    """Every model's circuit is open; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Vision service is cooling down, retry in {math.ceil(retry_after)}s.")
+        self.retry_after = retry_after
+
+
+class VisionBusy(ModelsUnavailable):
+    """Every vision slot stayed taken for queue_timeout seconds."""
+
+    def __init__(self, retry_after):
+        OpenAIError.__init__(self, f"Vision service is busy, retry in {math.ceil(retry_after)}s.")
+        self.retry_after = retry_after
+
+
+def is_model_access_error(error):
+    """Errors that mean "this model is not usable here, try another"."""
+    msg = str(error).lower()
+    return ("model" in msg) or ("access" in msg) or ("403" in msg)
+
+
+def error_kind(error):
+    """"rate_limit", "access" (model not usable with this key) or "other"."""
+    msg = str(error).lower()
+    if isinstance(error, RateLimitError) or "429" in msg or "rate limit" in msg:
+        return "rate_limit"
+    if (
+        isinstance(error, (PermissionDeniedError, NotFoundError))
+        or "model_not_found" in msg
+        or "does not have access" in msg
+        or "403" in msg
+    ):
+        return "access"
+    return "other"
+
+
+def _retry_after(error):
+    """Seconds from the response's Retry-After header, if any."""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    closed -> open -> half-open (one probe) -> closed, for one model.
+
+    failures        : consecutive "other" errors that open the circuit
+    cooldown        : first open period in seconds; doubles with every
+                      re-open until a success, capped at max_cooldown
+    unavailable_for : open period after a model-access error
+    """
+
+    def __init__(self, failures=3, cooldown=15.0, max_cooldown=600.0, unavailable_for=600.0):
+        self.max_failures = max(1, failures)
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.unavailable_for = unavailable_for
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.last_error = None
+
+    def allow(self):
+        """True if a request may go out now (claims the probe when half-open)."""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() < self.open_until:
+                    return False
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open":
+                if self.probing:
+                    return False
+                self.probing = True
+            return True
+
+    def retry_after(self):
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            return max(0.0, self.open_until - time.monotonic())
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trips = 0
+            self.probing = False
+
+    def release(self):
+        """The request was cancelled: no verdict, free the probe."""
+        with self._lock:
+            self.probing = False
+
+    def failure(self, kind, retry_after=None):
+        with self._lock:
+            self.probing = False
+            self.last_error = kind
+            if kind == "access":
+                self._open(self.unavailable_for)
+            elif kind == "rate_limit":
+                self.trips += 1
+                self._open(retry_after or self._backoff())
+            else:
+                self.failures += 1
+                if self.state == "half_open" or self.failures >= self.max_failures:
+                    self.trips += 1
+                    self._open(self._backoff())
+
+    def _backoff(self):
+        return min(self.max_cooldown, self.cooldown * 2 ** max(0, self.trips - 1))
+
+    def _open(self, seconds):
+        self.state = "open"
+        self.open_until = time.monotonic() + seconds
+        self.failures = 0
+
+    def metrics(self):
+        retry_after = self.retry_after()
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "retry_after_seconds": round(retry_after, 1),
+                "last_error": self.last_error,
+            }
+
+
+class VisionGateway:
+    """
+    client_kwargs   : AsyncOpenAI arguments (api_key, project, ...)
+    deadline        : seconds one analyze() may take, all models included
+    max_concurrency : vision calls in flight at once
+    queue_timeout   : seconds a call may wait for a free slot before
+                      failing with VisionBusy
+    hedge_after     : seconds before a slow model is hedged with the next
+                      one (None / 0 = only fall back on access errors)
+    breaker_options : CircuitBreaker arguments, shared by every model
+    """
+
+    def __init__(self, client_kwargs, deadline=15.0, max_concurrency=8, hedge_after=None,
+                 breaker_options=None, queue_timeout=2.0):
+        self.client_kwargs = dict(client_kwargs)
+        self.deadline = deadline
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.hedge_after = hedge_after or None
+        self.breaker_options = breaker_options or {}
+        self.breakers = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._client = None
+        self._slots = None
+
+    def _start(self):
+        """Starts the event loop thread and the shared client (once)."""
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="vision-gateway", daemon=True).start()
+
+            async def setup():
+                # per-call timeouts come from the deadline; SDK retries would overrun it
+                self._client = AsyncOpenAI(
+                    **self.client_kwargs, timeout=self.deadline, max_retries=0
+                )
+                self._slots = asyncio.Semaphore(self.max_concurrency)
+
+            asyncio.run_coroutine_threadsafe(setup(), loop).result()
+            self._loop = loop
+            return loop
+
+    def breaker(self, model):
+        with self._lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(**self.breaker_options)
+            return self.breakers[model]
+
+    async def _call(self, model, img_b64):
+        """One vision request, with its outcome recorded on the model's breaker."""
+        breaker = self.breaker(model)
+        try:
+            resp = await self._request(model, img_b64)
+        except (asyncio.CancelledError, VisionBusy):
+            # never reached the model: no verdict
+            breaker.release()
+            raise
+        except OpenAIError as e:
+            breaker.failure(error_kind(e), _retry_after(e))
+            raise
+        breaker.success()
+        return json.loads(resp.choices[0].message.content.strip())
+
+    async def _request(self, model, img_b64):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise VisionBusy(self.queue_timeout)
+        try:
+            return await self._client.chat.completions.create(
+                model=model,
+                response_format={"type": "json_object"},
+                messages=[
+                    {"role": "system", "content": "You are a nutrition assistant."},
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": PROMPT},
+                            {
+                                "type": "image_url",
+                                "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"},
+                            },
+                        ],
+                    },
+                ],
+                max_tokens=500,
+                temperature=0.2,
+            )
+        finally:
+            self._slots.release()
+
+    async def _first_answer(self, img_b64, models):
+        """(model, parsed JSON) from the first model that answers."""
+        queue = list(models)
+        running = {}
+        last_err = None
+        fatal = None  # an error that rules out falling back to further models
+
+        def launch():
+            # next model whose circuit lets a request through
+            while queue:
+                model = queue.pop(0)
+                if self.breaker(model).allow():
+                    running[asyncio.ensure_future(self._call(model, img_b64))] = model
+                    return True
+            return False
+
+        if not launch():
+            raise ModelsUnavailable(min(self.breaker(m).retry_after() for m in models))
+        try:
+            while running:
+                hedge = self.hedge_after if queue and not fatal else None
+                done, _pending = await asyncio.wait(
+                    running, timeout=hedge, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # slow model: race the next one against it
+                    launch()
+                    continue
+                for task in done:
+                    model = running.pop(task)
+                    try:
+                        return model, task.result()
+                    except OpenAIError as e:
+                        if error_kind(e) == "other" and not is_model_access_error(e):
+                            # no new fallbacks, but a hedge in flight may still answer
+                            fatal = fatal or e
+                        last_err = e
+                if not running and queue and not fatal:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+        if fatal or last_err:
+            raise fatal or last_err
+        raise OpenAIError("Unknown OpenAI error")
+
+    def analyze(self, img_b64, models, deadline=None):
+        """
+        Blocking entry point for request threads: (model, parsed JSON).
+        Raises VisionTimeout after `deadline` seconds (default self.deadline).
+        """
+        deadline = deadline or self.deadline
+        loop = self._start()
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(self._first_answer(img_b64, list(models)), deadline), loop
+        )
+        try:
+            return future.result()
+        except asyncio.TimeoutError:
+            raise VisionTimeout(f"Vision model did not answer within {deadline:g}s.")
+
+    def metrics(self):
+        with self._lock:
+            breakers = dict(self.breakers)
+        return {model: breaker.metrics() for model, breaker in breakers.items()}
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.close(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,47 @@
+"""
+Image normalization before vision API calls.
+
+Phone photos are 12+ MP and the live camera sends 0.9-quality frames,
+but the vision model looks at food through a few 512 px tiles anyway.
+Every image is therefore re-encoded the same way before it is hashed,
+cached or sent:
+
+  - JPEG sources are decoded with Pillow's draft() mode, which lets the
+    decoder scale by 1/2, 1/4 or 1/8 while decoding instead of
+    producing the full-size bitmap first;
+  - the EXIF orientation is applied, then all metadata is dropped
+    (EXIF, GPS, ICC and thumbnails are never sent upstream);
+  - the longest side is capped at max_side and the result saved as
+    baseline RGB JPEG at `quality`.
+
+The output is deterministic for a given input, so the content-addressed
+result cache keys on the normalized bytes.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# a 768 px image is one "high detail" tile group; food stays recognizable
+DEFAULT_MAX_SIDE = 768
+DEFAULT_QUALITY = 80
+
+
+def normalize_image(data, max_side=DEFAULT_MAX_SIDE, quality=DEFAULT_QUALITY):
+    """
+    Encoded image bytes (or a binary file object) -> normalized JPEG bytes.
+    Raises PIL.UnidentifiedImageError / OSError for unreadable images.
+    """
+    img = Image.open(BytesIO(data) if isinstance(data, (bytes, bytearray)) else data)
+    if max_side:
+        # JPEG only: decode at the smallest 1/2^k scale still >= max_side
+        img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    out = BytesIO()
+    # no exif= / icc_profile=: metadata is not carried over
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
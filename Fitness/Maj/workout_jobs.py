@@ -0,0 +1,245 @@
+"""
+Background job queue for workout video analysis.
+
+Uploads are handed to a bounded pool of worker processes so a long
+MediaPipe pass never pins a Flask request thread. Jobs are tracked
+in memory in the web process; workers report progress through a
+shared Manager dict that the status endpoint reads.
+
+Uploads are stored under their content hash, so two jobs may read the
+same input file. InputPins counts the jobs (and requests) using each
+input: it is only deleted, by the job queue or a storage sweep, once
+nothing references it any more.
+"""
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+# ---------- Job queue config (read from env) ----------
+WORKOUT_JOB_WORKERS = int(os.getenv("WORKOUT_JOB_WORKERS", "2"))
+WORKOUT_JOB_MAX_PENDING = int(os.getenv("WORKOUT_JOB_MAX_PENDING", "16"))
+WORKOUT_JOB_HISTORY = int(os.getenv("WORKOUT_JOB_HISTORY", "200"))
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already queued or running."""
+
+
+class InputPins:
+    """
+    Reference counts of input files still needed by queued / running jobs.
+
+    Store an upload and pin it inside saving(), so a job finishing in
+    between can't delete the (same-named) file; release() drops a pin
+    and, with discard=True, deletes the file if that was the last one.
+    `path in pins` tells storage sweeps to leave a file alone.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._counts = {}
+
+    @contextmanager
+    def saving(self):
+        with self._lock:
+            yield
+
+    def pin(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            self._counts[path] = self._counts.get(path, 0) + 1
+
+    def release(self, path, discard=False):
+        """Unpins `path`; returns True if it was discarded."""
+        path = os.path.abspath(path)
+        with self._lock:
+            count = self._counts.get(path, 0) - 1
+            if count > 0:
+                self._counts[path] = count
+                return False
+            self._counts.pop(path, None)
+            if not discard:
+                return False
+            try:
+                os.remove(path)
+            except OSError:
+                return False
+            return True
+
+    def __contains__(self, path):
+        with self._lock:
+            return os.path.abspath(path) in self._counts
+
+
+def _run_job(job_id, func, args, kwargs, progress_map):
+    """
+    Entry point inside the worker process.
+    Marks the job as started, then runs `func(*args, progress=..., **kwargs)`.
+    """
+    progress_map[job_id] = 0.0
+
+    def report(fraction):
+        progress_map[job_id] = float(fraction)
+
+    result = func(*args, progress=report, **kwargs)
+    progress_map[job_id] = 1.0
+    return result
+
+
+class WorkoutJobQueue:
+    """
+    Bounded process pool + in-memory job registry.
+
+    Each job record is a dict with: id, status (queued/running/done/failed),
+    progress (0..1), meta (caller-supplied), result, error, created, finished.
+    on_done(job) is called with a snapshot of every finished job record
+    (in the web process, on the pool's callback thread).
+    Input files passed to submit() stay pinned in `pins` while the job
+    is queued or running.
+    """
+
+    def __init__(self, max_workers=WORKOUT_JOB_WORKERS, max_pending=WORKOUT_JOB_MAX_PENDING,
+                 history=WORKOUT_JOB_HISTORY, initializer=None, initargs=(), on_done=None,
+                 pins=None):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.history = max(1, history)
+        # run once in each worker process (e.g. warm the Pose pool)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.on_done = on_done
+        self.pins = pins if pins is not None else InputPins()
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._executor = None
+        self._manager = None
+        self._progress = None
+
+    def _ensure_started(self):
+        # Pool is created lazily so importing the app does not fork workers.
+        # "spawn" keeps MediaPipe/TFLite out of a forked multi-threaded parent.
+        if self._executor is None:
+            ctx = multiprocessing.get_context("spawn")
+            self._manager = ctx.Manager()
+            self._progress = self._manager.dict()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=ctx,
+                initializer=self.initializer,
+                initargs=self.initargs,
+            )
+
+    def _pending_count(self):
+        return sum(1 for j in self._jobs.values() if j["status"] in ("queued", "running"))
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j["status"] in ("done", "failed")]
+        excess = len(finished) - self.history
+        if excess <= 0:
+            return
+        finished.sort(key=lambda j: j["finished"] or 0)
+        for job in finished[:excess]:
+            self._jobs.pop(job["id"], None)
+            self._progress.pop(job["id"], None)
+
+    def submit(self, func, args=(), kwargs=None, meta=None, inputs=(), discard_inputs=False):
+        """
+        Queue `func(*args, progress=cb, **kwargs)` in a worker process and
+        return a job id. `func` must be a picklable module-level function;
+        `meta` is stored on the job record for the status endpoints.
+        `inputs` are pinned until the job ends; with discard_inputs they
+        are then deleted if the job succeeded and its result has a
+        `landmarks_path` (the track is cached) and no other job pins them.
+        Raises JobQueueFull when the queue is at capacity.
+        """
+        with self._lock:
+            self._ensure_started()
+            if self._pending_count() >= self.max_pending:
+                raise JobQueueFull("Too many workouts are being analyzed. Try again shortly.")
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "progress": 0.0,
+                "meta": meta or {},
+                "result": None,
+                "error": None,
+                "created": time.time(),
+                "finished": None,
+                "inputs": list(inputs),
+                "discard_inputs": discard_inputs,
+            }
+            future = self._executor.submit(
+                _run_job, job_id, func, tuple(args), kwargs or {}, self._progress
+            )
+            for path in inputs:
+                self.pins.pin(path)
+
+        future.add_done_callback(lambda f, jid=job_id: self._on_done(jid, f))
+        return job_id
+
+    def _on_done(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            try:
+                job["result"] = future.result()
+                job["status"] = "done"
+                job["progress"] = 1.0
+            except Exception as e:
+                print("Workout job failed:", job_id, e)
+                job["status"] = "failed"
+                job["error"] = str(e) or e.__class__.__name__
+            job["finished"] = time.time()
+            self._prune()
+            snapshot = dict(job)
+
+        result = snapshot["result"]
+        discard = (
+            snapshot["discard_inputs"]
+            and snapshot["status"] == "done"
+            and bool(result and result.get("landmarks_path"))
+        )
+        for path in snapshot["inputs"]:
+            self.pins.release(path, discard=discard)
+
+        if self.on_done is not None:
+            try:
+                self.on_done(snapshot)
+            except Exception as e:
+                print("Warning: workout job callback failed:", job_id, e)
+
+    def get(self, job_id):
+        """Return a snapshot of the job record, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+
+        if snapshot["status"] == "queued" and self._progress is not None:
+            try:
+                fraction = self._progress.get(job_id)
+            except Exception:
+                fraction = None
+            if fraction is not None:
+                snapshot["status"] = "running"
+                snapshot["progress"] = fraction
+        return snapshot
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
+                self._progress = None
+